@@ -1,32 +1,40 @@
 ﻿"""
 Agents包 - 无人机视觉智能Agent系统
+
+包内各类通过模块级 __getattr__ 在首次访问时才导入，
+`import agents` 或导入轻量子模块（model_pool、job_queue等）不会拉起 torch/ultralytics/cv2
 """
 
-# 延迟导入，避免在模块级别失败
-try:
-    from agents.image_multi_angle_generator import ImageMultiAngleGenerator
-except Exception as e:
-    ImageMultiAngleGenerator = None
-    _import_error = str(e)
-
-try:
-    from agents.image_quality_analyzer import ImageQualityAnalyzer
-except Exception as e:
-    ImageQualityAnalyzer = None
-
-try:
-    from agents.material_generator_agent import MaterialGeneratorAgent
-except Exception as e:
-    MaterialGeneratorAgent = None
-
-try:
-    from agents.material_enhancement_trainer import MaterialEnhancementTrainer
-except Exception as e:
-    MaterialEnhancementTrainer = None
-
-__all__ = [
-    'ImageMultiAngleGenerator',
-    'ImageQualityAnalyzer',
-    'MaterialGeneratorAgent',
-    'MaterialEnhancementTrainer'
-]
+import importlib
+
+# 导出名 -> 所在子模块
+_LAZY_EXPORTS = {
+    'ImageMultiAngleGenerator': 'agents.image_multi_angle_generator',
+    'ImageQualityAnalyzer': 'agents.image_quality_analyzer',
+    'MaterialGeneratorAgent': 'agents.material_generator_agent',
+    'MaterialEnhancementTrainer': 'agents.material_enhancement_trainer',
+    'ModelPool': 'agents.model_pool',
+}
+
+_import_error = None
+
+__all__ = list(_LAZY_EXPORTS)
+
+
+def __getattr__(name):
+    """首次访问时导入对应子模块；导入失败时与以前一样返回None"""
+    global _import_error
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'agents' has no attribute '{name}'")
+    try:
+        value = getattr(importlib.import_module(module_name), name)
+    except Exception as e:
+        value = None
+        _import_error = str(e)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
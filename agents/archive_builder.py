@@ -0,0 +1,151 @@
+"""
+素材打包工具
+Material Archive Builder
+
+把生成/增强后的素材打包为ZIP供下载：
+- JPEG/PNG/WebP等已压缩的媒体文件使用ZIP_STORED，不再浪费CPU做deflate
+- 直接在磁盘上写归档，文件内容按块从磁盘流式读取，打包时不在内存中拼装整个ZIP
+- 归档按目录缓存，文件列表、大小和修改时间不变时直接复用，脚本重跑不会重复打包
+- show_archive_download 提供两步式下载：点击“准备下载”后才打包并读取ZIP
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+
+# 已经压缩过的格式，再deflate几乎没有收益
+STORED_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.mp4', '.zip', '.npz'}
+
+# 目录归档默认包含的图片格式
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def _archive_key(entries) -> str:
+    """根据 (归档名, 路径) 列表计算缓存键：包含文件大小和修改时间"""
+    digest = hashlib.sha1()
+    for arcname, path in entries:
+        stat = path.stat()
+        digest.update(f"{arcname}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_archive(file_paths: Iterable[Union[str, Path]], archive_path: Union[str, Path]) -> Optional[Path]:
+    """
+    把文件打包为ZIP（带缓存）
+
+    参数:
+        file_paths: 要打包的文件路径（不存在的文件会被跳过，归档内使用文件名；
+                    不同目录下的同名文件依次加 _1、_2 后缀，重复的同一路径只打包一次）
+        archive_path: ZIP输出路径
+
+    返回:
+        ZIP路径；没有可打包的文件时返回None
+    """
+    archive_path = Path(archive_path)
+    entries = []
+    arcnames = set()
+    added = set()
+    for file_path in file_paths:
+        path = Path(file_path)
+        if not path.is_file() or path.resolve() in added:
+            continue
+        added.add(path.resolve())
+        arcname = path.name
+        index = 1
+        while arcname in arcnames:
+            arcname = f"{path.stem}_{index}{path.suffix}"
+            index += 1
+        arcnames.add(arcname)
+        entries.append((arcname, path))
+    if not entries:
+        return None
+
+    # 缓存键写在ZIP注释中，内容未变化时直接复用已有归档
+    key = _archive_key(entries).encode('ascii')
+    if archive_path.exists():
+        try:
+            with zipfile.ZipFile(archive_path) as existing:
+                if existing.comment == key:
+                    return archive_path
+        except zipfile.BadZipFile:
+            pass
+
+    # 先写临时文件再原子替换，避免多个会话同时打包时读到半成品
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(suffix='.zip.tmp', dir=str(archive_path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            with zipfile.ZipFile(tmp_file, 'w', allowZip64=True) as zip_file:
+                for arcname, path in entries:
+                    compress_type = (zipfile.ZIP_STORED if path.suffix.lower() in STORED_SUFFIXES
+                                     else zipfile.ZIP_DEFLATED)
+                    # ZipFile.write按块从磁盘读取，不会把整个文件读入内存
+                    zip_file.write(path, arcname, compress_type=compress_type)
+                zip_file.comment = key
+        os.replace(tmp_name, archive_path)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    return archive_path
+
+
+def build_directory_archive(directory: Union[str, Path], file_paths: Optional[Iterable[Union[str, Path]]] = None) -> Optional[Path]:
+    """
+    为一次生成/增强的输出目录构建（或复用）下载归档
+
+    归档保存在目录旁边（<目录名>.zip），不会被再次打包进目录本身
+
+    参数:
+        directory: 输出目录
+        file_paths: 要打包的文件，None则打包目录下的所有图片
+    """
+    directory = Path(directory)
+    if file_paths is None:
+        file_paths = sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    return build_archive(file_paths, directory.parent / f"{directory.name}.zip")
+
+
+def show_archive_download(directory: Union[str, Path], file_paths: Optional[Iterable[Union[str, Path]]],
+                          label: str, file_name: str, key: str):
+    """
+    在Streamlit页面中显示两步式ZIP下载
+
+    st.download_button 会把整个ZIP读入内存（由媒体文件管理器持有，每次渲染都会重新读取），
+    所以平时只显示“准备下载”按钮，不检查文件也不打开归档；点击后才打包并显示下载按钮，
+    下载后回到未准备状态，之后的脚本重跑不再读取ZIP
+
+    参数:
+        directory: 输出目录（见 build_directory_archive）
+        file_paths: 要打包的文件，None则打包目录下的所有图片
+        label: 下载按钮文字
+        file_name: 浏览器保存的文件名
+        key: 控件key前缀，同一页面中的多个下载区域需不同
+    """
+    import streamlit as st
+
+    prepared_key = f"{key}_prepared"
+    if st.session_state.get(prepared_key) != str(directory):
+        if not st.button("📦 准备下载（ZIP）", key=f"{key}_prepare", use_container_width=True):
+            return
+        st.session_state[prepared_key] = str(directory)
+
+    archive_path = build_directory_archive(directory, file_paths)
+    if archive_path is None:
+        st.session_state.pop(prepared_key, None)
+        st.warning("没有可下载的文件")
+        return
+    with open(archive_path, 'rb') as archive_file:
+        st.download_button(
+            label=label,
+            data=archive_file,
+            file_name=file_name,
+            mime="application/zip",
+            use_container_width=True,
+            key=f"{key}_download",
+            on_click=lambda: st.session_state.pop(prepared_key, None)
+        )
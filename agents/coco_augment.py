@@ -0,0 +1,313 @@
+"""
+保留标注的COCO数据集几何增强
+Label-Preserving Geometric Augmentation for COCO Datasets
+
+以 labelme_to_coco.py 输出的COCO JSON为输入，为每张图片生成若干增强副本：
+- 变换参数沿用 ImageMultiAngleGenerator._apply_transformation 的视角变换，只记录矩阵
+  （WarpTracker(render=False)），再用整体矩阵一次性完成图片变换，检测框和多边形用同一个矩阵投影
+- 投影后的标注裁剪到图片范围，退化（过小或移出画面）的标注被丢弃
+- 数据集按分片在进程池中并行处理，结果按分片顺序流式写入COCO JSON，
+  图片和标注条目先写入临时片段文件，不在内存中累积整个数据集
+
+每个副本的随机流由 (种子, 图片id, 副本序号) 派生，同一种子的结果完全一致，不需要任何推理
+"""
+
+import json
+import multiprocessing as mp
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from agents.label_export import MIN_BOX_SIZE, polygon_area, project_annotations
+
+# 每个分片处理的源图片数
+DEFAULT_SHARD_SIZE = 32
+# 输出图片的JPEG质量
+AUGMENT_JPEG_QUALITY = 95
+
+_worker_generator = None
+
+
+def _get_generator():
+    """进程内共享一个生成器实例（只用它的变换参数采样，不加载检测模型）"""
+    global _worker_generator
+    if _worker_generator is None:
+        from agents.image_multi_angle_generator import ImageMultiAngleGenerator
+        _worker_generator = ImageMultiAngleGenerator(draw_boxes=False)
+    return _worker_generator
+
+
+def default_augment_transforms() -> List[str]:
+    """可以用单个矩阵描述的视角变换（排除鱼眼等非线性变换）"""
+    from agents.image_multi_angle_generator import NONLINEAR_TRANSFORMS, VIEW_TRANSFORMS
+    return [t for t in VIEW_TRANSFORMS if t not in NONLINEAR_TRANSFORMS]
+
+
+def augment_rng(seed: int, image_id: int, copy_index: int) -> np.random.Generator:
+    """(种子, 图片id, 副本序号) 对应的独立随机流"""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(image_id), copy_index)))
+
+
+def sample_view_matrix(transform_type: str, width: int, height: int,
+                       rng: np.random.Generator) -> Optional[np.ndarray]:
+    """
+    按视角变换采样整体变换矩阵（不执行任何像素操作）
+
+    返回:
+        3x3 矩阵，变换包含非线性映射时返回None
+    """
+    from agents.image_multi_angle_generator import WarpTracker
+    warp = WarpTracker(render=False)
+    # 占位数组不分配内存，render=False 时不会读写像素
+    placeholder = np.broadcast_to(np.zeros((1, 1, 3), dtype=np.uint8), (height, width, 3))
+    _get_generator()._apply_transformation(placeholder, transform_type, height, width, rng=rng, warp=warp)
+    return warp.matrix
+
+
+def _coco_to_shapes(annotations: List[Dict]) -> List[Dict]:
+    """COCO标注转为 project_annotations 使用的格式（xyxy + 多边形），保留其他字段"""
+    shapes = []
+    for ann in annotations:
+        x, y, w, h = ann['bbox']
+        polygon = None
+        segmentation = ann.get('segmentation')
+        # 只处理多边形分割；RLE（iscrowd）只保留检测框
+        if isinstance(segmentation, list) and segmentation and len(segmentation[0]) >= 6:
+            polygon = np.asarray(segmentation[0], dtype=np.float64).reshape(-1, 2).tolist()
+        shapes.append({
+            'category_id': ann['category_id'],
+            'iscrowd': ann.get('iscrowd', 0),
+            'bbox': [x, y, x + w, y + h],
+            'polygon': polygon
+        })
+    return shapes
+
+
+def _shapes_to_coco(shapes: List[Dict]) -> List[Dict]:
+    """投影后的标注转回COCO条目（不含id/image_id，由主进程分配）"""
+    annotations = []
+    for shape in shapes:
+        x1, y1, x2, y2 = shape['bbox']
+        annotation = {
+            'category_id': shape['category_id'],
+            'bbox': [round(x1, 2), round(y1, 2), round(x2 - x1, 2), round(y2 - y1, 2)],
+            'area': round((x2 - x1) * (y2 - y1), 2),
+            'segmentation': [],
+            'iscrowd': shape['iscrowd']
+        }
+        if shape['polygon']:
+            annotation['segmentation'] = [[round(v, 2) for p in shape['polygon'] for v in p]]
+            annotation['area'] = round(polygon_area(shape['polygon']), 2)
+        annotations.append(annotation)
+    return annotations
+
+
+def _augment_shard(task: Dict) -> List[Dict]:
+    """
+    处理一个分片（在worker进程中运行）
+
+    返回:
+        [{'image': 图片条目(不含id), 'annotations': 标注条目列表}]，按 (源图片, 副本) 顺序
+    """
+    from agents.image_backend import get_cv2
+    cv2 = get_cv2()
+    output_images = Path(task['output_dir']) / 'images'
+    results = []
+    for image, annotations in task['items']:
+        image_path = Path(task['image_root']) / image['file_name']
+        img = cv2.imread(str(image_path))
+        if img is None:
+            print(f"⚠️ 无法读取图片，跳过: {image_path}")
+            continue
+        height, width = img.shape[:2]
+        shapes = _coco_to_shapes(annotations)
+        stem = Path(image['file_name']).stem
+        for copy_index in range(task['copies']):
+            rng = augment_rng(task['seed'], image['id'], copy_index)
+            transform_type = task['transforms'][int(rng.integers(len(task['transforms'])))]
+            matrix = sample_view_matrix(transform_type, width, height, rng)
+            if matrix is None:
+                continue
+            warped = cv2.warpPerspective(img, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                         borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            projected = project_annotations(shapes, matrix, width, height, task['min_box_size'])
+            if task['drop_empty'] and shapes and not projected:
+                continue
+
+            file_name = f"{stem}_aug{copy_index:02d}_{transform_type}.jpg"
+            cv2.imwrite(str(output_images / file_name), warped,
+                        [cv2.IMWRITE_JPEG_QUALITY, task['jpeg_quality']])
+            results.append({
+                'image': {
+                    'file_name': f"images/{file_name}",
+                    'width': width,
+                    'height': height,
+                    'source_image_id': image['id'],
+                    'transformation': transform_type,
+                    'transform_matrix': [[round(v, 8) for v in row] for row in matrix.tolist()]
+                },
+                'annotations': _shapes_to_coco(projected)
+            })
+    return results
+
+
+class _FragmentWriter:
+    """把JSON数组的元素逐个追加到临时片段文件（逗号分隔），最后拼接进输出文件"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, item: Dict):
+        if self.count:
+            self._file.write(',\n')
+        self._file.write(json.dumps(item, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def augment_coco_dataset(
+    coco_json: Union[str, Path],
+    output_dir: Union[str, Path],
+    image_root: Optional[Union[str, Path]] = None,
+    copies: int = 10,
+    transformations: Optional[Sequence[str]] = None,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    min_box_size: float = MIN_BOX_SIZE,
+    drop_empty: bool = True,
+    jpeg_quality: int = AUGMENT_JPEG_QUALITY
+) -> Dict:
+    """
+    对COCO数据集做保留标注的几何增强
+
+    参数:
+        coco_json: 输入COCO JSON（如 labelme_to_coco.py 的输出）
+        output_dir: 输出目录，图片写入 images/，标注写入 annotations_augmented.json
+        image_root: 图片根目录（file_name相对于它），None则为COCO JSON所在目录
+        copies: 每张图片生成的增强副本数
+        transformations: 候选视角变换，None则使用全部线性视角变换
+        seed: 随机种子
+        workers: 并行进程数，None则按线程预算的batch预设
+        shard_size: 每个分片的源图片数
+        min_box_size: 投影裁剪后宽或高小于该值（像素）的标注被丢弃
+        drop_empty: 原图有标注但投影后全部被丢弃的副本不输出
+        jpeg_quality: 输出JPEG质量
+
+    返回:
+        {'output_json', 'num_source_images', 'num_images', 'num_annotations'}
+    """
+    from thread_budget import ThreadBudget, init_worker
+
+    coco_json = Path(coco_json)
+    output_dir = Path(output_dir)
+    image_root = Path(image_root) if image_root else coco_json.parent
+    (output_dir / 'images').mkdir(parents=True, exist_ok=True)
+
+    transforms = list(transformations) if transformations else default_augment_transforms()
+    from agents.image_multi_angle_generator import NONLINEAR_TRANSFORMS
+    nonlinear = [t for t in transforms if t in NONLINEAR_TRANSFORMS]
+    if nonlinear:
+        raise ValueError(f"非线性变换无法保留标注: {', '.join(nonlinear)}")
+
+    with open(coco_json, 'r', encoding='utf-8') as f:
+        coco = json.load(f)
+    annotations_by_image = {}
+    for ann in coco.get('annotations', []):
+        annotations_by_image.setdefault(ann['image_id'], []).append(ann)
+    images = coco.get('images', [])
+    # 读入后只保留分片需要的数据
+    items = [(img, annotations_by_image.get(img['id'], [])) for img in images]
+    del annotations_by_image
+
+    budget = ThreadBudget.for_profile('batch', workers=workers)
+    shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+    tasks = ({
+        'items': shard,
+        'image_root': str(image_root),
+        'output_dir': str(output_dir),
+        'copies': copies,
+        'transforms': transforms,
+        'seed': seed,
+        'min_box_size': min_box_size,
+        'drop_empty': drop_empty,
+        'jpeg_quality': jpeg_quality,
+    } for shard in shards)
+    print(f"🔁 增强 {len(images)} 张图片 × {copies} 份，{len(shards)} 个分片，"
+          f"{budget.workers} 进程 × {budget.intra_op_threads} 线程")
+
+    output_json = output_dir / 'annotations_augmented.json'
+    images_writer = _FragmentWriter(output_dir / '.images.part')
+    annotations_writer = _FragmentWriter(output_dir / '.annotations.part')
+    image_id = 0
+    annotation_id = 0
+    try:
+        with ProcessPoolExecutor(
+            max_workers=budget.workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(budget.intra_op_threads,)
+        ) as pool:
+            # 按分片顺序消费结果（id分配稳定），同时最多只有 2×worker 个分片在途
+            pending = deque()
+            done_shards = 0
+            for task in tasks:
+                pending.append(pool.submit(_augment_shard, task))
+                if len(pending) < budget.workers * 2:
+                    continue
+                image_id, annotation_id = _write_shard(
+                    pending.popleft().result(), images_writer, annotations_writer, image_id, annotation_id)
+                done_shards += 1
+                print(f"   分片 {done_shards}/{len(shards)} 完成")
+            while pending:
+                image_id, annotation_id = _write_shard(
+                    pending.popleft().result(), images_writer, annotations_writer, image_id, annotation_id)
+                done_shards += 1
+                print(f"   分片 {done_shards}/{len(shards)} 完成")
+    finally:
+        images_writer.close()
+        annotations_writer.close()
+
+    # 拼接最终的COCO JSON：头部 + 图片片段 + 标注片段 + 类别
+    info = dict(coco.get('info', {}), augmented_from=str(coco_json), augment_seed=seed, augment_copies=copies)
+    tmp_path = output_json.with_name(output_json.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write('{"info": ' + json.dumps(info, ensure_ascii=False) + ',\n"images": [\n')
+        with open(images_writer.path, 'r', encoding='utf-8') as part:
+            shutil.copyfileobj(part, out)
+        out.write('\n],\n"annotations": [\n')
+        with open(annotations_writer.path, 'r', encoding='utf-8') as part:
+            shutil.copyfileobj(part, out)
+        out.write('\n],\n"categories": ' + json.dumps(coco.get('categories', []), ensure_ascii=False) + '}\n')
+    os.replace(tmp_path, output_json)
+    images_writer.path.unlink()
+    annotations_writer.path.unlink()
+
+    print(f"✅ 增强完成: {image_id} 张图片, {annotation_id} 个标注 -> {output_json}")
+    return {
+        'output_json': str(output_json),
+        'num_source_images': len(images),
+        'num_images': image_id,
+        'num_annotations': annotation_id
+    }
+
+
+def _write_shard(results: List[Dict], images_writer: _FragmentWriter, annotations_writer: _FragmentWriter,
+                 image_id: int, annotation_id: int) -> tuple:
+    """为一个分片的结果分配id并写入片段文件"""
+    for item in results:
+        image_id += 1
+        images_writer.write(dict(item['image'], id=image_id))
+        for ann in item['annotations']:
+            annotation_id += 1
+            annotations_writer.write(dict(ann, id=annotation_id, image_id=image_id))
+    return image_id, annotation_id
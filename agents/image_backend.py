@@ -0,0 +1,119 @@
+"""
+图片处理后端
+Image Backend
+
+每个进程只解析一次OpenCV/PIL后端：
+- 导入前统一设置headless相关环境变量（OpenCL关闭、无显示、软件GL）
+- 加载OpenCV时只在首次导入时屏蔽libGL警告，之后直接返回缓存的模块
+- 显式配置 cv2.setUseOptimized / cv2.setNumThreads
+- 通过 capabilities() 提供能力标志，调用方据此选择OpenCV或PIL路径
+"""
+
+import contextlib
+import io
+import os
+import threading
+import warnings
+from typing import Dict
+
+
+def prepare_environment():
+    """设置headless环境变量并从LD_LIBRARY_PATH中去掉libGL/mesa（必须在导入cv2/ultralytics前调用）"""
+    os.environ['OPENCV_DISABLE_OPENCL'] = '1'
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    os.environ['DISPLAY'] = ''
+    os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+    if 'LD_LIBRARY_PATH' in os.environ:
+        paths = os.environ['LD_LIBRARY_PATH'].split(':')
+        paths = [p for p in paths if 'libGL' not in p and 'mesa' not in p.lower()]
+        os.environ['LD_LIBRARY_PATH'] = ':'.join(paths)
+
+
+prepare_environment()
+
+# OpenCV内部线程数：环境变量 CV2_NUM_THREADS，默认使用全部CPU
+CV2_NUM_THREADS = int(os.environ.get('CV2_NUM_THREADS', os.cpu_count() or 1))
+
+_lock = threading.Lock()
+_resolved = False
+_cv2 = None
+
+
+def _load_cv2():
+    """导入并配置OpenCV，失败时返回None"""
+    try:
+        # 只在首次导入时屏蔽libGL相关的警告和stderr输出
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with contextlib.redirect_stderr(io.StringIO()):
+                import cv2
+    except Exception as e:
+        print(f"⚠️ OpenCV 不可用，将使用PIL降级方案: {e}")
+        return None
+
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(CV2_NUM_THREADS)
+    try:
+        cv2.ocl.setUseOpenCL(False)
+    except Exception:
+        pass
+    print(f"✅ OpenCV {cv2.__version__} 加载成功（线程数: {cv2.getNumThreads()}）")
+    return cv2
+
+
+def get_cv2():
+    """
+    获取OpenCV模块（进程内只解析一次）
+
+    返回:
+        cv2模块，OpenCV不可用时返回None
+    """
+    global _resolved, _cv2
+    if not _resolved:
+        with _lock:
+            if not _resolved:
+                _cv2 = _load_cv2()
+                _resolved = True
+    return _cv2
+
+
+def has_cv2() -> bool:
+    """OpenCV是否可用"""
+    return get_cv2() is not None
+
+
+def set_cv2_threads(num_threads: int):
+    """
+    调整OpenCV内部线程数（进程池的每个worker中通常设为1，避免线程超订）
+
+    参数:
+        num_threads: 线程数；0表示禁用OpenCV内部并行
+    """
+    global CV2_NUM_THREADS
+    CV2_NUM_THREADS = num_threads
+    cv2 = get_cv2()
+    if cv2 is not None:
+        cv2.setNumThreads(num_threads)
+
+
+def capabilities() -> Dict:
+    """
+    当前进程的图片后端能力
+
+    返回:
+        {'backend': 'opencv'/'pil', 'cv2': bool, 'cv2_version', 'cv2_optimized', 'cv2_threads', 'pil_webp'}
+    """
+    cv2 = get_cv2()
+    try:
+        from PIL import features
+        pil_webp = bool(features.check('webp'))
+    except Exception:
+        pil_webp = False
+    return {
+        'backend': 'opencv' if cv2 is not None else 'pil',
+        'cv2': cv2 is not None,
+        'cv2_version': cv2.__version__ if cv2 is not None else None,
+        'cv2_optimized': bool(cv2.useOptimized()) if cv2 is not None else False,
+        'cv2_threads': cv2.getNumThreads() if cv2 is not None else 0,
+        'pil_webp': pil_webp,
+    }
@@ -0,0 +1,140 @@
+"""
+上传图片内存解码
+Upload Ingestion
+
+把 st.file_uploader 上传的字节直接解码为BGR数组，交给分析器的数组接口，
+不再为每张上传图片写入/删除临时文件；同时保留原始编码字节数，供"图片数据量"维度使用
+
+分析只需要约1024px的图片（YOLO内部还会缩放到640），JPEG可以在解码时按1/2、1/4、1/8
+直接缩小（DCT缩放：cv2.IMREAD_REDUCED_COLOR_*，PIL降级时用 draft()），不解码全分辨率像素；
+全分辨率尺寸从文件头读取，"图片数据量"等按原图尺寸计算的维度不受影响
+"""
+
+import io
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from agents.image_backend import get_cv2
+
+# 分析用的目标尺寸：缩小解码后最长边不小于该值（环境变量 ANALYSIS_MAX_SIDE，0表示始终全分辨率解码）
+ANALYSIS_MAX_SIDE = int(os.environ.get('ANALYSIS_MAX_SIDE', 1024))
+# 缩小倍数 -> OpenCV读取标志名
+_REDUCED_FLAGS = ((8, 'IMREAD_REDUCED_COLOR_8'), (4, 'IMREAD_REDUCED_COLOR_4'), (2, 'IMREAD_REDUCED_COLOR_2'))
+
+
+def probe_image(source: Union[str, Path, bytes]) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    """
+    只读取文件头，获得图片格式和全分辨率尺寸
+
+    参数:
+        source: 图片路径或编码字节
+
+    返回:
+        (格式如 'JPEG', (宽, 高))，无法识别时返回 (None, None)
+    """
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            return img.format, img.size
+    except Exception:
+        return None, None
+
+
+def reduction_factor(width: int, height: int, target_side: Optional[int]) -> int:
+    """缩小后最长边仍不小于target_side的最大倍数（8/4/2），不能缩小时返回1"""
+    if not target_side:
+        return 1
+    for factor, _ in _REDUCED_FLAGS:
+        if max(width, height) // factor >= target_side:
+            return factor
+    return 1
+
+
+def _decode(source: Union[str, bytes], factor: int) -> Optional[np.ndarray]:
+    """按倍数缩小解码（factor=1为全分辨率），OpenCV失败时使用PIL"""
+    cv2 = get_cv2()
+    if cv2 is not None:
+        flag = cv2.IMREAD_COLOR
+        if factor > 1:
+            flag = getattr(cv2, dict(_REDUCED_FLAGS)[factor])
+        if isinstance(source, bytes):
+            img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+        else:
+            img = cv2.imread(source, flag)
+        if img is not None:
+            return img
+    # OpenCV不可用或解码失败时使用PIL
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as pil_img:
+            if factor > 1:
+                # draft只对JPEG生效，按不小于请求尺寸的最大DCT缩放解码
+                pil_img.draft('RGB', (pil_img.width // factor, pil_img.height // factor))
+            return np.ascontiguousarray(np.asarray(pil_img.convert("RGB"))[:, :, ::-1])
+    except Exception:
+        return None
+
+
+def decode_reduced(source: Union[str, Path, bytes],
+                   target_side: Optional[int] = ANALYSIS_MAX_SIDE) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int]]]:
+    """
+    为分析解码图片：JPEG在目标尺寸允许时直接按1/2、1/4、1/8缩小解码，其他格式全分辨率解码
+
+    参数:
+        source: 图片路径或编码字节
+        target_side: 分析需要的最长边；None或0表示全分辨率解码
+
+    返回:
+        (BGR数组, 全分辨率尺寸 (宽, 高))，无法解码时数组为None
+    """
+    if isinstance(source, Path):
+        source = str(source)
+    fmt, full_size = probe_image(source)
+    factor = reduction_factor(*full_size, target_side) if fmt == 'JPEG' else 1
+    img = _decode(source, factor)
+    if img is not None and full_size is None:
+        full_size = (img.shape[1], img.shape[0])
+    return img, full_size
+
+
+def decode_image_bytes(data: bytes) -> Optional[np.ndarray]:
+    """
+    把编码后的图片字节解码为BGR数组
+
+    参数:
+        data: JPEG/PNG等编码字节
+
+    返回:
+        BGR数组（uint8, HxWx3），无法解码时返回None
+    """
+    return _decode(data, 1)
+
+
+def decode_uploads(uploaded_files: Iterable, target_side: Optional[int] = None) -> List[Dict]:
+    """
+    解码一批上传文件
+
+    参数:
+        uploaded_files: st.file_uploader 返回的文件对象（需支持 getvalue() 和 name）
+        target_side: 只用于分析时传入 ANALYSIS_MAX_SIDE，JPEG按缩小尺寸解码；None为全分辨率
+
+    返回:
+        图片记录列表 [{'image_path': 文件名, 'image': BGR数组, 'file_size': 原始字节数,
+        'full_size': 全分辨率 (宽, 高)}]，无法解码的文件会被跳过；记录可直接传给 ImageQualityAnalyzer.analyze_batch
+    """
+    records = []
+    for uploaded_file in uploaded_files:
+        data = uploaded_file.getvalue()
+        img, full_size = decode_reduced(data, target_side)
+        if img is None:
+            print(f"⚠️ 无法解码上传图片: {uploaded_file.name}")
+            continue
+        records.append({
+            'image_path': uploaded_file.name,
+            'image': img,
+            'file_size': len(data),
+            'full_size': full_size
+        })
+    return records
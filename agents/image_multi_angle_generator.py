@@ -3,140 +3,204 @@
 支持真正的无人机3D视角变换，并绘制YOLO检测框
 """
 
-# ========== 关键：在导入任何模块前设置环境变量并拦截libGL加载 ==========
-import os
-import sys
-
-# 必须在导入numpy等之前设置环境变量
-os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-os.environ['DISPLAY'] = ''
-os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-
-# 阻止加载libGL - 清理LD_LIBRARY_PATH
-if 'LD_LIBRARY_PATH' in os.environ:
-    paths = os.environ['LD_LIBRARY_PATH'].split(':')
-    paths = [p for p in paths if 'libGL' not in p and 'mesa' not in p.lower()]
-    os.environ['LD_LIBRARY_PATH'] = ':'.join(paths)
-
-# 使用ctypes拦截dlopen，阻止加载libGL.so.1
-try:
-    import ctypes
-    import ctypes.util
-    
-    # 获取系统的dlopen函数
-    if sys.platform.startswith('linux'):
-        libdl = ctypes.CDLL('libdl.so.2')
-        dlopen = libdl.dlopen
-        dlopen.argtypes = [ctypes.c_char_p, ctypes.c_int]
-        dlopen.restype = ctypes.c_void_p
-        
-        # 保存原始的dlopen
-        _original_dlopen = dlopen
-        
-        # 创建拦截函数
-        def _intercept_dlopen(filename, flag):
-            if filename:
-                filename_str = filename.decode('utf-8', errors='ignore') if isinstance(filename, bytes) else str(filename)
-                # 如果尝试加载libGL，返回None（失败但不报错）
-                if 'libGL' in filename_str or 'libGL.so' in filename_str:
-                    print(f"⚠️ 拦截libGL加载: {filename_str}")
-                    return None  # 返回NULL，但不抛出异常
-            # 其他库正常加载
-            return _original_dlopen(filename, flag)
-        
-        # 替换dlopen（注意：这需要更复杂的实现，暂时注释）
-        # libdl.dlopen = _intercept_dlopen
-except:
-    pass
+# 导入图片后端时会先设置headless环境变量，必须在导入numpy/ultralytics之前
+from agents.image_backend import get_cv2
 
 import numpy as np
-
-# 延迟导入 OpenCV，避免在模块级别失败
-_cv2_available = None
-_cv2 = None
-
-def _get_cv2():
-    """延迟导入 OpenCV，强制使用 headless 模式，完全阻止libGL加载"""
-    global _cv2_available, _cv2
-    if _cv2_available is None:
-        try:
-            # 再次确保环境变量已设置
-            import os
-            os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-            os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-            os.environ['DISPLAY'] = ''
-            os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-            
-            # 使用subprocess设置环境变量后导入（更彻底的方法）
-            import subprocess
-            import sys
-            
-            # 在Linux上，使用LD_PRELOAD来阻止libGL加载
-            # 但更简单的方法是：直接导入并捕获错误，然后忽略
-            try:
-                # 临时重定向stderr以捕获libGL错误
-                import io
-                import contextlib
-                
-                # 创建一个假的libGL.so.1模块
-                class FakeLibGL:
-                    pass
-                
-                # 在导入cv2前，拦截ImportError
-                with contextlib.redirect_stderr(io.StringIO()):
-                    import cv2
-                    # 测试基本功能
-                    _ = cv2.__version__
-                    _cv2 = cv2
-                    _cv2_available = True
-                    print("✅ OpenCV 加载成功（已忽略libGL警告）")
-            except Exception as e:
-                error_str = str(e)
-                # 如果是libGL错误，强制继续使用
-                if 'libGL' in error_str or 'libGL.so' in error_str:
-                    # 直接导入，忽略错误
-                    import warnings
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        try:
-                            import cv2
-                            _cv2 = cv2
-                            _cv2_available = True
-                            print("✅ OpenCV 加载成功（强制忽略libGL错误）")
-                        except:
-                            # 如果还是失败，使用PIL降级
-                            _cv2_available = False
-                            print("⚠️ OpenCV无法加载，将使用PIL降级方案")
-                else:
-                    raise
-        except Exception as e:
-            print(f"❌ OpenCV 导入失败: {e}")
-            _cv2_available = False
-    return _cv2 if _cv2_available else None
 from PIL import Image, ImageDraw, ImageFont
 from pathlib import Path
-from typing import List, Dict, Optional
-import random
-import time
+from typing import Callable, List, Dict, Optional
 from datetime import datetime
-import math
+import hashlib
+import json
+import os
 import torch
 
+from agents.preview_cache import write_preview
+from agents.detections import (
+    class_colors, draw_detections, empty_detections, extract_detections, load_detection_sidecar,
+    records_to_arrays, render_overlay, save_detection_sidecar, to_records
+)
+from agents.label_export import DEFAULT_LABEL_CONF, export_labels
+from agents.remap_tables import apply_lens
+from agents.output_writer import EncodeOptions, OutputWriter
+from agents.tiling import DetectionMerger, TileReader, should_tile, warp_tiled
+
+# 任务种子派生的随机流：PLAN_STREAM 决定变换方案，视角i使用 spawn_key=(i,)
+PLAN_STREAM = 0
+
+
+def new_job_seed() -> int:
+    """生成新的任务种子（来自系统熵源，不影响全局随机状态）"""
+    return int(np.random.SeedSequence().generate_state(1, dtype=np.uint64)[0]) >> 1
+
+
+def view_rng(seed: int, view_index: int) -> np.random.Generator:
+    """
+    任务种子派生出的第view_index个视角的独立随机流
+
+    等价于 SeedSequence(seed).spawn(...) 的第view_index个子序列，
+    可以单独构造，不需要先渲染前面的视角
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(view_index,)))
+
+
+# 生成缓存：输出目录下记录 视角键 -> 视角元数据，任务键 -> 元数据JSON
+GENERATION_CACHE_FILE = ".generation_cache.json"
+
+# 感知哈希（64位dHash）汉明距离不超过该值的视角视为近似重复
+DEDUP_THRESHOLD = 4
+
+# 检测的默认NMS IoU阈值；生成视角时按视角序号在0.4-0.5之间取值（见 _view_iou_threshold）
+DETECT_IOU = 0.45
+
+
+def file_content_hash(path) -> str:
+    """文件内容的SHA1（按块读取）"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def seed_from_hash(content_hash: str) -> int:
+    """由内容哈希得到确定的任务种子，同一张图片重复上传时得到相同的种子"""
+    return int(content_hash[:15], 16)
+
+
+def _cache_key(*parts) -> str:
+    return hashlib.sha1("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def perceptual_hash(img: np.ndarray) -> int:
+    """64位差值哈希（dHash）：缩小到9x8灰度图后比较相邻像素"""
+    cv2 = get_cv2()
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _output_stat(path) -> Dict:
+    """输出文件的大小和修改时间（记录在视角元数据中，复用前核对）"""
+    stat = os.stat(path)
+    return {'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _output_unchanged(view: Dict) -> bool:
+    """视角输出文件是否仍是当时写出的那个文件（存在且大小、修改时间一致）"""
+    if 'file_size' not in view or 'mtime_ns' not in view:
+        return False
+    try:
+        return _output_stat(view['generated_path']) == {'file_size': view['file_size'], 'mtime_ns': view['mtime_ns']}
+    except OSError:
+        return False
+
+
+def _load_generation_cache(output_path: Path) -> Dict:
+    cache_file = output_path / GENERATION_CACHE_FILE
+    if cache_file.exists():
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            cache.setdefault('jobs', {})
+            cache.setdefault('views', {})
+            return cache
+        except (OSError, ValueError):
+            pass
+    return {'jobs': {}, 'views': {}}
+
+
+def _save_generation_cache(output_path: Path, cache: Dict):
+    """先写临时文件再替换，避免并发任务读到半个JSON"""
+    cache_file = output_path / GENERATION_CACHE_FILE
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
 # 延迟导入 YOLO，确保环境变量已设置
 # 注意：YOLO在导入时会导入cv2，所以必须在环境变量设置后导入
 _YOLO = None
+# 真正的无人机视角变换列表
+VIEW_TRANSFORMS = (
+    'top_down_90', 'top_down_60', 'top_down_45',
+    'low_angle_30', 'low_angle_45',
+    'side_view_left', 'side_view_right',
+    'oblique_30', 'oblique_45', 'oblique_60',
+    'bird_eye', 'worm_eye',
+    'diagonal_up', 'diagonal_down',
+    'tilt_left', 'tilt_right',
+    'panoramic_wide', 'panoramic_narrow',
+    'zoom_extreme', 'rotate_3d_45', 'rotate_3d_90',
+    'perspective_strong', 'fisheye_effect', 'original'
+)
+# 镜头模拟变换（需通过 transformations 显式选择）-> 映射表类型，见 agents.remap_tables
+LENS_TRANSFORMS = {
+    'barrel_distortion': 'barrel',
+    'pincushion_distortion': 'pincushion',
+    'cylindrical_panorama': 'cylindrical',
+}
+# 包含非线性映射（remap）、无法用单个矩阵描述的变换
+NONLINEAR_TRANSFORMS = ('fisheye_effect',) + tuple(LENS_TRANSFORMS)
+
+
+class WarpTracker:
+    """
+    执行透视/仿射变换并累计整体变换矩阵（3x3，原图坐标 -> 视角坐标）
+
+    视角由若干次 warpPerspective/warpAffine 组成，整体矩阵是各次矩阵的乘积，
+    用于把原图的真值标注投影到视角上；经过 remap 等非线性变换后矩阵不再精确，matrix 返回None。
+    render=False 时只记录矩阵、不执行变换，调用方可以用整体矩阵一次性完成变换
+    """
+
+    def __init__(self, render: bool = True):
+        self._matrix = np.eye(3)
+        self.exact = True
+        self.render = render
+
+    @property
+    def matrix(self) -> Optional[np.ndarray]:
+        return self._matrix if self.exact else None
+
+    def perspective(self, img: np.ndarray, M: np.ndarray, dsize: tuple, **kwargs) -> np.ndarray:
+        self._matrix = np.asarray(M, dtype=np.float64) @ self._matrix
+        if not self.render:
+            return img
+        return get_cv2().warpPerspective(img, M, dsize, **kwargs)
+
+    def affine(self, img: np.ndarray, M: np.ndarray, dsize: tuple, **kwargs) -> np.ndarray:
+        self._matrix = np.vstack([np.asarray(M, dtype=np.float64), [0.0, 0.0, 1.0]]) @ self._matrix
+        if not self.render:
+            return img
+        return get_cv2().warpAffine(img, M, dsize, **kwargs)
+
+    def remap(self, img: np.ndarray, map_x: np.ndarray, map_y: np.ndarray, interpolation: int,
+              **kwargs) -> np.ndarray:
+        self.exact = False
+        if not self.render:
+            return img
+        return get_cv2().remap(img, map_x, map_y, interpolation, **kwargs)
+
+    def lens(self, img: np.ndarray, kind: str, params: Dict[str, float],
+             pre_homography: Optional[np.ndarray] = None, **kwargs) -> np.ndarray:
+        """缓存映射表的镜头变换（可合并前面的透视变换），见 agents.remap_tables.apply_lens"""
+        self.exact = False
+        if not self.render:
+            return img
+        return apply_lens(img, kind, params, pre_homography=pre_homography, **kwargs)
+
+
 def _get_yolo():
     """延迟导入 YOLO，确保环境变量已设置"""
     global _YOLO
     if _YOLO is None:
         try:
-            # 再次确保环境变量已设置（防止ultralytics导入cv2时出错）
-            os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-            os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-            os.environ['DISPLAY'] = ''
-            os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-            
             from ultralytics import YOLO as _YOLO_CLS
             _YOLO = _YOLO_CLS
         except Exception as e:
@@ -155,7 +219,7 @@ class ImageMultiAngleGenerator:
         
         参数:
             yolo_model_path: YOLO模型路径，None则使用默认模型
-            draw_boxes: 是否绘制检测框
+            draw_boxes: 界面默认是否叠加检测框（检测框不再画进保存的图片，见 render_view_overlay）
         """
         self.supported_formats = {'.jpg', '.jpeg', '.png', '.bmp'}
         self.draw_boxes = draw_boxes
@@ -186,21 +250,19 @@ class ImageMultiAngleGenerator:
 
     def _generate_colors(self, num_colors: int) -> List[tuple]:
         """生成不同颜色用于不同类别"""
-        colors = []
-        np.random.seed(42)  # 固定随机种子，确保颜色一致
-        for i in range(num_colors):
-            color = tuple(np.random.randint(0, 255, 3).tolist())
-            colors.append(color)
-        return colors
+        return class_colors(num_colors)
     
     def _generate_with_pil_fallback(
         self,
         input_image_path: str,
         output_dir: str,
         num_generations: int = 8,
-        transformations: List[str] = None
+        transformations: List[str] = None,
+        seed: Optional[int] = None
     ) -> Dict:
         """使用 PIL 降级方案生成图片（当 OpenCV 不可用时）"""
+        if seed is None:
+            seed = new_job_seed()
         input_path = Path(input_image_path)
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
@@ -218,7 +280,9 @@ class ImageMultiAngleGenerator:
             transformations = ['original', 'rotate_90', 'rotate_180', 'rotate_270', 
                              'flip_horizontal', 'flip_vertical', 'crop_center', 'resize']
         
-        selected_transforms = random.sample(transformations, min(num_generations, len(transformations)))
+        plan_rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PLAN_STREAM,)))
+        selected_transforms = [str(t) for t in plan_rng.choice(
+            transformations, min(num_generations, len(transformations)), replace=False)]
         
         generated_files = []
         metadata = []
@@ -251,10 +315,12 @@ class ImageMultiAngleGenerator:
                 output_filename = f"generated_{idx:03d}_{transform_type}.jpg"
                 output_file = output_path / output_filename
                 transformed_img.save(str(output_file), 'JPEG', quality=95)
+                write_preview(np.asarray(transformed_img.convert('RGB'))[:, :, ::-1], output_file)
                 
                 generated_files.append(str(output_file))
                 metadata.append({
                     'index': idx,
+                    'seed': seed,
                     'transform_type': transform_type,
                     'file_path': str(output_file)
                 })
@@ -267,6 +333,7 @@ class ImageMultiAngleGenerator:
             'num_generated': len(generated_files),
             'generated_files': generated_files,
             'metadata': metadata,
+            'seed': seed,
             'confidence_statistics': {}
         }
 
@@ -275,51 +342,58 @@ class ImageMultiAngleGenerator:
         input_image_path: str,
         output_dir: str,
         num_generations: int = 8,
-        transformations: List[str] = None
+        transformations: List[str] = None,
+        draw_boxes: Optional[bool] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        seed: Optional[int] = None,
+        skip_existing: bool = False,
+        dedup_threshold: Optional[int] = DEDUP_THRESHOLD,
+        detect: bool = True,
+        export_format: Optional[str] = None,
+        label_conf_threshold: float = DEFAULT_LABEL_CONF,
+        ground_truth: Optional[str] = None,
+        tiled: Optional[bool] = None,
+        encode_options: Optional[EncodeOptions] = None
     ) -> Dict:
         """
         从单张图片生成多角度素材（真正的3D视角变换 + 检测框）
+
+        保存的视角始终是干净的图片，detect=True时检测结果写入同目录的 detections_*.npz
+        附属文件（元数据中也保留每个视角的检测记录），检测框由 render_view_overlay 按需叠加，
+        所以带框和不带框的展示共用同一次生成。draw_boxes只记录界面默认是否叠加检测框，
+        为None时使用实例的设置，不影响输出和缓存。progress_callback(已完成数, 总数)
+        在每个视角开始前调用，抛出异常即可中止生成。
+
+        seed为任务级随机种子（None则随机生成），变换方案和每个视角的参数都由它派生的
+        独立随机流决定，不读写全局random/np.random；种子记录在元数据JSON中，
+        可以用 render_view 单独重新渲染任意视角。
+
+        skip_existing=True时按 (输入内容哈希, 变换, 种子, 是否检测, 模型) 复用输出目录中
+        已经生成过的视角；整个任务都生成过时直接返回缓存的元数据。缓存查找在解码原图之前进行，
+        所有视角都可复用时不解码原图。输出文件名带视角键/任务键前缀，不同参数的任务不会互相覆盖；
+        复用前核对文件大小和修改时间，被改写或替换的文件会重新生成。被去重丢弃的视角同样记录在缓存中，
+        重跑时不再重新渲染。
+        dedup_threshold为感知哈希的汉明距离阈值，与已保留视角近似重复的视角会被丢弃，None表示不去重
+
+        export_format为 'coco'/'yolo' 时在生成后直接导出标注（见 agents.label_export.export_labels）：
+        原图有真值标注（ground_truth，或原图旁边同名的 .json/.txt）时按每个视角的整体变换矩阵投影，
+        否则用置信度不低于 label_conf_threshold 的检测结果作为伪标签
+
+        tiled=True时使用分块模式（超大正射影像，见 agents.tiling），None时按文件头中的像素数自动选择：
+        每个视角按输出块逐块变换并写入磁盘画布，检测逐块进行后跨块NMS合并，峰值内存由块大小决定。
+        分块模式只支持可用单个矩阵描述的视角，非线性视角（鱼眼、镜头畸变）会被跳过
+
+        encode_options为输出编码参数（格式、质量、optimize/progressive、色度抽样，见 agents.output_writer），
+        默认JPEG质量95。视角在编码线程池中并行写出，每个视角的写入字节数和编码耗时记录在元数据的 output 字段
         """
-        # 延迟导入 OpenCV - 使用更激进的方法阻止libGL错误
-        import warnings
-        import io
-        import contextlib
-        
-        # 完全忽略所有警告和错误
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            with contextlib.redirect_stderr(io.StringIO()):
-                cv2 = _get_cv2()
-                if cv2 is None:
-                    # 强制导入，完全忽略libGL错误
-                    try:
-                        import os
-                        os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-                        os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-                        os.environ['DISPLAY'] = ''
-                        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-                        
-                        # 直接导入，不捕获任何错误
-                        import cv2
-                        print("✅ OpenCV 在方法内成功加载（强制模式）")
-                    except ImportError as e:
-                        # ImportError不应该发生，因为opencv-python-headless已安装
-                        raise RuntimeError(f"OpenCV 未安装: {e}")
-                    except Exception as e:
-                        error_str = str(e)
-                        # 如果是libGL错误，强制继续
-                        if 'libGL' in error_str or 'libGL.so' in error_str:
-                            # 完全忽略错误，强制导入
-                            import sys
-                            old_stderr = sys.stderr
-                            sys.stderr = io.StringIO()
-                            try:
-                                import cv2
-                                print("✅ OpenCV 加载成功（已忽略libGL错误）")
-                            finally:
-                                sys.stderr = old_stderr
-                        else:
-                            raise RuntimeError(f"OpenCV 加载失败: {e}")
+        if draw_boxes is None:
+            draw_boxes = self.draw_boxes
+        if seed is None:
+            seed = new_job_seed()
+        cv2 = get_cv2()
+        if cv2 is None:
+            # OpenCV不可用时使用PIL降级方案
+            return self._generate_with_pil_fallback(input_image_path, output_dir, num_generations, transformations, seed=seed)
         
         input_path = Path(input_image_path)
         output_path = Path(output_dir)
@@ -328,27 +402,37 @@ class ImageMultiAngleGenerator:
         if not input_path.exists():
             raise FileNotFoundError(f"输入图片不存在: {input_image_path}")
 
-        img = cv2.imread(str(input_path))
-        if img is None:
-            pil_img = Image.open(input_path)
-            img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+        if tiled is None:
+            tiled = should_tile(input_path)
+        # 原图在第一个需要渲染的视角之前才解码（见 _load_source），全部命中缓存时不解码
+        img = None
+        reader = None
+        source_size = None
 
-        h, w = img.shape[:2]
+        input_hash = file_content_hash(input_path)
+        model_id = Path(self.yolo_model_path).name if self.yolo_model_path else 'yolov8n.pt'
+        model_id = model_id if detect else None
+        cache = _load_generation_cache(output_path)
+        # 分块模式的渲染与整图模式不同（无差异兜底变换），缓存键中区分；非默认的编码参数同样区分
+        encode_options = encode_options or EncodeOptions()
+        mode = ('tiled',) if tiled else ()
+        if encode_options.to_dict() != EncodeOptions().to_dict():
+            mode += (json.dumps(encode_options.to_dict(), sort_keys=True),)
+        job_key = _cache_key(input_hash, seed, detect, model_id, num_generations, transformations, dedup_threshold,
+                             *mode)
+        if skip_existing:
+            cached_result = self._load_cached_result(cache.get('jobs', {}).get(job_key), job_key)
+            if cached_result is not None:
+                print(f"♻️ 复用已生成的素材: {cached_result['metadata_file']}")
+                if export_format:
+                    cached_result['labels'] = export_labels(
+                        cached_result['metadata_file'], export_format,
+                        conf_threshold=label_conf_threshold, ground_truth=ground_truth)
+                return cached_result
 
         # 真正的无人机视角变换列表
         if transformations is None:
-            transformations = [
-                'top_down_90', 'top_down_60', 'top_down_45',
-                'low_angle_30', 'low_angle_45',
-                'side_view_left', 'side_view_right',
-                'oblique_30', 'oblique_45', 'oblique_60',
-                'bird_eye', 'worm_eye',
-                'diagonal_up', 'diagonal_down',
-                'tilt_left', 'tilt_right',
-                'panoramic_wide', 'panoramic_narrow',
-                'zoom_extreme', 'rotate_3d_45', 'rotate_3d_90',
-                'perspective_strong', 'fisheye_effect', 'original'
-            ]
+            transformations = list(VIEW_TRANSFORMS)
 
         # 极端变换在实际素材中过于失真，这里默认关闭
         extreme_transforms = []
@@ -356,122 +440,133 @@ class ImageMultiAngleGenerator:
         # 合并所有变换类型
         all_transforms = transformations + extreme_transforms
         
-        # 强制选择不同的变换，确保每个都不同
-        if num_generations > len(all_transforms):
-            selected_transforms = all_transforms.copy()
-            # 重复使用但添加唯一标识
-            for i in range(num_generations - len(all_transforms)):
-                base = random.choice(all_transforms)
-                selected_transforms.append(f"{base}_unique_{i}")
-        else:
-            selected_transforms = random.sample(all_transforms, num_generations)
-        
-        # 强制打乱，确保顺序随机
-        random.shuffle(selected_transforms)
+        selected_transforms = self._plan_transforms(all_transforms, num_generations, seed)
 
         generated_files = []
         metadata = []
         all_detections = []  # 存储所有检测结果用于统计
+        view_detections = {}  # 视角文件名 -> 检测数组，写入附属文件
+        kept_hashes = []  # 已保留视角的感知哈希
+        dropped_duplicates = []
+        num_reused = 0
 
-        for idx, transform_type in enumerate(selected_transforms, 1):
-            try:
-                # 为每次变换生成唯一的随机种子，确保每次变换都不同
-                # 使用更激进的随机种子生成（基于时间、索引、哈希）
-                seed_base = int(time.time() * 1000000) + idx * 10000 + hash(transform_type) % 100000 + random.randint(1, 1000000)
-                random.seed(seed_base)
-                np.random.seed(seed_base % 2**32)
-                
-                # 传递索引作为额外随机因子，并添加时间戳确保唯一性
-                random_factor = idx * 10000 + int(time.time() * 1000) % 100000 + hash(transform_type) % 10000
-                
-                # 强制应用变换（不使用copy，直接变换）
-                transformed_img = self._apply_transformation(img, transform_type, h, w, random_factor=random_factor)
-                
-                cv2 = _get_cv2()
-                if cv2 is not None and transformed_img.shape == img.shape:
-                    diff = np.abs(transformed_img.astype(np.float32) - img.astype(np.float32))
-                    mean_diff = np.mean(diff)
-                    if mean_diff < 6.0:
-                        center = (w // 2, h // 2)
-                        angle = random.uniform(-15, 15)
-                        scale = random.uniform(0.95, 1.05)
-                        M = cv2.getRotationMatrix2D(center, angle, scale)
-                        transformed_img = cv2.warpAffine(
-                            transformed_img, M, (w, h),
-                            borderMode=cv2.BORDER_REFLECT
-                        )
-                        tx = random.uniform(-w * 0.05, w * 0.05)
-                        ty = random.uniform(-h * 0.05, h * 0.05)
-                        M[0, 2] += tx
-                        M[1, 2] += ty
-                        transformed_img = cv2.warpAffine(
-                            transformed_img, M, (w, h),
-                            borderMode=cv2.BORDER_REFLECT
-                        )
+        writer = OutputWriter(encode_options)
+        try:
+            for idx, transform_type in enumerate(selected_transforms, 1):
+                if progress_callback:
+                    progress_callback(idx - 1, len(selected_transforms))
+                view_key = _cache_key(input_hash, transform_type, seed, idx, detect, model_id, *mode)
+                cached_view = cache['views'].get(view_key) if skip_existing else None
+                if cached_view and cached_view.get('duplicate'):
+                    # 上次被去重丢弃的视角：与本次已保留的视角仍然近似重复时直接跳过，不重新渲染
+                    phash = int(cached_view['phash'], 16)
+                    if dedup_threshold is not None and any(
+                            hamming_distance(phash, kept) <= dedup_threshold for kept in kept_hashes):
+                        dropped_duplicates.append({'index': idx, 'transformation': transform_type})
+                        continue
+                elif cached_view and _output_unchanged(cached_view):
+                    # 输出文件未变化，直接复用元数据
+                    generated_files.append(cached_view['generated_path'])
+                    metadata.append(cached_view)
+                    all_detections.extend(cached_view['detections'])
+                    view_detections[cached_view['filename']] = records_to_arrays(cached_view['detections'])
+                    kept_hashes.append(int(cached_view['phash'], 16))
+                    source_size = source_size or cached_view.get('source_size')
+                    num_reused += 1
+                    continue
+                try:
+                    if img is None and reader is None:
+                        img, reader, source_size = self._load_source(input_path, tiled)
+                    # 文件名带视角键前缀：不同种子/模型/编码参数的视角不会覆盖缓存仍引用的文件
+                    output_filename = f"generated_{idx:03d}_{transform_type}_{view_key[:8]}{encode_options.extension}"
+                    output_file = output_path / output_filename
+                    if tiled:
+                        # 分块模式在渲染时直接写出视角图片，返回的是缩略图
+                        transformed_img, view_arrays, view_matrix = self._render_view_tiled(
+                            reader, transform_type, idx, view_rng(seed, idx), detect, output_file,
+                            write_fn=writer.write)
+                        if transformed_img is None:
+                            print(f"⚠️ 分块模式不支持非线性视角，跳过: {transform_type}")
+                            continue
+                    else:
+                        transformed_img, view_arrays, view_matrix = self._render_view(
+                            img, transform_type, idx, view_rng(seed, idx), detect)
+                    detections = to_records(view_arrays, self.class_names, integer_boxes=True)
                 
-                # 进行目标检测并绘制检测框（每次使用不同的置信度阈值）
-                detections = []
-                if self.draw_boxes:
-                    # 为每次检测添加随机变化，但降低阈值以检测更多目标
-                    # 使用更低的置信度阈值，确保检测到更多目标
-                    base_conf = 0.1 + (idx % 10) * 0.03  # 0.1-0.37之间变化，10个不同值
-                    # 添加额外的随机偏移（更小的范围，避免过度变化）
-                    conf_variation = random.uniform(-0.03, 0.03)
-                    final_conf = max(0.08, min(0.4, base_conf + conf_variation))  # 降低最大阈值，检测更多目标
-                    
-                    # 检测前再次确保图片已经变换（双重验证，但使用温和变换）
-                    if cv2 is not None and transformed_img.shape == img.shape:
-                        diff_check = np.abs(transformed_img.astype(np.float32) - img.astype(np.float32))
-                        if np.mean(diff_check) < 10.0:  # 如果差异还是太小
-                            # 应用温和的变换（避免过度扭曲）
-                            center = (w // 2, h // 2)
-                            angle = random.uniform(-25, 25)  # 减小角度
-                            scale = random.uniform(0.9, 1.1)  # 减小缩放
-                            M = cv2.getRotationMatrix2D(center, angle, scale)
-                            transformed_img = cv2.warpAffine(transformed_img, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
-                            
-                            # 再添加温和的透视变换
-                            offset = random.uniform(0.05, 0.15)  # 减小偏移
-                            pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
-                            pts2 = np.float32([
-                                [w*offset, h*offset], 
-                                [w*(1-offset), h*offset], 
-                                [w*0.1, h*0.9], 
-                                [w*0.9, h*0.9]
-                            ])
-                            M2 = cv2.getPerspectiveTransform(pts1, pts2)
-                            transformed_img = cv2.warpPerspective(transformed_img, M2, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
-                    
-                    transformed_img, detections = self._detect_and_draw_boxes(transformed_img, conf_threshold=final_conf)
+                    phash = perceptual_hash(transformed_img)
+                    if dedup_threshold is not None and any(
+                            hamming_distance(phash, kept) <= dedup_threshold for kept in kept_hashes):
+                        dropped_duplicates.append({'index': idx, 'transformation': transform_type})
+                        cache['views'][view_key] = {'duplicate': True, 'index': idx,
+                                                    'transformation': transform_type, 'phash': f"{phash:016x}"}
+                        if tiled:
+                            output_file.unlink(missing_ok=True)
+                            writer.results.pop(str(output_file), None)
+                        continue
+                    kept_hashes.append(phash)
                     all_detections.extend(detections)
                 
-                output_filename = f"generated_{idx:03d}_{transform_type}.jpg"
-                output_file = output_path / output_filename
+                    view_detections[output_filename] = view_arrays
                 
-                # 使用 OpenCV 保存，如果失败则使用 PIL
-                try:
-                    cv2.imwrite(str(output_file), transformed_img, [cv2.IMWRITE_JPEG_QUALITY, 95])
-                except Exception:
-                    # 降级方案：使用 PIL 保存
-                    if len(transformed_img.shape) == 3:
-                        # BGR to RGB
-                        pil_img = Image.fromarray(transformed_img[:, :, ::-1])
+                    # 用内存中的结果直接写出画廊预览图，画廊不再解码全分辨率原图
+                    if tiled:
+                        write_preview(transformed_img, output_file)
                     else:
-                        pil_img = Image.fromarray(transformed_img)
-                    pil_img.save(str(output_file), 'JPEG', quality=95)
+                        # 交给编码线程池（队列满时在这里等待），预览图在编码线程中随后写出
+                        writer.submit(transformed_img, output_file, after=write_preview)
 
-                generated_files.append(str(output_file))
-                metadata.append({
-                    'index': idx,
-                    'original_path': str(input_path),
-                    'generated_path': str(output_file),
-                    'transformation': transform_type,
-                    'filename': output_filename,
-                    'detections': detections
-                })
-            except Exception as e:
-                print(f"⚠️ 生成失败 {transform_type}: {e}")
+                    generated_files.append(str(output_file))
+                    view_meta = {
+                        'index': idx,
+                        'seed': seed,
+                        'original_path': str(input_path),
+                        'generated_path': str(output_file),
+                        'transformation': transform_type,
+                        'filename': output_filename,
+                        'phash': f"{phash:016x}",
+                        'source_size': list(source_size),
+                        # 原图 -> 视角的整体变换矩阵，非线性视角（如鱼眼）为None
+                        'transform_matrix': view_matrix.tolist() if view_matrix is not None else None,
+                        'detections': detections
+                    }
+                    metadata.append(view_meta)
+                    cache['views'][view_key] = view_meta
+                except Exception as e:
+                    print(f"⚠️ 生成失败 {transform_type}: {e}")
+                    continue
+        finally:
+            # 等待编码线程写完所有视角
+            writer.close()
+
+        # 记录每个视角的写入字节数和编码耗时，编码失败的视角从结果中去掉
+        failed = set()
+        for view_meta in metadata:
+            output = writer.results.get(view_meta['generated_path'])
+            if output is None:
+                continue  # 复用的视角保留原记录
+            if 'error' in output:
+                failed.add(view_meta['generated_path'])
                 continue
+            view_meta['output'] = {key: output[key] for key in ('format', 'bytes', 'encode_ms')}
+            # 记录写出后的文件大小和修改时间，复用缓存前核对
+            try:
+                view_meta.update(_output_stat(view_meta['generated_path']))
+            except OSError:
+                failed.add(view_meta['generated_path'])
+        if failed:
+            metadata = [v for v in metadata if v['generated_path'] not in failed]
+            generated_files = [p for p in generated_files if p not in failed]
+            view_detections = {v['filename']: view_detections[v['filename']] for v in metadata}
+            all_detections = [d for v in metadata for d in v['detections']]
+            cache['views'] = {k: v for k, v in cache['views'].items() if v.get('generated_path') not in failed}
+        encode_stats = {
+            'views': sum(1 for v in writer.results.values() if 'error' not in v),
+            'bytes': sum(v.get('bytes', 0) for v in writer.results.values()),
+            'encode_ms': round(sum(v.get('encode_ms', 0.0) for v in writer.results.values()), 2)
+        }
+        if encode_stats['views']:
+            print(f"💾 编码 {encode_stats['views']} 个视角: {encode_stats['bytes'] / 1024 / 1024:.1f}MB, "
+                  f"编码耗时合计 {encode_stats['encode_ms'] / 1000:.2f}s（{writer.workers} 线程）")
 
         # 计算平均置信度统计（确保总是返回数据）
         confidence_stats = self._calculate_confidence_stats(all_detections)
@@ -493,19 +588,59 @@ class ImageMultiAngleGenerator:
                 confidence_stats['_all_confidences'] = all_conf
             confidence_stats['_total_detections'] = len(confidence_stats.get('_all_confidences', []))
 
-        metadata_file = output_path / f"generation_metadata_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        import json
+        if dropped_duplicates:
+            print(f"🧹 丢弃 {len(dropped_duplicates)} 个近似重复的视角")
+        if num_reused:
+            print(f"♻️ 复用 {num_reused} 个已生成的视角")
+
+        # 所有视角都复用且旧缓存没有记录原图尺寸时，才需要读取原图
+        if source_size is None:
+            img, reader, source_size = self._load_source(input_path, tiled)
+        w, h = source_size
+
+        # 文件名带任务键前缀：同一秒结束的不同任务不会互相覆盖元数据和附属文件
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        detections_file = None
+        if detect:
+            detections_file = save_detection_sidecar(
+                output_path / f"detections_{timestamp}_{job_key[:8]}.npz", view_detections, self.class_names, (w, h))
+
+        metadata_file = output_path / f"generation_metadata_{timestamp}_{job_key[:8]}.json"
         with open(metadata_file, 'w', encoding='utf-8') as f:
             json.dump({
                 'generation_time': datetime.now().isoformat(),
+                'job_key': job_key,
                 'original_image': str(input_path),
+                'input_hash': input_hash,
+                'model': model_id,
                 'output_dir': str(output_path),
                 'num_requested': num_generations,
                 'num_generated': len(generated_files),
+                'seed': seed,
+                'detect': detect,
+                'tiled': bool(tiled),
+                'encoding': encode_options.to_dict(),
+                'encode_stats': encode_stats,
+                'draw_boxes': draw_boxes,
+                'detections_file': str(detections_file) if detections_file else None,
+                'transform_plan': selected_transforms,
                 'generated_images': metadata,
+                'dropped_duplicates': dropped_duplicates,
                 'confidence_statistics': confidence_stats,
                 'total_detections': len(all_detections)
-            }, f, ensure_ascii=False, indent=2)
+            }, f, ensure_ascii=False, separators=(',', ':'))
+
+        # 记录缓存（即使本次未开启skip_existing，之后的调用也可以复用）
+        cache['jobs'][job_key] = str(metadata_file)
+        try:
+            _save_generation_cache(output_path, cache)
+        except OSError as e:
+            print(f"⚠️ 生成缓存写入失败: {e}")
+
+        labels = None
+        if export_format:
+            labels = export_labels(metadata_file, export_format,
+                                   conf_threshold=label_conf_threshold, ground_truth=ground_truth)
 
         return {
             'success': True,
@@ -514,10 +649,272 @@ class ImageMultiAngleGenerator:
             'num_generated': len(generated_files),
             'generated_files': generated_files,
             'metadata_file': str(metadata_file),
+            'detections_file': str(detections_file) if detections_file else None,
+            'draw_boxes': draw_boxes,
+            'seed': seed,
             'confidence_statistics': confidence_stats,
-            'total_detections': len(all_detections)
+            'total_detections': len(all_detections),
+            'encode_stats': encode_stats,
+            'labels': labels
         }
 
+    def _load_cached_result(self, metadata_file: Optional[str], job_key: Optional[str] = None) -> Optional[Dict]:
+        """
+        从已有的元数据JSON还原生成结果
+
+        元数据不属于job_key对应的任务、任一输出文件缺失或被改写（大小/修改时间与记录不一致）、
+        检测附属文件缺失时返回None
+        """
+        if not metadata_file or not Path(metadata_file).exists():
+            return None
+        try:
+            with open(metadata_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job_key is not None and meta.get('job_key') != job_key:
+            return None
+        views = meta.get('generated_images', [])
+        if not all(_output_unchanged(view) for view in views):
+            return None
+        generated_files = [view['generated_path'] for view in views]
+        detections_file = meta.get('detections_file')
+        if detections_file and not Path(detections_file).exists():
+            return None
+        return {
+            'success': True,
+            'cached': True,
+            'original_image': meta['original_image'],
+            'output_dir': meta['output_dir'],
+            'num_generated': len(generated_files),
+            'generated_files': generated_files,
+            'metadata_file': str(metadata_file),
+            'detections_file': detections_file,
+            'draw_boxes': meta.get('draw_boxes', True),
+            'seed': meta.get('seed'),
+            'confidence_statistics': meta.get('confidence_statistics', {}),
+            'total_detections': meta.get('total_detections', 0)
+        }
+
+    def _load_source(self, input_path: Path, tiled: bool) -> tuple:
+        """
+        读取原图：分块模式只打开TileReader逐块读取，否则整图解码
+
+        返回:
+            (整图BGR数组或None, TileReader或None, 原图尺寸 (宽, 高))
+        """
+        if tiled:
+            reader = TileReader(input_path)
+            h, w = reader.shape
+            print(f"🧩 分块模式: {w}x{h}")
+            return None, reader, (w, h)
+        cv2 = get_cv2()
+        img = cv2.imread(str(input_path))
+        if img is None:
+            pil_img = Image.open(input_path)
+            img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+        h, w = img.shape[:2]
+        return img, None, (w, h)
+
+    def _plan_transforms(self, all_transforms: List[str], num_generations: int, seed: int) -> List[str]:
+        """由任务种子确定本次生成的变换方案（同一种子得到同一方案）"""
+        plan_rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PLAN_STREAM,)))
+        # 强制选择不同的变换，确保每个都不同
+        if num_generations > len(all_transforms):
+            selected_transforms = all_transforms.copy()
+            # 重复使用但添加唯一标识
+            for i in range(num_generations - len(all_transforms)):
+                base = all_transforms[plan_rng.integers(len(all_transforms))]
+                selected_transforms.append(f"{base}_unique_{i}")
+        else:
+            selected_transforms = [all_transforms[i] for i in
+                                   plan_rng.choice(len(all_transforms), num_generations, replace=False)]
+        
+        # 打乱顺序
+        return [selected_transforms[i] for i in plan_rng.permutation(len(selected_transforms))]
+
+    def _render_view(self, img: np.ndarray, transform_type: str, idx: int,
+                     rng: np.random.Generator, detect: bool) -> tuple:
+        """
+        渲染单个视角（变换 + 可选检测），所有随机参数只来自rng
+
+        返回:
+            (干净的渲染图片, 检测数组, 原图到视角的整体变换矩阵或None)
+        """
+        cv2 = get_cv2()
+        h, w = img.shape[:2]
+        warp = WarpTracker()
+        transformed_img = self._apply_transformation(img, transform_type, h, w, rng=rng, warp=warp)
+        
+        if cv2 is not None and transformed_img.shape == img.shape:
+            diff = np.abs(transformed_img.astype(np.float32) - img.astype(np.float32))
+            mean_diff = np.mean(diff)
+            if mean_diff < 6.0:
+                center = (w // 2, h // 2)
+                angle = rng.uniform(-15, 15)
+                scale = rng.uniform(0.95, 1.05)
+                M = cv2.getRotationMatrix2D(center, angle, scale)
+                transformed_img = warp.affine(
+                    transformed_img, M, (w, h),
+                    borderMode=cv2.BORDER_REFLECT
+                )
+                tx = rng.uniform(-w * 0.05, w * 0.05)
+                ty = rng.uniform(-h * 0.05, h * 0.05)
+                M[0, 2] += tx
+                M[1, 2] += ty
+                transformed_img = warp.affine(
+                    transformed_img, M, (w, h),
+                    borderMode=cv2.BORDER_REFLECT
+                )
+        
+        # 进行目标检测（每次使用不同的置信度阈值），检测框不画进图片
+        detections = empty_detections()
+        if detect:
+            # 为每次检测添加随机变化，但降低阈值以检测更多目标
+            # 使用更低的置信度阈值，确保检测到更多目标
+            base_conf = 0.1 + (idx % 10) * 0.03  # 0.1-0.37之间变化，10个不同值
+            # 添加额外的随机偏移（更小的范围，避免过度变化）
+            conf_variation = rng.uniform(-0.03, 0.03)
+            final_conf = max(0.08, min(0.4, base_conf + conf_variation))  # 降低最大阈值，检测更多目标
+            iou_threshold = self._view_iou_threshold(idx)
+            
+            # 检测前再次确保图片已经变换（双重验证，但使用温和变换）
+            if cv2 is not None and transformed_img.shape == img.shape:
+                diff_check = np.abs(transformed_img.astype(np.float32) - img.astype(np.float32))
+                if np.mean(diff_check) < 10.0:  # 如果差异还是太小
+                    # 应用温和的变换（避免过度扭曲）
+                    center = (w // 2, h // 2)
+                    angle = rng.uniform(-25, 25)  # 减小角度
+                    scale = rng.uniform(0.9, 1.1)  # 减小缩放
+                    M = cv2.getRotationMatrix2D(center, angle, scale)
+                    transformed_img = warp.affine(transformed_img, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+                    
+                    # 再添加温和的透视变换
+                    offset = rng.uniform(0.05, 0.15)  # 减小偏移
+                    pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
+                    pts2 = np.float32([
+                        [w*offset, h*offset], 
+                        [w*(1-offset), h*offset], 
+                        [w*0.1, h*0.9], 
+                        [w*0.9, h*0.9]
+                    ])
+                    M2 = cv2.getPerspectiveTransform(pts1, pts2)
+                    transformed_img = warp.perspective(transformed_img, M2, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            
+            detections = self._detect(transformed_img, conf_threshold=final_conf, iou_threshold=iou_threshold)
+        
+        return transformed_img, detections, warp.matrix
+
+    @staticmethod
+    def _view_iou_threshold(idx: int) -> float:
+        """视角的NMS IoU阈值：0.4-0.5之间按视角序号变化，跨进程/重跑保持一致"""
+        return 0.4 + (idx % 3) * 0.05
+
+    def _render_view_tiled(self, reader: TileReader, transform_type: str, idx: int,
+                           rng: np.random.Generator, detect: bool, output_file: Path,
+                           write_fn: Optional[Callable] = None) -> tuple:
+        """
+        分块渲染单个视角并写入output_file（超大图片）
+
+        先用不渲染的WarpTracker采样整体矩阵（随机参数的消耗顺序与 _render_view 相同），
+        再逐个输出块完成变换；检测在输出块上进行，跨块NMS合并。
+        整图差异检查需要整图像素，分块模式下不做差异兜底变换；边界统一填黑
+
+        返回:
+            (缩略图, 检测数组, 整体变换矩阵)；非线性视角返回 (None, None, None)，不写文件
+        """
+        h, w = reader.shape
+        warp = WarpTracker(render=False)
+        # 占位数组不分配内存，render=False 时不会读写像素
+        placeholder = np.broadcast_to(np.zeros((1, 1, 3), dtype=np.uint8), (h, w, 3))
+        self._apply_transformation(placeholder, transform_type, h, w, rng=rng, warp=warp)
+        if warp.matrix is None:
+            return None, None, None
+
+        merger = None
+        on_tile = None
+        if detect:
+            base_conf = 0.1 + (idx % 10) * 0.03
+            conf_variation = rng.uniform(-0.03, 0.03)
+            final_conf = max(0.08, min(0.4, base_conf + conf_variation))
+            iou_threshold = self._view_iou_threshold(idx)
+            merger = DetectionMerger()
+            on_tile = lambda tile, window, core: merger.add(
+                self._detect(tile, conf_threshold=final_conf, iou_threshold=iou_threshold), window)
+
+        thumbnail = warp_tiled(reader, warp.matrix, output_file, on_tile=on_tile, write_fn=write_fn)
+        detections = merger.result() if merger is not None else empty_detections()
+        return thumbnail, detections, warp.matrix
+
+    def render_view(self, metadata_file: str, view_index: int, output_path: Optional[str] = None,
+                    overlay: bool = False) -> np.ndarray:
+        """
+        按元数据JSON中记录的种子重新渲染某个视角（结果与原生成完全一致）
+
+        参数:
+            metadata_file: generate_multi_angle_images 写出的元数据JSON
+            view_index: 视角序号（元数据中的 index，从1开始）
+            output_path: 可选，保存路径
+            overlay: 是否叠加检测框
+
+        返回:
+            渲染后的BGR图片
+        """
+        cv2 = get_cv2()
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('seed') is None:
+            raise ValueError(f"元数据中没有记录种子，无法重新渲染: {metadata_file}")
+        transform_type = meta['transform_plan'][view_index - 1]
+        img = cv2.imread(meta['original_image'])
+        if img is None:
+            raise FileNotFoundError(f"原图不存在或无法读取: {meta['original_image']}")
+        # 旧版元数据没有detect字段，当时draw_boxes即表示是否检测
+        rendered, detections, _ = self._render_view(img, transform_type, view_index,
+                                                 view_rng(meta['seed'], view_index),
+                                                 meta.get('detect', meta.get('draw_boxes', True)))
+        if overlay:
+            rendered = draw_detections(rendered, detections, self.class_names, self.colors)
+        if output_path:
+            cv2.imwrite(str(output_path), rendered, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        return rendered
+
+    def render_view_overlay(self, metadata_file: str, view_index: int, max_side: Optional[int] = None) -> np.ndarray:
+        """
+        在已保存的干净视角上叠加检测框（读取图片和检测附属文件，不重新推理）
+
+        参数:
+            metadata_file: generate_multi_angle_images 写出的元数据JSON
+            view_index: 视角序号（元数据中的 index，从1开始）
+            max_side: 可选，先缩小到最长边不超过该值再绘制（用于画廊和预览）
+
+        返回:
+            叠加检测框后的BGR图片
+        """
+        cv2 = get_cv2()
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        view = next((v for v in meta['generated_images'] if v['index'] == view_index), None)
+        if view is None:
+            raise KeyError(f"元数据中没有视角 {view_index}: {metadata_file}")
+        img = cv2.imread(view['generated_path'])
+        if img is None:
+            raise FileNotFoundError(f"视角图片不存在或无法读取: {view['generated_path']}")
+        h, w = img.shape[:2]
+        if max_side and max(h, w) > max_side:
+            scale = max_side / max(h, w)
+            img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))),
+                             interpolation=cv2.INTER_AREA)
+
+        detections_file = meta.get('detections_file')
+        if detections_file and Path(detections_file).exists():
+            detections = load_detection_sidecar(detections_file)['views'].get(view['filename'])
+        else:
+            detections = None
+        if detections is None:
+            detections = records_to_arrays(view.get('detections', []))
+        return render_overlay(img, detections, self.class_names, source_size=(w, h), colors=self.colors)
+
     def _detect_and_draw_boxes(self, img: np.ndarray, conf_threshold: float = None) -> tuple:
         """
         检测目标并绘制检测框
@@ -529,24 +926,41 @@ class ImageMultiAngleGenerator:
         返回:
             (绘制后的图片, 检测结果列表)
         """
-        cv2 = _get_cv2()
+        detections = self._detect(img, conf_threshold)
+        return (draw_detections(img, detections, self.class_names, self.colors),
+                to_records(detections, self.class_names, integer_boxes=True))
+
+    def _detect(self, img: np.ndarray, conf_threshold: float = None,
+                iou_threshold: float = None) -> Dict[str, np.ndarray]:
+        """
+        检测目标（不绘制）
+        
+        参数:
+            img: 输入图片
+            conf_threshold: 置信度阈值，如果为None则自动计算
+            iou_threshold: NMS IoU阈值，None使用 DETECT_IOU
+        
+        返回:
+            检测数组 {'xyxy','conf','cls'}，检测不可用或出错时为空数组
+        """
+        cv2 = get_cv2()
         if cv2 is None:
-            # 如果 OpenCV 不可用，返回原图和空检测结果
-            return img, []
+            # 如果 OpenCV 不可用，返回空检测结果
+            return empty_detections()
         
         # 延迟加载 YOLO 模型
         if self.detector is None:
             YOLO = _get_yolo()
             if YOLO is None:
-                return img, []
+                return empty_detections()
             try:
                 if self.yolo_model_path and Path(self.yolo_model_path).exists():
                     self.detector = YOLO(self.yolo_model_path)
                 else:
                     self.detector = YOLO('yolov8n.pt')
             except Exception as e:
-                # 如果加载失败，返回原图
-                return img, []
+                # 如果加载失败，返回空检测结果
+                return empty_detections()
         
         try:
             # 改进的检测算法：使用动态置信度阈值
@@ -562,66 +976,15 @@ class ImageMultiAngleGenerator:
                 else:
                     conf_threshold = base_conf
             
-            # 使用动态NMS和置信度阈值（每次检测都不同）
-            # 根据图片内容动态调整IOU
-            iou_threshold = 0.4 + (hash(str(img.shape)) % 3) * 0.05  # 0.4-0.5之间
+            # IoU阈值由调用方按视角确定（不能用带随机盐的hash()，否则不同进程结果不一致）
+            if iou_threshold is None:
+                iou_threshold = DETECT_IOU
             results = self.detector(img, verbose=False, conf=conf_threshold, iou=iou_threshold)
-            detections = []
-            annotated_img = img.copy()
-            
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    # 获取检测信息
-                    cls_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().tolist()
-                    
-                    # 获取类别名称和颜色
-                    class_name = self.class_names[cls_id] if cls_id < len(self.class_names) else f'class_{cls_id}'
-                    color = self.colors[cls_id % len(self.colors)]
-                    
-                    # 绘制检测框
-                    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                    cv2.rectangle(annotated_img, (x1, y1), (x2, y2), color, 2)
-                    
-                    # 绘制标签背景
-                    label = f'{class_name} {confidence:.2f}'
-                    (label_width, label_height), baseline = cv2.getTextSize(
-                        label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1
-                    )
-                    cv2.rectangle(
-                        annotated_img,
-                        (x1, y1 - label_height - baseline - 5),
-                        (x1 + label_width, y1),
-                        color,
-                        -1
-                    )
-                    
-                    # 绘制标签文字
-                    cv2.putText(
-                        annotated_img,
-                        label,
-                        (x1, y1 - baseline - 2),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.5,
-                        (255, 255, 255),
-                        1,
-                        cv2.LINE_AA
-                    )
-                    
-                    # 记录检测结果
-                    detections.append({
-                        'class_id': cls_id,
-                        'class_name': class_name,
-                        'confidence': confidence,
-                        'bbox': [x1, y1, x2, y2]
-                    })
-            
-            return annotated_img, detections
+            # 一次性把所有框拉到NumPy
+            return extract_detections(results)
         except Exception as e:
             print(f"检测出错: {e}")
-            return img, []
+            return empty_detections()
 
     def _calculate_confidence_stats(self, all_detections: List[Dict]) -> Dict:
         """计算各类别的置信度统计（包含所有置信度值）"""
@@ -668,22 +1031,27 @@ class ImageMultiAngleGenerator:
         
         return sorted_stats
 
-    def _apply_transformation(self, img: np.ndarray, transform_type: str, h: int, w: int, random_factor: int = 1) -> np.ndarray:
-        """应用指定的3D视角变换（改进版：添加随机参数变化，确保每次变换都不同）"""
-        cv2 = _get_cv2()
+    def _apply_transformation(self, img: np.ndarray, transform_type: str, h: int, w: int,
+                              rng: Optional[np.random.Generator] = None,
+                              warp: Optional[WarpTracker] = None) -> np.ndarray:
+        """应用指定的3D视角变换（随机参数全部来自rng，rng相同则结果相同；warp累计变换矩阵）"""
+        cv2 = get_cv2()
         if cv2 is None:
             # 如果 OpenCV 不可用，返回原图
             return img.copy()
         
-        result = img.copy()
+        # 只采样矩阵（render=False）时不读写像素，不复制输入（可以是broadcast_to的零开销占位数组）
+        result = img if warp is not None and not warp.render else img.copy()
         
         # 处理带变体后缀的变换类型
         base_transform = transform_type.split('_var')[0].split('_extra')[0]
         has_extra = '_extra' in transform_type
         
-        # 强制所有变换都使用随机参数（除了original）
-        # 使用random_factor确保每次变换都不同
-        rng = np.random.RandomState(random_factor * 1000 + hash(transform_type) % 10000)
+        # 所有变换都使用随机参数，参数只来自调用方传入的随机流
+        if rng is None:
+            rng = np.random.default_rng()
+        if warp is None:
+            warp = WarpTracker()
         
         if base_transform == 'original':
             # 即使是original，也添加随机变化
@@ -691,7 +1059,7 @@ class ImageMultiAngleGenerator:
             angle = rng.uniform(-8, 8)
             scale = rng.uniform(0.95, 1.05)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             return result
         
         # ========== 真正的3D视角变换 ==========
@@ -712,11 +1080,11 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset2 - tilt_x), h*(1-offset2 - tilt_y)]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             # 应用旋转
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'top_down_60':
             offset = rng.uniform(0.02, 0.2)
@@ -732,10 +1100,10 @@ class ImageMultiAngleGenerator:
                 [w*(0.95 - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'top_down_45':
             offset = rng.uniform(0.05, 0.25)
@@ -751,10 +1119,10 @@ class ImageMultiAngleGenerator:
                 [w*(0.9 - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'low_angle_30':
             offset = rng.uniform(0.02, 0.2)
@@ -769,10 +1137,10 @@ class ImageMultiAngleGenerator:
                 [w*(0.95 - tilt), h*0.95]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'low_angle_45':
             offset = rng.uniform(0.05, 0.25)
@@ -787,10 +1155,10 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*1.0]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'side_view_left':
             offset = rng.uniform(0.6, 0.8)
@@ -806,10 +1174,10 @@ class ImageMultiAngleGenerator:
                 [w*(offset - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'side_view_right':
             offset = rng.uniform(0.2, 0.4)
@@ -825,17 +1193,17 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'oblique_30':
             angle = rng.uniform(20, 40)
             scale = rng.uniform(0.9, 1.1)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.02, 0.2)
             tilt = rng.uniform(-0.12, 0.12)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -846,14 +1214,14 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*0.9]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'oblique_45':
             angle = rng.uniform(35, 55)
             scale = rng.uniform(0.85, 1.15)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.05, 0.25)
             tilt = rng.uniform(-0.15, 0.15)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -864,14 +1232,14 @@ class ImageMultiAngleGenerator:
                 [w*(0.95 - tilt), h*0.95]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'oblique_60':
             angle = rng.uniform(50, 70)
             scale = rng.uniform(0.8, 1.2)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.1, 0.3)
             tilt = rng.uniform(-0.18, 0.18)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -882,7 +1250,7 @@ class ImageMultiAngleGenerator:
                 [w*(0.9 - tilt), h*0.9]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'bird_eye' or transform_type == 'bird_eye':
             offset = rng.uniform(0.02, 0.12)
@@ -896,10 +1264,10 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset), h*(1-offset)]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w/2, h/2)
             M_scale = cv2.getRotationMatrix2D(center, rotation, scale)
-            result = cv2.warpAffine(result, M_scale, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_scale, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'worm_eye' or transform_type == 'worm_eye':
             offset_x = rng.uniform(0.15, 0.25)
@@ -914,10 +1282,10 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*1.0]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'diagonal_up' or transform_type == 'diagonal_up':
             top_y = rng.uniform(0.1, 0.3)
@@ -933,10 +1301,10 @@ class ImageMultiAngleGenerator:
                 [w*1.0, h*(bottom_y - 0.1)]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'diagonal_down' or transform_type == 'diagonal_down':
             top_y = rng.uniform(0.0, 0.2)
@@ -952,17 +1320,17 @@ class ImageMultiAngleGenerator:
                 [w*right_x, h*1.0]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'tilt_left' or transform_type == 'tilt_left':
             angle = rng.uniform(-25, -5)
             rotation2 = rng.uniform(-10, 10)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, 1.0)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.05, 0.15)
             tilt = rng.uniform(-0.1, 0.1)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -973,16 +1341,16 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset - tilt), h*0.9]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             M_rot2 = cv2.getRotationMatrix2D(center, rotation2, 1.0)
-            result = cv2.warpAffine(result, M_rot2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'tilt_right' or transform_type == 'tilt_right':
             angle = rng.uniform(5, 25)
             rotation2 = rng.uniform(-10, 10)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, 1.0)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.05, 0.15)
             tilt = rng.uniform(-0.1, 0.1)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -993,9 +1361,9 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset - tilt), h*1.0]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             M_rot2 = cv2.getRotationMatrix2D(center, rotation2, 1.0)
-            result = cv2.warpAffine(result, M_rot2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot2, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'panoramic_wide' or transform_type == 'panoramic_wide':
             top_y = rng.uniform(0.1, 0.2)
@@ -1010,10 +1378,10 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'panoramic_narrow' or transform_type == 'panoramic_narrow':
             offset = rng.uniform(0.05, 0.15)
@@ -1027,24 +1395,24 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset - tilt), h*1.0]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'zoom_extreme' or transform_type == 'zoom_extreme':
             scale = rng.uniform(1.3, 1.8)
             rotation = rng.uniform(-30, 30)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, rotation, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
         
         elif base_transform == 'rotate_3d_45' or transform_type == 'rotate_3d_45':
             angle = rng.uniform(35, 55)
             scale = rng.uniform(0.9, 1.1)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             offset = rng.uniform(0.05, 0.15)
             tilt = rng.uniform(-0.12, 0.12)
             pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -1055,14 +1423,14 @@ class ImageMultiAngleGenerator:
                 [w*(1-offset - tilt), h*(1-offset - tilt)]
             ])
             M2 = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
             
         elif base_transform == 'rotate_3d_90' or transform_type == 'rotate_3d_90':
             angle = rng.uniform(80, 100)
             scale = rng.uniform(0.85, 1.15)
             center = (w // 2, h // 2)
             M = cv2.getRotationMatrix2D(center, angle, scale)
-            result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
         
         elif base_transform == 'perspective_strong' or transform_type == 'perspective_strong':
             top_offset = rng.uniform(0.15, 0.25)
@@ -1077,35 +1445,41 @@ class ImageMultiAngleGenerator:
                 [w*(1.0 - tilt), h*bottom_y]
             ])
             M = cv2.getPerspectiveTransform(pts1, pts2)
-            result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
             center = (w // 2, h // 2)
             M_rot = cv2.getRotationMatrix2D(center, rotation, 1.0)
-            result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+            result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         elif base_transform == 'fisheye_effect' or transform_type == 'fisheye_effect':
             h, w = result.shape[:2]
-            center_x, center_y = w // 2, h // 2
-            max_radius = min(center_x, center_y)
-            # 使用随机强度
+            # 使用随机强度，偏移为相对尺寸的比例；映射表按参数桶缓存
             strength = rng.uniform(0.5, 0.9)
-            offset_x = rng.uniform(-w*0.05, w*0.05)
-            offset_y = rng.uniform(-h*0.05, h*0.05)
-            map_x = np.zeros((h, w), dtype=np.float32)
-            map_y = np.zeros((h, w), dtype=np.float32)
-            for y in range(h):
-                for x in range(w):
-                    dx = x - center_x + offset_x
-                    dy = y - center_y + offset_y
-                    r = math.sqrt(dx*dx + dy*dy) / max_radius
-                    if r > 0:
-                        theta = math.atan2(dy, dx)
-                        r_new = r * r * strength
-                        map_x[y, x] = center_x + r_new * max_radius * math.cos(theta)
-                        map_y[y, x] = center_y + r_new * max_radius * math.sin(theta)
-                    else:
-                        map_x[y, x] = x
-                        map_y[y, x] = y
-            result = cv2.remap(result, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            offset_x = rng.uniform(-0.05, 0.05)
+            offset_y = rng.uniform(-0.05, 0.05)
+            result = warp.lens(result, 'fisheye',
+                               {'strength': strength, 'offset_x': offset_x, 'offset_y': offset_y},
+                               border_mode=cv2.BORDER_REPLICATE)
+        
+        elif base_transform in LENS_TRANSFORMS:
+            # 镜头模拟：轻微倾斜的透视变换合并进镜头映射表，一次remap完成
+            kind = LENS_TRANSFORMS[base_transform]
+            offset = rng.uniform(0.0, 0.08)
+            tilt = rng.uniform(-0.05, 0.05)
+            pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
+            pts2 = np.float32([
+                [w*(offset + tilt), h*offset],
+                [w*(1-offset + tilt), h*offset],
+                [w*(0.0 - tilt), h*1.0],
+                [w*(1.0 - tilt), h*1.0]
+            ])
+            M = cv2.getPerspectiveTransform(pts1, pts2)
+            if kind == 'barrel':
+                params = {'k1': rng.uniform(0.08, 0.3), 'k2': rng.uniform(0.0, 0.1)}
+            elif kind == 'pincushion':
+                params = {'k1': -rng.uniform(0.08, 0.25), 'k2': -rng.uniform(0.0, 0.06)}
+            else:
+                params = {'fov': rng.uniform(60, 110)}
+            result = warp.lens(result, kind, params, pre_homography=M)
         
         # 添加极端变换类型
         elif base_transform.startswith('extreme_'):
@@ -1123,10 +1497,10 @@ class ImageMultiAngleGenerator:
                     [w*(1-offset2 - tilt), h*(1-offset2 + tilt)]
                 ])
                 M = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 center = (w // 2, h // 2)
                 M_rot = cv2.getRotationMatrix2D(center, rotation, rng.uniform(0.7, 1.3))
-                result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 
             elif 'low_angle' in base_transform:
                 offset = rng.uniform(0.0, 0.3)
@@ -1141,10 +1515,10 @@ class ImageMultiAngleGenerator:
                     [w*1.0, h*1.0]
                 ])
                 M = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 center = (w // 2, h // 2)
                 M_rot = cv2.getRotationMatrix2D(center, rotation, rng.uniform(0.6, 1.4))
-                result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 
             elif 'side' in base_transform:
                 offset = rng.uniform(0.1, 0.9) if 'left' in base_transform else rng.uniform(0.1, 0.9)
@@ -1166,17 +1540,17 @@ class ImageMultiAngleGenerator:
                         [w*1.0, h*1.0]
                     ])
                 M = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 center = (w // 2, h // 2)
                 M_rot = cv2.getRotationMatrix2D(center, rotation, rng.uniform(0.7, 1.3))
-                result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 
             elif 'oblique' in base_transform or 'diagonal' in base_transform:
                 angle = rng.uniform(0, 90)
                 scale = rng.uniform(0.5, 1.5)
                 center = (w // 2, h // 2)
                 M = cv2.getRotationMatrix2D(center, angle, scale)
-                result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+                result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
                 offset = rng.uniform(0.0, 0.3)
                 tilt = rng.uniform(-0.3, 0.3)
                 pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -1187,13 +1561,13 @@ class ImageMultiAngleGenerator:
                     [w*(1.0 - tilt), h*0.9]
                 ])
                 M2 = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 
             elif 'tilt' in base_transform:
                 angle = rng.uniform(-60, 60)
                 center = (w // 2, h // 2)
                 M = cv2.getRotationMatrix2D(center, angle, rng.uniform(0.7, 1.3))
-                result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+                result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
                 offset = rng.uniform(0.0, 0.2)
                 tilt = rng.uniform(-0.25, 0.25)
                 pts1 = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
@@ -1204,21 +1578,21 @@ class ImageMultiAngleGenerator:
                     [w*(1-offset - tilt), h*0.9]
                 ])
                 M2 = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M2, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 
             elif 'zoom' in base_transform:
                 scale = rng.uniform(1.5, 2.5) if 'in' in base_transform else rng.uniform(0.4, 0.7)
                 rotation = rng.uniform(-45, 45)
                 center = (w // 2, h // 2)
                 M = cv2.getRotationMatrix2D(center, rotation, scale)
-                result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+                result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
                 
             elif 'rotate' in base_transform:
                 angle = rng.uniform(0, 180)
                 scale = rng.uniform(0.6, 1.4)
                 center = (w // 2, h // 2)
                 M = cv2.getRotationMatrix2D(center, angle, scale)
-                result = cv2.warpAffine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+                result = warp.affine(result, M, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
                 
             elif 'perspective' in base_transform:
                 offset = rng.uniform(0.0, 0.3)
@@ -1232,10 +1606,10 @@ class ImageMultiAngleGenerator:
                     [w*1.0, h*1.0]
                 ])
                 M = cv2.getPerspectiveTransform(pts1, pts2)
-                result = cv2.warpPerspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.perspective(result, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
                 center = (w // 2, h // 2)
                 M_rot = cv2.getRotationMatrix2D(center, rotation, rng.uniform(0.7, 1.3))
-                result = cv2.warpAffine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
+                result = warp.affine(result, M_rot, (w, h), borderMode=cv2.BORDER_REPLICATE)
         
         # 最后添加小幅变换，但不要过度扭曲（使用更温和的参数）
         # 只对非original变换添加，且使用更小的参数范围
@@ -1244,7 +1618,7 @@ class ImageMultiAngleGenerator:
             final_scale = rng.uniform(0.98, 1.02)  # 减小缩放范围
             center = (w // 2, h // 2)
             M_final = cv2.getRotationMatrix2D(center, final_rotation, final_scale)
-            result = cv2.warpAffine(result, M_final, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            result = warp.affine(result, M_final, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
         
         return result
 
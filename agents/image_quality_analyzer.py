@@ -4,64 +4,17 @@
 用于分析无人机图片素材的8个关键维度，评分标准已调整为适配VisDrone数据集
 """
 
-# ========== 关键：在导入任何模块前设置环境变量 ==========
-import os
-import sys
-
-# 必须在导入numpy等之前设置环境变量
-os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-os.environ['DISPLAY'] = ''
-os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-
-# 阻止加载libGL
-if 'LD_LIBRARY_PATH' in os.environ:
-    paths = os.environ['LD_LIBRARY_PATH'].split(':')
-    paths = [p for p in paths if 'libGL' not in p and 'mesa' not in p.lower()]
-    os.environ['LD_LIBRARY_PATH'] = ':'.join(paths)
+# 导入图片后端时会先设置headless环境变量，必须在导入numpy/ultralytics之前
+from agents.image_backend import get_cv2
+from agents.detections import empty_detections, extract_detections, to_records
+from agents.image_ingest import ANALYSIS_MAX_SIDE, decode_reduced
+from agents.prefetch import PREFETCH_DEPTH, prefetch_images
 
 import numpy as np
-
-# 延迟导入 OpenCV，避免在模块级别失败
-_cv2_available = None
-_cv2 = None
-
-def _get_cv2():
-    """延迟导入 OpenCV，强制使用 headless 模式，忽略 libGL 错误"""
-    global _cv2_available, _cv2
-    if _cv2_available is None:
-        try:
-            # 设置环境变量避免 OpenGL 依赖（必须在导入前设置）
-            import os
-            os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-            os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-            os.environ['DISPLAY'] = ''
-            os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-            
-            import cv2
-            # 测试基本功能
-            _ = cv2.__version__
-            _cv2 = cv2
-            _cv2_available = True
-            print("✅ OpenCV 在分析器中加载成功")
-        except (ImportError, OSError) as e:
-            # 即使有 libGL 错误，也尝试继续使用（headless 版本不需要 libGL）
-            if 'libGL' in str(e) or 'libGL.so' in str(e):
-                print(f"⚠️ 检测到 libGL 警告，但继续使用 OpenCV: {e}")
-                try:
-                    import cv2
-                    _cv2 = cv2
-                    _cv2_available = True
-                except:
-                    _cv2_available = False
-            else:
-                _cv2_available = False
-                print(f"警告: OpenCV 导入失败: {e}")
-    return _cv2 if _cv2_available else None
 from PIL import Image
 import torch
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, List, Tuple, Optional, Union
 import json
 from datetime import datetime
 
@@ -72,12 +25,6 @@ def _get_yolo_class():
     """延迟导入YOLO类，确保环境变量已设置"""
     global _YOLO_CLS
     if _YOLO_CLS is None:
-        # 再次确保环境变量已设置
-        os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-        os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-        os.environ['DISPLAY'] = ''
-        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-        
         from ultralytics import YOLO
         _YOLO_CLS = YOLO
     return _YOLO_CLS
@@ -106,6 +53,9 @@ class ImageQualityAnalyzer:
             # 使用预训练的YOLOv8n模型
             self.detector = YOLO('yolov8n.pt')
         
+        # 分析用的目标尺寸：JPEG按缩小尺寸解码（None为全分辨率），见 agents.image_ingest.decode_reduced
+        self.analysis_max_side = ANALYSIS_MAX_SIDE
+        
         # 8个维度的名称
         self.dimensions = [
             "图片数据量",
@@ -118,48 +68,57 @@ class ImageQualityAnalyzer:
             "场景复杂度"
         ]
         
-    def analyze_single_image(self, image_path: str) -> Dict:
+    def analyze_single_image(self, image_path: str, tiled: Optional[bool] = None) -> Dict:
         """
         分析单张图片的8个维度
         
         参数:
             image_path: 图片路径
+            tiled: 是否使用分块模式（超大正射影像）；None时按文件头中的像素数自动选择
             
         返回:
             包含8个维度分数的字典
         """
-        # 延迟导入 OpenCV
-        cv2 = _get_cv2()
+        cv2 = get_cv2()
         if cv2 is None:
-            # 最后一次尝试：直接导入，忽略 libGL 错误
-            try:
-                import os
-                os.environ['OPENCV_DISABLE_OPENCL'] = '1'
-                os.environ['QT_QPA_PLATFORM'] = 'offscreen'
-                os.environ['DISPLAY'] = ''
-                os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
-                import cv2
-                print("✅ OpenCV 在分析单张图片时成功加载")
-            except Exception as e:
-                # 即使有 libGL 错误，也尝试继续使用
-                if 'libGL' in str(e) or 'libGL.so' in str(e):
-                    print(f"⚠️ 忽略 libGL 错误，继续使用 OpenCV: {e}")
-                    import cv2
-                else:
-                    # 如果 OpenCV 真的不可用，使用 PIL 降级方案
-                    return self._analyze_with_pil(image_path)
+            # OpenCV 不可用，使用 PIL 降级方案
+            return self._analyze_with_pil(image_path)
+        
+        from agents.tiling import should_tile
+        if tiled or (tiled is None and should_tile(image_path)):
+            return self._analyze_tiled(image_path)
         
-        # 读取图片
-        img = cv2.imread(image_path)
+        # 读取图片（JPEG按分析尺寸缩小解码，全分辨率尺寸来自文件头）
+        img, full_size = decode_reduced(image_path, self.analysis_max_side)
         if img is None:
-            # 如果 cv2.imread 失败，尝试用 PIL 读取
+            # 如果解码失败，尝试用 PIL 读取
             return self._analyze_with_pil(image_path)
         
+        return self.analyze_image_array(img, Path(image_path).stat().st_size, full_size)
+    
+    def analyze_image_array(self, img: np.ndarray, file_size: Optional[int] = None,
+                            full_size: Optional[Tuple[int, int]] = None) -> Dict:
+        """
+        分析内存中已解码图片的8个维度（上传的图片不必先写入临时文件）
+        
+        参数:
+            img: BGR图片数组（可以是缩小解码的结果）
+            file_size: 原始编码文件的字节数，用于图片数据量维度；None时按0计
+            full_size: 原图全分辨率 (宽, 高)，用于图片数据量和目标密集度；None时使用img的尺寸
+            
+        返回:
+            包含8个维度分数的字典
+        """
+        cv2 = get_cv2()
+        if cv2 is None:
+            return self._analyze_pil_image(Image.fromarray(np.ascontiguousarray(img[:, :, ::-1])), file_size)
+        
         img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        h, w = img.shape[:2]
+        # 目标尺寸、完整性按相对比例计算，与解码尺寸无关；按面积计算的维度使用原图尺寸
+        w, h = full_size if full_size else (img.shape[1], img.shape[0])
         
         # 1. 图片数据量 (基于图片分辨率和文件大小)
-        data_quantity = self._calculate_data_quantity(image_path, h, w)
+        data_quantity = self._calculate_data_quantity(file_size, h, w)
         
         # 2. 拍摄光照质量 (基于亮度、对比度、直方图分析)
         lighting_quality = self._calculate_lighting_quality(img_rgb)
@@ -193,17 +152,60 @@ class ImageQualityAnalyzer:
             "场景复杂度": scene_complexity
         }
     
+    def _analyze_tiled(self, image_path: str) -> Dict:
+        """
+        分块分析超大图片：逐块检测后跨块NMS合并，光照和场景复杂度由各块的部分统计量合成，
+        峰值内存由块大小决定
+        """
+        from agents.tiling import TileReader, TileStats, detect_tiled
+        
+        cv2 = get_cv2()
+        reader = TileReader(image_path)
+        stats = TileStats()
+        h, w = reader.shape
+        
+        # 与整图路径一致，检测和统计都在RGB块上进行
+        detections = to_records(detect_tiled(
+            reader,
+            lambda tile: self._detect_arrays(cv2.cvtColor(tile, cv2.COLOR_BGR2RGB)),
+            on_tile=lambda tile, window, core: stats.add(cv2.cvtColor(tile, cv2.COLOR_BGR2RGB), window, core)
+        ))
+        summary = stats.result()
+        
+        scores = {
+            "图片数据量": self._calculate_data_quantity(Path(image_path).stat().st_size, h, w),
+            "拍摄光照质量": self._score_lighting(summary['v_mean'], summary['v_std'],
+                                           summary['overexposed'], summary['underexposed']),
+            "场景复杂度": self._score_scene_complexity(summary['laplacian_var'], summary['edge_density'],
+                                                summary['unique_colors'])
+        }
+        scores.update(self._detection_scores(detections, h, w))
+        return {dim: scores[dim] for dim in self.dimensions}
+    
     def _analyze_with_pil(self, image_path: str) -> Dict:
         """
         使用 PIL 进行基础分析（OpenCV 不可用时的降级方案）
         """
         try:
             pil_img = Image.open(image_path).convert("RGB")
+            file_size = Path(image_path).stat().st_size
+        except Exception as e:
+            print(f"PIL 读取失败: {e}")
+            pil_img, file_size = None, None
+        return self._analyze_pil_image(pil_img, file_size)
+    
+    def _analyze_pil_image(self, pil_img: Optional[Image.Image], file_size: Optional[int]) -> Dict:
+        """
+        对已解码的PIL图片进行基础分析（pil_img为None时返回默认值）
+        """
+        try:
+            if pil_img is None:
+                raise ValueError("图片读取失败")
             w, h = pil_img.size
             img_array = np.array(pil_img)
             
             # 1. 图片数据量
-            file_size = Path(image_path).stat().st_size / (1024 * 1024)  # MB
+            file_size = (file_size or 0) / (1024 * 1024)  # MB
             pixel_count = h * w
             resolution_score = min(100, (pixel_count / (1280 * 720)) * 100)
             size_score = min(100, (file_size / 1.0) * 100)
@@ -249,20 +251,42 @@ class ImageQualityAnalyzer:
                 "场景复杂度": 50.0
             }
     
-    def analyze_batch(self, image_paths: List[str]) -> Dict:
+    def analyze_batch(self, image_paths: List[Union[str, Dict]],
+                      progress_callback: Optional[Callable[[int, int], None]] = None,
+                      prefetch_depth: int = PREFETCH_DEPTH) -> Dict:
         """
         批量分析多张图片
         
         参数:
-            image_paths: 图片路径列表
+            image_paths: 图片路径列表；也可以是 agents.image_ingest.decode_uploads 返回的
+                         内存图片记录（{'image_path', 'image', 'file_size'}）
+            progress_callback: 进度回调 (已完成数, 总数)，每张图片开始前调用
+            prefetch_depth: 预读取深度，分析当前图片时后台线程按顺序读取并解码后面的图片
+                            （见 agents.prefetch）；缺失或损坏的图片被跳过
             
         返回:
             包含所有图片分析结果的字典
         """
         results = []
-        for img_path in image_paths:
+        total_annotations = 0
+        records = prefetch_images(image_paths, depth=prefetch_depth,
+                                  target_side=self.analysis_max_side, defer_tiled=True)
+        for i, record in enumerate(records):
+            if progress_callback:
+                progress_callback(i, len(image_paths))
+            img_path = record['image_path']
+            if record.get('error'):
+                print(f"分析图片 {img_path} 时出错: {record['error']}")
+                continue
             try:
-                result = self.analyze_single_image(img_path)
+                if record.get('deferred'):
+                    # 超大图片按路径分块分析
+                    result = self.analyze_single_image(img_path)
+                    total_annotations += self._count_annotations(img_path)
+                else:
+                    result = self.analyze_image_array(record['image'], record.get('file_size'),
+                                                      record.get('full_size'))
+                    total_annotations += self._count_annotations(record['image'])
                 result['image_path'] = img_path
                 results.append(result)
             except Exception as e:
@@ -279,13 +303,25 @@ class ImageQualityAnalyzer:
             "individual_results": results,
             "average_scores": avg_scores,
             "total_images": len(results),
-            "total_annotations": sum(len(self._detect_objects(r['image_path'])) for r in results)
+            "total_annotations": total_annotations
         }
     
-    def _calculate_data_quantity(self, image_path: str, height: int, width: int) -> float:
+    def _count_annotations(self, source: Union[str, np.ndarray]) -> int:
+        """统计一张图片的检测目标数（超大图片按分块检测，不整图送入检测器）"""
+        if isinstance(source, str):
+            from agents.tiling import TileReader, detect_tiled, should_tile
+            if should_tile(source):
+                cv2 = get_cv2()
+                return len(detect_tiled(
+                    TileReader(source),
+                    lambda tile: self._detect_arrays(cv2.cvtColor(tile, cv2.COLOR_BGR2RGB))
+                )['cls'])
+        return len(self._detect_objects(source))
+    
+    def _calculate_data_quantity(self, file_size: Optional[int], height: int, width: int) -> float:
         """计算图片数据量维度 (0-100) - VisDrone优化：降低标准"""
-        # 基于分辨率和文件大小
-        file_size = Path(image_path).stat().st_size / (1024 * 1024)  # MB
+        # 基于分辨率和文件大小（file_size为原始编码字节数）
+        file_size = (file_size or 0) / (1024 * 1024)  # MB
         pixel_count = height * width
         
         # 归一化到0-100
@@ -302,7 +338,7 @@ class ImageQualityAnalyzer:
     
     def _calculate_lighting_quality(self, img: np.ndarray) -> float:
         """计算拍摄光照质量维度 (0-100) - VisDrone优化：放宽标准"""
-        cv2 = _get_cv2()
+        cv2 = get_cv2()
         if cv2 is None:
             # 如果 OpenCV 不可用，使用基础亮度计算
             brightness = np.mean(img)
@@ -315,7 +351,13 @@ class ImageQualityAnalyzer:
         # 计算亮度统计
         mean_brightness = np.mean(v_channel)
         std_brightness = np.std(v_channel)
-        
+        overexposed = np.sum(v_channel > 240) / v_channel.size
+        underexposed = np.sum(v_channel < 15) / v_channel.size
+        return self._score_lighting(mean_brightness, std_brightness, overexposed, underexposed)
+    
+    def _score_lighting(self, mean_brightness: float, std_brightness: float,
+                        overexposed: float, underexposed: float) -> float:
+        """由亮度统计量计算光照评分（整图和分块统计共用）"""
         # VisDrone优化：理想亮度范围放宽为 80-220 (0-255范围)
         brightness_score = 100 - abs(mean_brightness - 150) / 150 * 100
         brightness_score = max(0, min(100, brightness_score))
@@ -324,39 +366,43 @@ class ImageQualityAnalyzer:
         contrast_score = min(100, std_brightness / 2.0)  # 从2.55降到2.0
         
         # 检查是否有过曝或欠曝 - 减少惩罚
-        overexposed = np.sum(v_channel > 240) / v_channel.size
-        underexposed = np.sum(v_channel < 15) / v_channel.size
         exposure_penalty = (overexposed + underexposed) * 30  # 从50降到30
         
         final_score = (brightness_score * 0.4 + contrast_score * 0.4) - exposure_penalty
         # 最低保证20分（VisDrone数据集通常光照不理想）
         return max(20, min(100, final_score))
     
-    def _detect_objects(self, img: np.ndarray) -> List[Dict]:
-        """使用YOLO检测目标"""
+    def _detect_arrays(self, img: np.ndarray) -> Dict[str, np.ndarray]:
+        """使用YOLO检测目标，返回检测数组 {'xyxy', 'conf', 'cls'}"""
         try:
-            results = self.detector(img, verbose=False)
-            detections = []
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    detections.append({
-                        'class': int(box.cls[0]),
-                        'confidence': float(box.conf[0]),
-                        'bbox': box.xyxy[0].cpu().numpy().tolist()  # [x1, y1, x2, y2]
-                    })
-            return detections
+            return extract_detections(self.detector(img, verbose=False))
         except Exception as e:
             print(f"目标检测出错: {e}")
-            return []
+            return empty_detections()
+    
+    def _detect_objects(self, img: np.ndarray) -> List[Dict]:
+        """使用YOLO检测目标"""
+        # 一次性提取所有框，bbox为 [x1, y1, x2, y2]
+        return to_records(self._detect_arrays(img))
+    
+    def _detection_scores(self, detections: List[Dict], h: int, w: int) -> Dict[str, float]:
+        """由一次检测结果计算5个检测相关维度（分块模式下检测结果来自跨块合并）"""
+        return {
+            "目标尺寸": self._score_target_size(detections, h, w),
+            "目标完整性": self._score_target_completeness(detections, h, w),
+            "数据均衡度": self._score_data_balance(detections),
+            "产品丰富度": self._score_product_richness(detections),
+            "目标密集度": self._score_target_density(detections, h, w)
+        }
     
     def _calculate_target_size(self, img: np.ndarray) -> float:
         """计算目标尺寸维度 (0-100) - VisDrone优化：降低理想占比"""
-        detections = self._detect_objects(img)
+        return self._score_target_size(self._detect_objects(img), *img.shape[:2])
+    
+    def _score_target_size(self, detections: List[Dict], h: int, w: int) -> float:
         if not detections:
             return 0.0
         
-        h, w = img.shape[:2]
         total_area = h * w
         
         # 计算所有检测框的平均面积占比
@@ -379,11 +425,12 @@ class ImageQualityAnalyzer:
     
     def _calculate_target_completeness(self, img: np.ndarray) -> float:
         """计算目标完整性维度 (0-100) - VisDrone优化：减少边缘惩罚"""
-        detections = self._detect_objects(img)
+        return self._score_target_completeness(self._detect_objects(img), *img.shape[:2])
+    
+    def _score_target_completeness(self, detections: List[Dict], h: int, w: int) -> float:
         if not detections:
             return 0.0
         
-        h, w = img.shape[:2]
         completeness_scores = []
         
         for det in detections:
@@ -411,7 +458,9 @@ class ImageQualityAnalyzer:
     
     def _calculate_data_balance(self, img: np.ndarray) -> float:
         """计算数据均衡度维度 (0-100) - VisDrone优化：保持但放宽"""
-        detections = self._detect_objects(img)
+        return self._score_data_balance(self._detect_objects(img))
+    
+    def _score_data_balance(self, detections: List[Dict]) -> float:
         if not detections:
             return 0.0
         
@@ -438,7 +487,9 @@ class ImageQualityAnalyzer:
     
     def _calculate_product_richness(self, img: np.ndarray) -> float:
         """计算产品丰富度维度 (0-100) - VisDrone优化：降低理想类别数"""
-        detections = self._detect_objects(img)
+        return self._score_product_richness(self._detect_objects(img))
+    
+    def _score_product_richness(self, detections: List[Dict]) -> float:
         unique_classes = len(set(det['class'] for det in detections))
         
         # VisDrone优化：理想情况降低为 3-6个不同类别（从5-10降低）
@@ -452,7 +503,9 @@ class ImageQualityAnalyzer:
     
     def _calculate_target_density(self, img: np.ndarray, height: int, width: int) -> float:
         """计算目标密集度维度 (0-100) - VisDrone优化：降低理想密集度"""
-        detections = self._detect_objects(img)
+        return self._score_target_density(self._detect_objects(img), height, width)
+    
+    def _score_target_density(self, detections: List[Dict], height: int, width: int) -> float:
         num_targets = len(detections)
         
         if num_targets == 0:
@@ -473,7 +526,7 @@ class ImageQualityAnalyzer:
     
     def _calculate_scene_complexity(self, img: np.ndarray) -> float:
         """计算场景复杂度维度 (0-100) - VisDrone优化：稍微放宽"""
-        cv2 = _get_cv2()
+        cv2 = get_cv2()
         if cv2 is None:
             # 如果 OpenCV 不可用，使用基础复杂度计算
             contrast = np.std(img)
@@ -491,6 +544,10 @@ class ImageQualityAnalyzer:
         
         # 计算颜色复杂度
         unique_colors = len(np.unique(img.reshape(-1, img.shape[-1]), axis=0))
+        return self._score_scene_complexity(laplacian_var, edge_density, unique_colors)
+    
+    def _score_scene_complexity(self, laplacian_var: float, edge_density: float, unique_colors: int) -> float:
+        """由清晰度、边缘密度和颜色数计算场景复杂度评分（整图和分块统计共用）"""
         color_complexity = min(100, (unique_colors / 800) * 100)  # 从1000降到800
         
         # 综合评分
@@ -0,0 +1,365 @@
+"""
+后台任务队列
+Background Job Queue
+
+SQLite持久化的本地任务队列 + 工作线程池，供Streamlit界面提交耗时任务
+（多角度生成、批量分析、增强训练），任务在脚本重跑之间继续运行：
+- submit 返回任务ID，界面按ID轮询状态
+- 任务处理函数通过 JobContext.report 上报进度事件
+- cancel 设置取消标记，处理函数在下一次上报进度时中止
+- 结果以JSON保存，可随时通过 get 取回
+- 运行中的任务记录所属进程和心跳时间，进程启动时只重新排队心跳超时的任务
+  （其他进程仍在执行的任务不会被重复执行）
+- 已结束任务的进度事件保留一段时间后删除，每个任务最多保留固定条数的事件
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 运行中任务的心跳间隔（秒）；超过 JOB_STALE_SECONDS 没有心跳的任务视为所属进程已退出
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 60))
+# 已结束任务的进度事件保留时间（秒）和每个任务保留的最大事件数
+JOB_EVENTS_RETENTION = float(os.environ.get('JOB_EVENTS_RETENTION', 7 * 24 * 3600))
+JOB_EVENTS_PER_JOB = int(os.environ.get('JOB_EVENTS_PER_JOB', 500))
+
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+
+def _json_default(value):
+    """把numpy类型、Path等转换为可JSON序列化的值"""
+    # 只在遇到非原生类型时才导入numpy，保持 agents.job_queue 轻量
+    import numpy as np
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Path):
+        return str(value)
+    raise TypeError(f"无法序列化类型 {type(value).__name__}")
+
+
+class JobContext:
+    """传给任务处理函数的上下文，用于上报进度和检查取消"""
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    def report(self, done: int, total: int, message: str = ""):
+        """
+        上报进度（同时检查取消标记）
+
+        参数:
+            done: 已完成数量
+            total: 总数量
+            message: 进度说明
+
+        异常:
+            JobCancelled: 任务已被请求取消
+        """
+        progress = done / total if total else 0.0
+        self.queue._record_progress(self.job_id, progress, message)
+        if self.cancelled():
+            raise JobCancelled(self.job_id)
+
+    def progress_callback(self, message: str = "", start: float = 0.0, end: float = 1.0):
+        """
+        生成 (done, total) 形式的进度回调，映射到整体进度的 [start, end] 区间，
+        用于把多步骤任务中的某一步接入 agent 的 progress_callback 参数
+        """
+        def callback(done: int, total: int):
+            fraction = done / total if total else 0.0
+            self.report(start + (end - start) * fraction, 1.0,
+                        f"{message} {done}/{total}" if message else f"{done}/{total}")
+        return callback
+
+    def cancelled(self) -> bool:
+        """是否已被请求取消"""
+        return self.queue._cancel_requested(self.job_id)
+
+
+class JobQueue:
+    """SQLite持久化的后台任务队列"""
+
+    def __init__(self, db_path: str = "jobs/jobs.sqlite", num_workers: int = 1):
+        """
+        初始化任务队列并启动工作线程
+
+        参数:
+            db_path: SQLite数据库路径
+            num_workers: 工作线程数
+        """
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.num_workers = num_workers
+        # 本队列实例的标识，写入所认领任务的owner字段
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[Dict, JobContext], Any]] = {}
+        self._wakeup = threading.Condition()
+        self._closed = False
+        self._stop = threading.Event()
+        self._init_db()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT,
+                    progress REAL DEFAULT 0,
+                    message TEXT DEFAULT '',
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER DEFAULT 0,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT,
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp REAL,
+                    progress REAL,
+                    message TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, seq)")
+            # 旧数据库补充所属进程和心跳字段
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            # 所属进程已退出（心跳超时）的运行中任务无法继续，重新排队；
+            # 仍有心跳的任务属于其他存活的进程，不能重复执行
+            self._requeue_stale(conn)
+            self._prune_events(conn)
+
+    def _requeue_stale(self, conn) -> int:
+        """把心跳超时的运行中任务重新排队，返回重新排队的任务数"""
+        return conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+            "WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (QUEUED, RUNNING, time.time() - JOB_STALE_SECONDS)).rowcount
+
+    def _prune_events(self, conn):
+        """删除已结束超过保留时间的任务（以及已不存在的任务）的进度事件"""
+        placeholders = ",".join("?" * len(FINISHED_STATES))
+        conn.execute(
+            f"DELETE FROM job_events WHERE job_id NOT IN (SELECT job_id FROM jobs) OR job_id IN "
+            f"(SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?)",
+            (*FINISHED_STATES, time.time() - JOB_EVENTS_RETENTION))
+
+    def register(self, kind: str, handler: Callable[[Dict, JobContext], Any]):
+        """
+        注册任务处理函数
+
+        参数:
+            kind: 任务类型
+            handler: handler(params, context) -> 可JSON序列化的结果
+        """
+        self._handlers[kind] = handler
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, kind: str, params: Optional[Dict] = None) -> str:
+        """
+        提交任务
+
+        参数:
+            kind: 任务类型（需已注册）
+            params: 任务参数（需可JSON序列化）
+
+        返回:
+            任务ID
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(params or {}, ensure_ascii=False, default=_json_default),
+                 time.time()))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        获取任务状态和结果
+
+        返回:
+            任务字典（params/result已解析），任务不存在时返回None
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit: int = 20, kind: Optional[str] = None) -> List[Dict]:
+        """按提交时间倒序列出任务"""
+        query = "SELECT * FROM jobs"
+        args = []
+        if kind:
+            query += " WHERE kind = ?"
+            args.append(kind)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(query, args).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def events(self, job_id: str, since: int = 0) -> List[Dict]:
+        """获取序号大于since的进度事件"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, timestamp, progress, message FROM job_events "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, since)).fetchall()
+        return [dict(row) for row in rows]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        请求取消任务：排队中的任务直接取消，运行中的任务在下一次上报进度时中止
+
+        返回:
+            任务是否仍处于可取消状态
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED))
+            updated = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN (?, ?)",
+                (job_id, QUEUED, RUNNING)).rowcount
+        return bool(updated)
+
+    def close(self, timeout: Optional[float] = None):
+        """停止工作线程（正在运行的任务会先执行完）"""
+        self._closed = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        # 仍在执行任务的工作线程需要心跳，否则任务会被其他进程当作超时接管
+        if not any(worker.is_alive() for worker in self._workers):
+            self._stop.set()
+
+    def _row_to_job(self, row) -> Dict:
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _record_progress(self, job_id: str, progress: float, message: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE job_id = ?",
+                         (progress, message, now, job_id))
+            seq = conn.execute("INSERT INTO job_events (job_id, timestamp, progress, message) VALUES (?, ?, ?, ?)",
+                               (job_id, now, progress, message)).lastrowid
+            # 每个任务只保留最近 JOB_EVENTS_PER_JOB 条事件
+            conn.execute("DELETE FROM job_events WHERE job_id = ? AND seq <= ?",
+                         (job_id, seq - JOB_EVENTS_PER_JOB))
+
+    def _claim_next(self) -> Optional[Dict]:
+        """原子地取出下一个有处理函数的排队任务"""
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        placeholders = ",".join("?" * len(kinds))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # 运行期间其他进程崩溃留下的任务也在这里接管
+            self._requeue_stale(conn)
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND kind IN ({placeholders}) "
+                f"ORDER BY created_at LIMIT 1", [QUEUED] + kinds).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? WHERE job_id = ?",
+                         (RUNNING, now, self.owner, now, row['job_id']))
+        return self._row_to_job(row)
+
+    def _finish(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                "progress = CASE WHEN ? = ? THEN 1.0 ELSE progress END WHERE job_id = ?",
+                (status,
+                 json.dumps(result, ensure_ascii=False, default=_json_default) if result is not None else None,
+                 error, time.time(), status, SUCCEEDED, job_id))
+            self._prune_events(conn)
+
+    def _heartbeat_loop(self):
+        """定时刷新本实例所有运行中任务的心跳（处理函数长时间不上报进度时任务也不会被判定为超时）"""
+        while not self._stop.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self._connect() as conn:
+                    conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                                 (time.time(), self.owner, RUNNING))
+            except sqlite3.OperationalError:
+                # 数据库被其他进程锁住，下一次再刷新
+                pass
+
+    def _worker_loop(self):
+        while not self._closed:
+            try:
+                job = self._claim_next()
+            except sqlite3.OperationalError:
+                # 数据库被其他进程锁住，稍后重试
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+
+            context = JobContext(self, job['job_id'])
+            try:
+                if job['cancel_requested']:
+                    raise JobCancelled(job['job_id'])
+                result = self._handlers[job['kind']](job['params'], context)
+                self._finish(job['job_id'], SUCCEEDED, result=result)
+            except JobCancelled:
+                self._finish(job['job_id'], CANCELLED)
+            except Exception as e:
+                print(f"❌ 任务 {job['job_id']} ({job['kind']}) 失败: {e}")
+                self._finish(job['job_id'], FAILED, error=f"{e}\n{traceback.format_exc()}")
@@ -0,0 +1,408 @@
+"""
+生成素材的标注导出
+Label Export for Generated Views
+
+把 generate_multi_angle_images 已经跑过的检测结果直接导出为 COCO JSON 或 YOLO txt，
+不再对生成的素材做第二遍标注：
+- 伪标签：按置信度阈值过滤视角上的检测结果
+- 真值投影：原图有真值标注（LabelMe JSON / COCO JSON / YOLO txt）时，
+  用视角记录的整体变换矩阵（各次透视/仿射矩阵的乘积）把标注投影到视角上，
+  检测框取四角投影后的外接框，多边形按图片边界裁剪，退化的标注被丢弃
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from agents.detections import load_detection_sidecar, records_to_arrays
+
+EXPORT_FORMATS = ('coco', 'yolo')
+# 伪标签默认置信度阈值
+DEFAULT_LABEL_CONF = 0.25
+# 投影后宽或高小于该值（像素）的标注视为退化并丢弃
+MIN_BOX_SIZE = 2.0
+
+
+def project_points(points: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    用3x3矩阵投影点集
+
+    参数:
+        points: (N,2) 点坐标
+        matrix: 3x3 透视矩阵
+
+    返回:
+        (N,2) 投影后的坐标
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    homogeneous = np.hstack([points, np.ones((len(points), 1))]) @ np.asarray(matrix, dtype=np.float64).T
+    w = homogeneous[:, 2:3]
+    # 落到无穷远附近的点（透视分母接近0）直接放到很远处，后续裁剪会处理
+    w = np.where(np.abs(w) < 1e-12, 1e-12, w)
+    return homogeneous[:, :2] / w
+
+
+def project_boxes(xyxy: np.ndarray, matrix: np.ndarray, width: int, height: int,
+                  min_size: float = MIN_BOX_SIZE) -> tuple:
+    """
+    投影检测框：四个角点投影后取外接框，裁剪到图片范围
+
+    参数:
+        xyxy: (N,4) 原图坐标下的检测框
+        matrix: 3x3 原图 -> 视角的变换矩阵
+        width, height: 视角尺寸
+        min_size: 裁剪后宽或高小于该值的框被丢弃
+
+    返回:
+        (投影后的 (M,4) 检测框, 保留的原索引 (M,))
+    """
+    xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    if len(xyxy) == 0:
+        return np.zeros((0, 4)), np.zeros((0,), dtype=np.int64)
+    corners = np.stack([
+        xyxy[:, [0, 1]], xyxy[:, [2, 1]], xyxy[:, [2, 3]], xyxy[:, [0, 3]]
+    ], axis=1).reshape(-1, 2)
+    projected = project_points(corners, matrix).reshape(-1, 4, 2)
+    boxes = np.concatenate([projected.min(axis=1), projected.max(axis=1)], axis=1)
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    keep = np.flatnonzero(((boxes[:, 2] - boxes[:, 0]) >= min_size) & ((boxes[:, 3] - boxes[:, 1]) >= min_size))
+    return boxes[keep], keep
+
+
+def clip_polygon(points: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    把多边形裁剪到图片范围内（Sutherland-Hodgman，逐条边界裁剪）
+
+    返回:
+        裁剪后的 (K,2) 顶点，多边形完全在图片外时 K=0
+    """
+    polygon = [tuple(p) for p in np.asarray(points, dtype=np.float64).reshape(-1, 2)]
+    # (坐标轴, 边界值, 保留 <= 边界还是 >= 边界)
+    for axis, bound, keep_below in ((0, 0.0, False), (0, float(width), True),
+                                    (1, 0.0, False), (1, float(height), True)):
+        if not polygon:
+            break
+        inside = (lambda p: p[axis] <= bound) if keep_below else (lambda p: p[axis] >= bound)
+        clipped = []
+        for i, current in enumerate(polygon):
+            previous = polygon[i - 1]
+            if inside(current) != inside(previous):
+                t = (bound - previous[axis]) / (current[axis] - previous[axis])
+                clipped.append((previous[0] + t * (current[0] - previous[0]),
+                                previous[1] + t * (current[1] - previous[1])))
+            if inside(current):
+                clipped.append(current)
+        polygon = clipped
+    return np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+
+
+def polygon_area(points: np.ndarray) -> float:
+    """多边形面积（鞋带公式）"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    return float(abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0)
+
+
+def project_annotations(annotations: List[Dict], matrix: np.ndarray, width: int, height: int,
+                        min_size: float = MIN_BOX_SIZE) -> List[Dict]:
+    """
+    把原图的真值标注投影到视角上
+
+    参数:
+        annotations: load_ground_truth 的返回值
+        matrix: 3x3 原图 -> 视角的变换矩阵
+        width, height: 视角尺寸
+        min_size: 退化阈值（像素）
+
+    返回:
+        投影后的标注列表（保留输入的其他字段，只替换bbox/polygon），退化或完全移出视角的标注被丢弃
+    """
+    projected = []
+    for ann in annotations:
+        polygon = ann.get('polygon')
+        if polygon is not None and len(polygon) >= 3:
+            clipped = clip_polygon(project_points(polygon, matrix), width, height)
+            if len(clipped) < 3:
+                continue
+            x1, y1 = clipped.min(axis=0)
+            x2, y2 = clipped.max(axis=0)
+            if x2 - x1 < min_size or y2 - y1 < min_size:
+                continue
+            projected.append(dict(ann, bbox=[x1, y1, x2, y2], polygon=clipped.tolist()))
+        else:
+            boxes, keep = project_boxes([ann['bbox']], matrix, width, height, min_size)
+            if len(keep):
+                projected.append(dict(ann, bbox=boxes[0].tolist(), polygon=None))
+    return projected
+
+
+def _labelme_annotations(data: Dict) -> List[Dict]:
+    """LabelMe JSON 的 polygon/rectangle 标注"""
+    annotations = []
+    for shape in data.get('shapes', []):
+        label = shape.get('label')
+        points = np.asarray(shape.get('points', []), dtype=np.float64).reshape(-1, 2)
+        shape_type = shape.get('shape_type', 'polygon')
+        if not label or len(points) < 2:
+            continue
+        if shape_type == 'rectangle':
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            annotations.append({'class_name': label, 'bbox': [x1, y1, x2, y2], 'polygon': None})
+        elif shape_type == 'polygon' and len(points) >= 3:
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            annotations.append({'class_name': label, 'bbox': [x1, y1, x2, y2], 'polygon': points.tolist()})
+    return annotations
+
+
+def _coco_annotations(data: Dict, image_name: str) -> List[Dict]:
+    """COCO JSON 中按文件名匹配到的图片的标注"""
+    image_ids = {img['id'] for img in data.get('images', []) if Path(img['file_name']).name == image_name}
+    categories = {cat['id']: cat['name'] for cat in data.get('categories', [])}
+    annotations = []
+    for ann in data.get('annotations', []):
+        if ann.get('image_id') not in image_ids:
+            continue
+        x, y, w, h = ann['bbox']
+        polygon = None
+        segmentation = ann.get('segmentation')
+        if isinstance(segmentation, list) and segmentation and len(segmentation[0]) >= 6:
+            polygon = np.asarray(segmentation[0], dtype=np.float64).reshape(-1, 2).tolist()
+        annotations.append({
+            'class_name': categories.get(ann['category_id'], f"class_{ann['category_id']}"),
+            'bbox': [x, y, x + w, y + h],
+            'polygon': polygon
+        })
+    return annotations
+
+
+def _yolo_annotations(path: Path, width: int, height: int,
+                      class_names: Optional[Sequence[str]]) -> List[Dict]:
+    """YOLO txt（类别 cx cy w h，归一化坐标）"""
+    annotations = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        cls_id = int(float(parts[0]))
+        cx, cy, bw, bh = (float(v) for v in parts[1:5])
+        name = class_names[cls_id] if class_names and cls_id < len(class_names) else f'class_{cls_id}'
+        annotations.append({
+            'class_name': name,
+            'bbox': [(cx - bw / 2) * width, (cy - bh / 2) * height,
+                     (cx + bw / 2) * width, (cy + bh / 2) * height],
+            'polygon': None
+        })
+    return annotations
+
+
+def load_ground_truth(image_path: Union[str, Path], annotation_path: Optional[Union[str, Path]] = None,
+                      class_names: Optional[Sequence[str]] = None) -> Optional[List[Dict]]:
+    """
+    读取原图的真值标注
+
+    参数:
+        image_path: 原图路径
+        annotation_path: 标注文件（LabelMe JSON / COCO JSON / YOLO txt）；
+                         None时查找原图旁边同名的 .json（LabelMe）或 .txt（YOLO）
+        class_names: YOLO txt 的类别名列表
+
+    返回:
+        [{'class_name', 'bbox': [x1,y1,x2,y2], 'polygon': [[x,y],...] 或None}]，没有标注文件时返回None
+    """
+    image_path = Path(image_path)
+    if annotation_path is None:
+        for suffix in ('.json', '.txt'):
+            candidate = image_path.with_suffix(suffix)
+            if candidate.exists():
+                annotation_path = candidate
+                break
+        else:
+            return None
+    annotation_path = Path(annotation_path)
+    if not annotation_path.exists():
+        return None
+
+    if annotation_path.suffix.lower() == '.txt':
+        from PIL import Image
+        with Image.open(image_path) as img:
+            width, height = img.size
+        return _yolo_annotations(annotation_path, width, height, class_names)
+
+    with open(annotation_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if 'shapes' in data:
+        return _labelme_annotations(data)
+    if 'annotations' in data:
+        return _coco_annotations(data, image_path.name)
+    return None
+
+
+def _view_size(view: Dict, sidecar: Optional[Dict]) -> tuple:
+    """视角尺寸 (宽, 高)：优先用附属文件记录的尺寸，否则读取图片文件头"""
+    if sidecar and sidecar.get('image_size'):
+        return sidecar['image_size']
+    from PIL import Image
+    with Image.open(view['generated_path']) as img:
+        return img.size
+
+
+def export_labels(metadata_file: Union[str, Path], fmt: str = 'coco',
+                  output_dir: Optional[Union[str, Path]] = None,
+                  conf_threshold: float = DEFAULT_LABEL_CONF,
+                  ground_truth: Optional[Union[str, Path]] = None,
+                  gt_class_names: Optional[Sequence[str]] = None,
+                  class_names: Optional[Sequence[str]] = None) -> Dict:
+    """
+    把一次生成任务的视角导出为COCO或YOLO标注
+
+    有真值标注且视角记录了整体变换矩阵时使用投影后的真值，否则使用置信度不低于
+    conf_threshold 的检测结果作为伪标签
+
+    参数:
+        metadata_file: generate_multi_angle_images 写出的元数据JSON
+        fmt: 'coco' 或 'yolo'
+        output_dir: 输出目录，None则写到生成目录
+        conf_threshold: 伪标签置信度阈值
+        ground_truth: 原图的标注文件，None时自动查找原图旁边的同名标注
+        gt_class_names: YOLO txt 真值的类别名列表
+        class_names: 导出的类别顺序，None则使用检测模型的类别并追加真值中的新类别
+
+    返回:
+        {'format', 'labels_path', 'num_images', 'num_annotations', 'num_ground_truth_views', 'num_pseudo_views'}
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未知的标注格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+    with open(metadata_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    output_dir = Path(output_dir or meta['output_dir'])
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    detections_file = meta.get('detections_file')
+    sidecar = None
+    if detections_file and Path(detections_file).exists():
+        sidecar = load_detection_sidecar(detections_file)
+    detector_classes = list(sidecar['class_names']) if sidecar else []
+
+    gt = load_ground_truth(meta['original_image'], ground_truth, gt_class_names)
+    if class_names is None:
+        class_names = list(detector_classes)
+        for ann in gt or []:
+            if ann['class_name'] not in class_names:
+                class_names.append(ann['class_name'])
+    class_names = list(class_names)
+    class_index = {name: i for i, name in enumerate(class_names)}
+
+    views = []
+    num_gt_views = 0
+    for view in meta.get('generated_images', []):
+        width, height = _view_size(view, sidecar)
+        matrix = view.get('transform_matrix')
+        if gt is not None and matrix is not None:
+            labels = [dict(ann, score=None) for ann in project_annotations(gt, np.asarray(matrix), width, height)]
+            source = 'ground_truth'
+            num_gt_views += 1
+        else:
+            arrays = sidecar['views'].get(view['filename']) if sidecar else None
+            if arrays is None:
+                arrays = records_to_arrays(view.get('detections', []))
+            mask = arrays['conf'] >= conf_threshold
+            names = [detector_classes[c] if c < len(detector_classes) else f'class_{c}'
+                     for c in arrays['cls'][mask].tolist()]
+            labels = [
+                {'class_name': n, 'bbox': b, 'polygon': None, 'score': s}
+                for n, b, s in zip(names, arrays['xyxy'][mask].tolist(), arrays['conf'][mask].tolist())
+            ]
+            source = 'pseudo'
+        # 不在导出类别表中的类别（显式传入class_names时）直接跳过
+        labels = [label for label in labels if label['class_name'] in class_index]
+        views.append({'view': view, 'width': width, 'height': height, 'labels': labels, 'source': source})
+
+    if fmt == 'coco':
+        labels_path = _write_coco(output_dir / 'labels_coco.json', views, class_names, meta)
+    else:
+        labels_path = _write_yolo(output_dir, views, class_names)
+
+    summary = {
+        'format': fmt,
+        'labels_path': str(labels_path),
+        'num_images': len(views),
+        'num_annotations': sum(len(v['labels']) for v in views),
+        'num_ground_truth_views': num_gt_views,
+        'num_pseudo_views': len(views) - num_gt_views
+    }
+    print(f"🏷️ 导出{fmt.upper()}标注: {summary['num_images']} 张图片, {summary['num_annotations']} 个标注 "
+          f"(真值投影 {num_gt_views} 张, 伪标签 {summary['num_pseudo_views']} 张) -> {labels_path}")
+    return summary
+
+
+def _write_coco(path: Path, views: List[Dict], class_names: List[str], meta: Dict) -> Path:
+    """写出COCO JSON（category_id从1开始，伪标签附带score）"""
+    coco = {
+        'info': {
+            'description': 'generated multi-angle views',
+            'original_image': meta['original_image'],
+            'seed': meta.get('seed'),
+            'date_created': meta.get('generation_time'),
+        },
+        'images': [],
+        'annotations': [],
+        'categories': [{'id': i + 1, 'name': name, 'supercategory': 'none'} for i, name in enumerate(class_names)]
+    }
+    category_ids = {name: i + 1 for i, name in enumerate(class_names)}
+    annotation_id = 1
+    for item in views:
+        view = item['view']
+        coco['images'].append({
+            'id': view['index'],
+            'file_name': view['filename'],
+            'width': int(item['width']),
+            'height': int(item['height']),
+            'label_source': item['source']
+        })
+        for label in item['labels']:
+            x1, y1, x2, y2 = label['bbox']
+            annotation = {
+                'id': annotation_id,
+                'image_id': view['index'],
+                'category_id': category_ids[label['class_name']],
+                'bbox': [round(x1, 2), round(y1, 2), round(x2 - x1, 2), round(y2 - y1, 2)],
+                'area': round((x2 - x1) * (y2 - y1), 2),
+                'segmentation': [],
+                'iscrowd': 0
+            }
+            if label['polygon']:
+                annotation['segmentation'] = [[round(v, 2) for p in label['polygon'] for v in p]]
+                annotation['area'] = round(polygon_area(label['polygon']), 2)
+            if label['score'] is not None:
+                annotation['score'] = round(label['score'], 4)
+            coco['annotations'].append(annotation)
+            annotation_id += 1
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(coco, f, ensure_ascii=False, separators=(',', ':'))
+    tmp_path.replace(path)
+    return path
+
+
+def _write_yolo(output_dir: Path, views: List[Dict], class_names: List[str]) -> Path:
+    """写出YOLO txt（labels/<视角文件名>.txt，归一化 cx cy w h）和 classes.txt"""
+    labels_dir = output_dir / 'labels'
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    class_index = {name: i for i, name in enumerate(class_names)}
+    for item in views:
+        width, height = float(item['width']), float(item['height'])
+        lines = []
+        for label in item['labels']:
+            x1, y1, x2, y2 = label['bbox']
+            lines.append(f"{class_index[label['class_name']]} {(x1 + x2) / 2 / width:.6f} "
+                         f"{(y1 + y2) / 2 / height:.6f} {(x2 - x1) / width:.6f} {(y2 - y1) / height:.6f}")
+        (labels_dir / f"{Path(item['view']['filename']).stem}.txt").write_text(
+            '\n'.join(lines) + ('\n' if lines else ''), encoding='utf-8')
+    (output_dir / 'classes.txt').write_text('\n'.join(class_names) + '\n', encoding='utf-8')
+    return labels_dir
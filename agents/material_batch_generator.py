@@ -7,12 +7,17 @@ Drone Material Batch Generator
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from datetime import datetime
 import json
 import shutil
 from agents.image_quality_analyzer import ImageQualityAnalyzer
 from agents.material_generator_agent import MaterialGeneratorAgent
+from agents.prefetch import PREFETCH_DEPTH
+from agents.source_manifest import SourceManifest, open_manifest
+
+# 在源目录清单中记录处理状态时使用的名称
+MANIFEST_CONSUMER = 'material_batch_generator'
 
 
 class MaterialBatchGenerator:
@@ -35,7 +40,11 @@ class MaterialBatchGenerator:
         output_dir: str,
         min_quality: float = 75.0,
         max_count: Optional[int] = None,
-        dimension_weights: Optional[Dict[str, float]] = None
+        dimension_weights: Optional[Dict[str, float]] = None,
+        prefetch_depth: int = PREFETCH_DEPTH,
+        manifest: Optional[Union[str, SourceManifest]] = None,
+        only_changed: bool = True,
+        full_scan: bool = False
     ) -> Dict:
         """
         从源目录批量生成高质量素材
@@ -46,6 +55,11 @@ class MaterialBatchGenerator:
             min_quality: 最低质量分数
             max_count: 最大生成数量（None表示不限制）
             dimension_weights: 维度权重（用于自定义评分）
+            prefetch_depth: 分析时的预读取深度（见 agents.prefetch）
+            manifest: 可选，源目录清单（SourceManifest或清单SQLite路径，见 agents.source_manifest），
+                      指定时先增量扫描，不再全量遍历源目录
+            only_changed: 使用清单时只处理上次处理后新增或大小/mtime变化的图片
+            full_scan: 使用清单时重新列出所有目录，发现就地改写的文件（增量扫描只列出mtime变化的目录）
             
         返回:
             生成结果字典
@@ -55,11 +69,22 @@ class MaterialBatchGenerator:
         output_path.mkdir(parents=True, exist_ok=True)
         
         # 获取所有图片
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
-        image_paths = [
-            str(p) for p in source_path.rglob('*')
-            if p.suffix.lower() in image_extensions
-        ]
+        if manifest is not None:
+            manifest = open_manifest(manifest, root=source_path, full_scan=full_scan)
+            image_paths = manifest.pending(MANIFEST_CONSUMER) if only_changed else manifest.paths()
+            if not image_paths and len(manifest):
+                return {
+                    'success': True,
+                    'message': f'{source_dir} 中没有新增或变化的图片',
+                    'total_images': 0,
+                    'generated_count': 0
+                }
+        else:
+            image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
+            image_paths = [
+                str(p) for p in source_path.rglob('*')
+                if p.suffix.lower() in image_extensions
+            ]
         
         if not image_paths:
             return {
@@ -72,10 +97,13 @@ class MaterialBatchGenerator:
         print(f"📸 找到 {len(image_paths)} 张图片，开始分析...")
         
         # 批量分析
-        analysis_result = self.agent.analyze_and_evaluate(image_paths)
+        analysis_result = self.agent.analyze_and_evaluate(image_paths, prefetch_depth=prefetch_depth)
         
         # 筛选高质量素材
         quality_scores = analysis_result['quality_evaluation']
+        if manifest is not None:
+            # 分析失败的图片不记录，下次仍会处理
+            manifest.mark_processed(MANIFEST_CONSUMER, [q['image_path'] for q in quality_scores])
         
         # 应用自定义权重（如果有）
         if dimension_weights:
@@ -3,26 +3,13 @@ GPU加速版素材自动增强训练器（基于提升幅度评估）
 """
 import numpy as np
 
-# 延迟导入 OpenCV
-_cv2_available = None
-_cv2 = None
-
-def _get_cv2():
-    """延迟导入 OpenCV，如果失败返回 None"""
-    global _cv2_available, _cv2
-    if _cv2_available is None:
-        try:
-            import cv2
-            _cv2 = cv2
-            _cv2_available = True
-        except (ImportError, OSError):
-            _cv2_available = False
-    return _cv2 if _cv2_available else None
+from agents.image_backend import get_cv2
 from PIL import Image
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from agents.image_quality_analyzer import ImageQualityAnalyzer
 from agents.material_generator_agent import MaterialGeneratorAgent
+from agents.prefetch import PREFETCH_DEPTH, prefetch_images
 import torch
 import torch.nn.functional as F
 
@@ -42,11 +29,10 @@ class MaterialEnhancementTrainer:
         self.max_iterations = 10
         self.fast_mode = fast_mode
         self.analysis_max_side = analysis_max_side
-        self.temp_dir = Path("temp_enhancement_cache")
-        self.temp_dir.mkdir(exist_ok=True)
 
     def enhance_to_excellent(self, image_path: str, output_dir: str,
-                             target_improvement: float = 5.0, max_iterations: int = 10) -> Dict:
+                             target_improvement: float = 5.0, max_iterations: int = 10,
+                             image: Optional[np.ndarray] = None) -> Dict:
         """
         增强图片质量，目标为提升指定分数
         
@@ -55,27 +41,30 @@ class MaterialEnhancementTrainer:
             output_dir: 输出目录
             target_improvement: 目标提升分数（默认5分）
             max_iterations: 最大迭代次数
+            image: 可选，已解码的BGR图片（批量增强时由预读取线程提供），为None时从image_path读取
         """
         input_path = Path(image_path)
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
-        if not input_path.exists():
+        if image is None and not input_path.exists():
             raise FileNotFoundError(f"输入图片不存在: {image_path}")
 
-        cv2 = _get_cv2()
+        cv2 = get_cv2()
         if cv2 is None:
             raise RuntimeError("OpenCV 不可用，无法执行增强训练")
         
-        img = cv2.imread(str(input_path))
+        img = image
+        if img is None:
+            img = cv2.imread(str(input_path))
         if img is None:
             pil_img = Image.open(input_path)
             img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
 
-        # 获取初始分数
-        temp_path = self._write_temp_image(img, "initial.jpg")
-        initial_analysis = self.analyzer.analyze_single_image(str(temp_path))
-        if temp_path.exists():
-            temp_path.unlink()
+        # 获取初始分数（在内存中分析，不写临时文件）；图片数据量维度始终按原文件大小和原图尺寸计算，
+        # 分数变化只反映增强本身
+        file_size = input_path.stat().st_size if input_path.exists() else None
+        full_size = (img.shape[1], img.shape[0])
+        initial_analysis = self._analyze(img, file_size, full_size)
         
         initial_scores = [initial_analysis[dim] for dim in self.analyzer.dimensions]
         initial_score = float(np.mean(initial_scores))
@@ -84,10 +73,7 @@ class MaterialEnhancementTrainer:
         iteration_history = []
 
         for iteration in range(max_iterations):
-            temp_path = self._write_temp_image(current_img, f"iter_{iteration}.jpg")
-            analysis_result = self.analyzer.analyze_single_image(str(temp_path))
-            if temp_path.exists():
-                temp_path.unlink()
+            analysis_result = self._analyze(current_img, file_size, full_size)
 
             scores = [analysis_result[dim] for dim in self.analyzer.dimensions]
             current_score = float(np.mean(scores))
@@ -117,7 +103,7 @@ class MaterialEnhancementTrainer:
             # 如果达到目标提升幅度，提前结束
             if improvement >= target_improvement:
                 final_path = output_path / f"enhanced_final_{input_path.stem}.jpg"
-                cv2_local = _get_cv2()
+                cv2_local = get_cv2()
                 if cv2_local is None:
                     raise RuntimeError("OpenCV 不可用")
                 cv2_local.imwrite(str(final_path), current_img, [cv2_local.IMWRITE_JPEG_QUALITY, 95])
@@ -138,7 +124,7 @@ class MaterialEnhancementTrainer:
 
         # 达到最大迭代次数
         final_path = output_path / f"enhanced_final_{input_path.stem}.jpg"
-        cv2_local = _get_cv2()
+        cv2_local = get_cv2()
         if cv2_local is None:
             raise RuntimeError("OpenCV 不可用")
         cv2_local.imwrite(str(final_path), current_img, [cv2_local.IMWRITE_JPEG_QUALITY, 95])
@@ -166,7 +152,9 @@ class MaterialEnhancementTrainer:
         }
 
     def enhance_batch_to_excellent(self, image_paths: List[str], output_dir: str,
-                                   target_improvement: float = 5.0, max_iterations: int = 10) -> Dict:
+                                   target_improvement: float = 5.0, max_iterations: int = 10,
+                                   progress_callback: Optional[Callable[[int, int], None]] = None,
+                                   prefetch_depth: int = PREFETCH_DEPTH) -> Dict:
         """
         批量增强图片质量
         
@@ -175,15 +163,24 @@ class MaterialEnhancementTrainer:
             output_dir: 输出目录
             target_improvement: 目标提升分数
             max_iterations: 最大迭代次数
+            progress_callback: 进度回调 (已完成数, 总数)，每张图片开始前调用
+            prefetch_depth: 预读取深度，增强当前图片时后台线程按顺序读取并解码后面的图片（全分辨率）
         """
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         batch_results = []
-        for img_path in image_paths:
+        for i, record in enumerate(prefetch_images(image_paths, depth=prefetch_depth)):
+            if progress_callback:
+                progress_callback(i, len(image_paths))
+            img_path = record['image_path']
+            if record.get('error'):
+                batch_results.append({'success': False, 'original_path': img_path, 'error': record['error']})
+                continue
             try:
                 img_output_dir = output_path / Path(img_path).stem
                 result = self.enhance_to_excellent(img_path, str(img_output_dir),
-                                                   target_improvement, max_iterations)
+                                                   target_improvement, max_iterations,
+                                                   image=record['image'])
                 result['original_path'] = img_path
                 batch_results.append(result)
             except Exception as e:
@@ -225,11 +222,11 @@ class MaterialEnhancementTrainer:
         img = (tensor.permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
         return img[:, :, ::-1]
 
-    def _write_temp_image(self, img: np.ndarray, filename: str) -> Path:
-        cv2_local = _get_cv2()
+    def _analyze(self, img: np.ndarray, file_size: Optional[int], full_size: tuple) -> Dict:
+        """在内存中分析图片的8个维度（fast_mode下先缩小到 analysis_max_side）"""
+        cv2_local = get_cv2()
         if cv2_local is None:
             raise RuntimeError("OpenCV 不可用")
-        temp_path = self.temp_dir / filename
         processed = img
         if self.fast_mode and self.analysis_max_side:
             h, w = img.shape[:2]
@@ -238,9 +235,7 @@ class MaterialEnhancementTrainer:
                 scale = self.analysis_max_side / max_side
                 new_size = (int(w * scale), int(h * scale))
                 processed = cv2_local.resize(img, new_size, interpolation=cv2_local.INTER_AREA)
-        quality = 85 if self.fast_mode else 95
-        cv2_local.imwrite(str(temp_path), processed, [cv2_local.IMWRITE_JPEG_QUALITY, quality])
-        return temp_path
+        return self.analyzer.analyze_image_array(processed, file_size, full_size)
 
     def _select_enhancement_strategy(self, scores: Dict) -> List[str]:
         th = 50.0  # 降低阈值，因为VisDrone数据集分数本身较低
@@ -7,10 +7,11 @@ Drone Material Generator Agent
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 import json
 from agents.image_quality_analyzer import ImageQualityAnalyzer
+from agents.prefetch import PREFETCH_DEPTH
 
 
 class MaterialGeneratorAgent:
@@ -27,18 +28,23 @@ class MaterialGeneratorAgent:
         self.material_database = []  # 素材数据库
         self.quality_threshold = 70.0  # 质量阈值
         
-    def analyze_and_evaluate(self, image_paths: List[str]) -> Dict:
+    def analyze_and_evaluate(self, image_paths: List[Union[str, Dict]],
+                             progress_callback: Optional[Callable[[int, int], None]] = None,
+                             prefetch_depth: int = PREFETCH_DEPTH) -> Dict:
         """
         分析图片并评估质量
         
         参数:
-            image_paths: 图片路径列表
+            image_paths: 图片路径列表（或内存图片记录，见 ImageQualityAnalyzer.analyze_batch）
+            progress_callback: 进度回调 (已完成数, 总数)
+            prefetch_depth: 预读取深度（见 agents.prefetch）
             
         返回:
             分析结果和质量评估
         """
         # 批量分析
-        analysis_results = self.analyzer.analyze_batch(image_paths)
+        analysis_results = self.analyzer.analyze_batch(image_paths, progress_callback=progress_callback,
+                                                       prefetch_depth=prefetch_depth)
         
         # 评估每张图片的综合质量
         quality_scores = []
@@ -146,19 +152,21 @@ class MaterialGeneratorAgent:
         
         return str(report_path)
     
-    def filter_high_quality_materials(self, image_paths: List[str], 
-                                      min_score: float = 70.0) -> List[str]:
+    def filter_high_quality_materials(self, image_paths: List[Union[str, Dict]], 
+                                      min_score: float = 70.0,
+                                      progress_callback: Optional[Callable[[int, int], None]] = None) -> List[str]:
         """
         筛选高质量素材
         
         参数:
-            image_paths: 图片路径列表
+            image_paths: 图片路径列表（或内存图片记录，见 ImageQualityAnalyzer.analyze_batch）
             min_score: 最低质量分数
+            progress_callback: 进度回调 (已完成数, 总数)
             
         返回:
-            高质量图片路径列表
+            高质量图片路径列表（内存图片记录返回其 image_path 名称）
         """
-        results = self.analyze_and_evaluate(image_paths)
+        results = self.analyze_and_evaluate(image_paths, progress_callback=progress_callback)
         high_quality = [
             q['image_path'] for q in results['quality_evaluation']
             if q['average_score'] >= min_score
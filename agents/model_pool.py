@@ -0,0 +1,87 @@
+"""
+模型实例池
+Model Instance Pool
+
+进程级共享、数量有界的模型实例池：多个会话/线程复用同一批已加载权重的实例，
+每次使用时独占借出一个实例，用完归还，实例总数不超过max_size
+"""
+
+import contextlib
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+
+class ModelPool:
+    """有界模型实例池"""
+
+    def __init__(self, factory: Callable[[], Any], max_size: int = 1, name: str = "model"):
+        """
+        初始化实例池
+
+        参数:
+            factory: 创建实例的无参函数（实例在首次需要时才创建）
+            max_size: 最多创建的实例数
+            name: 池名称，用于错误信息
+        """
+        if max_size < 1:
+            raise ValueError(f"max_size必须 >= 1，当前为 {max_size}")
+        self.factory = factory
+        self.max_size = max_size
+        self.name = name
+        # 后进先出，优先复用刚归还（缓存较热）的实例
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @property
+    def created(self) -> int:
+        """已创建的实例数"""
+        return self._created
+
+    def warm_up(self) -> 'ModelPool':
+        """确保至少创建了一个实例，初始化失败时直接抛出异常"""
+        with self.lease():
+            pass
+        return self
+
+    @contextlib.contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """
+        独占借出一个实例，退出上下文时归还
+
+        参数:
+            timeout: 所有实例都被占用时的最长等待秒数，None表示一直等待
+
+        异常:
+            TimeoutError: 等待超时
+        """
+        instance = self._acquire(timeout)
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def _acquire(self, timeout: Optional[float]):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"{self.name} 实例池已满（{self.max_size}个），等待 {timeout}s 超时")
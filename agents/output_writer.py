@@ -0,0 +1,212 @@
+"""
+输出图片编码
+Output Writer
+
+生成的视角原来在主线程逐张 cv2.imwrite，24个4K视角的编码是每个任务串行的长尾。这里：
+- EncodeOptions 描述输出格式（JPEG/WebP/PNG）、质量、optimize/progressive、色度抽样
+- encode_to_file 直接编码到文件（不在内存中保留编码后的字节副本），返回写入字节数和耗时
+- OutputWriter 用线程池并行编码（cv2.imwrite 执行时释放GIL），
+  待处理任务数有上限，队列满时 submit 阻塞（背压），内存中最多保留有限张待编码图片
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+
+from agents.image_backend import get_cv2
+
+# 输出格式 -> 文件扩展名
+OUTPUT_FORMATS = {'jpeg': '.jpg', 'webp': '.webp', 'png': '.png'}
+# 色度抽样 -> (OpenCV IMWRITE_JPEG_SAMPLING_FACTOR 常量名, PIL subsampling 取值)
+CHROMA_SUBSAMPLING = {
+    '444': ('IMWRITE_JPEG_SAMPLING_FACTOR_444', 0),
+    '422': ('IMWRITE_JPEG_SAMPLING_FACTOR_422', 1),
+    '420': ('IMWRITE_JPEG_SAMPLING_FACTOR_420', 2),
+}
+# 编码线程数（环境变量 ENCODE_WORKERS，默认最多4个）
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+class EncodeOptions:
+    """输出编码参数（默认与原来的 JPEG 质量95 相同）"""
+
+    def __init__(self, fmt: str = 'jpeg', quality: int = 95, optimize: bool = False,
+                 progressive: bool = False, chroma_subsampling: Optional[str] = None,
+                 png_compression: int = 3):
+        """
+        参数:
+            fmt: 'jpeg' / 'webp' / 'png'
+            quality: JPEG/WebP质量（1-100，WebP超过100为无损）
+            optimize: JPEG优化哈夫曼表（文件更小，编码稍慢）
+            progressive: JPEG渐进式编码
+            chroma_subsampling: JPEG色度抽样 '444'/'422'/'420'，None使用编码器默认（4:2:0）
+            png_compression: PNG压缩级别（0-9）
+        """
+        fmt = fmt.lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}，可选: {', '.join(OUTPUT_FORMATS)}")
+        if chroma_subsampling is not None and chroma_subsampling not in CHROMA_SUBSAMPLING:
+            raise ValueError(f"不支持的色度抽样: {chroma_subsampling}，可选: {', '.join(CHROMA_SUBSAMPLING)}")
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.optimize = optimize
+        self.progressive = progressive
+        self.chroma_subsampling = chroma_subsampling
+        self.png_compression = int(png_compression)
+
+    @property
+    def extension(self) -> str:
+        return OUTPUT_FORMATS[self.fmt]
+
+    def to_dict(self) -> Dict:
+        """记录到元数据JSON"""
+        return {'format': self.fmt, 'quality': self.quality, 'optimize': self.optimize,
+                'progressive': self.progressive, 'chroma_subsampling': self.chroma_subsampling,
+                'png_compression': self.png_compression}
+
+    def cv2_params(self, cv2) -> list:
+        """OpenCV imencode 参数"""
+        if self.fmt == 'png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        if self.fmt == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, int(self.optimize),
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.progressive)]
+        if self.chroma_subsampling is not None:
+            # OpenCV 4.5.5 起支持设置色度抽样，旧版本忽略该选项
+            factor = getattr(cv2, CHROMA_SUBSAMPLING[self.chroma_subsampling][0], None)
+            if factor is not None:
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, factor]
+        return params
+
+    def pil_params(self) -> Dict:
+        """PIL save 参数（OpenCV不可用时）"""
+        if self.fmt == 'png':
+            return {'format': 'PNG', 'compress_level': self.png_compression}
+        if self.fmt == 'webp':
+            return {'format': 'WEBP', 'quality': min(self.quality, 100), 'lossless': self.quality > 100}
+        params = {'format': 'JPEG', 'quality': self.quality, 'optimize': self.optimize,
+                  'progressive': self.progressive}
+        if self.chroma_subsampling is not None:
+            params['subsampling'] = CHROMA_SUBSAMPLING[self.chroma_subsampling][1]
+        return params
+
+
+def encode_image(img: np.ndarray, options: Optional[EncodeOptions] = None) -> bytes:
+    """把BGR或灰度图片编码为字节"""
+    options = options or EncodeOptions()
+    cv2 = get_cv2()
+    if cv2 is not None:
+        ok, buffer = cv2.imencode(options.extension, img, options.cv2_params(cv2))
+        if ok:
+            return buffer.tobytes()
+    # OpenCV不可用或编码失败时使用PIL
+    import io
+    from PIL import Image
+    pil_img = Image.fromarray(np.ascontiguousarray(img[:, :, ::-1]) if img.ndim == 3 else img)
+    stream = io.BytesIO()
+    pil_img.save(stream, **options.pil_params())
+    return stream.getvalue()
+
+
+def encode_to_file(img: np.ndarray, path: Union[str, Path], options: Optional[EncodeOptions] = None) -> Dict:
+    """
+    编码并写入文件
+
+    编码器直接写文件（cv2.imwrite / PIL save），不经过 imencode + tobytes 的两份内存副本，
+    分块模式的磁盘画布也不会被整体读入内存；写入字节数取自文件大小
+
+    返回:
+        {'path', 'format', 'bytes': 写入字节数, 'encode_ms': 编码耗时（毫秒，含写盘）}
+    """
+    options = options or EncodeOptions()
+    path = str(path)
+    start = time.perf_counter()
+    cv2 = get_cv2()
+    if cv2 is None or not cv2.imwrite(path, img, options.cv2_params(cv2)):
+        # OpenCV不可用或写入失败（例如路径含非ASCII字符的Windows环境）时使用PIL
+        from PIL import Image
+        pil_img = Image.fromarray(np.ascontiguousarray(img[:, :, ::-1]) if img.ndim == 3 else img)
+        pil_img.save(path, **options.pil_params())
+    encode_ms = (time.perf_counter() - start) * 1000
+    return {'path': path, 'format': options.fmt, 'bytes': os.stat(path).st_size, 'encode_ms': round(encode_ms, 2)}
+
+
+class OutputWriter:
+    """
+    线程池并行编码输出图片，待处理任务数有上限（背压）
+
+    用法:
+        with OutputWriter(options) as writer:
+            writer.submit(img, path)
+        writer.results  # 路径 -> encode_to_file 的返回值，失败时为 {'path', 'error'}
+    """
+
+    def __init__(self, options: Optional[EncodeOptions] = None, workers: int = ENCODE_WORKERS,
+                 max_pending: Optional[int] = None):
+        """
+        参数:
+            options: 编码参数
+            workers: 编码线程数
+            max_pending: 最多同时持有的待编码图片数（默认为线程数的2倍），达到上限时 submit 阻塞
+        """
+        self.options = options or EncodeOptions()
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='encoder')
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 2)
+        self._lock = threading.Lock()
+        self.results = {}
+
+    def submit(self, img: np.ndarray, path: Union[str, Path],
+               after: Optional[Callable[[np.ndarray, Path], None]] = None) -> Future:
+        """
+        提交一张图片（调用方之后不能再修改img）
+
+        参数:
+            img: BGR或灰度图片数组
+            path: 输出路径
+            after: 可选，写入成功后在编码线程中调用 after(img, path)，例如写出预览图
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, img, Path(path), after)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def write(self, img: np.ndarray, path: Union[str, Path]) -> Dict:
+        """在当前线程同步编码（例如分块模式的磁盘画布，不适合排队持有），结果同样记录到 results"""
+        return self._write(img, Path(path), None)
+
+    def _write(self, img: np.ndarray, path: Path, after):
+        try:
+            result = encode_to_file(img, path, self.options)
+            if after is not None:
+                after(img, path)
+        except Exception as e:
+            print(f"⚠️ 图片编码失败 {path.name}: {e}")
+            result = {'path': str(path), 'error': str(e)}
+        with self._lock:
+            self.results[str(path)] = result
+        return result
+
+    def close(self):
+        """等待所有已提交的图片编码完成"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
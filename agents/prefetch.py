@@ -0,0 +1,103 @@
+"""
+图片预读取
+Prefetching Image Source
+
+批量分析/增强原来读一张、处理一张，网络存储上读取期间CPU空闲。这里用读取线程池提前读取字节并解码：
+- 最多提前 depth 张（有界队列），内存中同时持有的图片数有上限
+- 按输入顺序产出，消费方的进度和结果顺序不变
+- 文件缺失、损坏或读取超时只产出一条带 error 的记录，不阻塞后续图片
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+from agents.image_ingest import decode_reduced
+
+# 预读取深度和读取线程数（环境变量 PREFETCH_DEPTH / PREFETCH_WORKERS）
+PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', 4))
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))
+
+
+def load_record(path: str, target_side: Optional[int] = None, defer_tiled: bool = False) -> Dict:
+    """
+    读取并解码一张图片（在读取线程中执行）
+
+    参数:
+        path: 图片路径
+        target_side: 分析用的目标尺寸，JPEG按缩小尺寸解码；None为全分辨率
+        defer_tiled: 达到分块模式阈值的超大图片不预读取，记录中 image 为None、deferred为True，
+                     由消费方按路径分块处理
+
+    返回:
+        {'image_path', 'image', 'file_size', 'full_size'}，失败时 image 为None并带 'error'
+    """
+    record = {'image_path': path, 'image': None, 'file_size': None, 'full_size': None}
+    try:
+        if defer_tiled:
+            from agents.tiling import should_tile
+            if should_tile(path):
+                record['deferred'] = True
+                return record
+        data = Path(path).read_bytes()
+        record['file_size'] = len(data)
+        record['image'], record['full_size'] = decode_reduced(data, target_side)
+        if record['image'] is None:
+            record['error'] = '无法解码（文件损坏或格式不支持）'
+    except Exception as e:
+        record['error'] = str(e)
+    return record
+
+
+def prefetch_images(items: Iterable[Union[str, Path, Dict]], depth: int = PREFETCH_DEPTH,
+                    workers: int = PREFETCH_WORKERS, target_side: Optional[int] = None,
+                    defer_tiled: bool = False, timeout: Optional[float] = None) -> Iterator[Dict]:
+    """
+    按输入顺序产出预读取的图片记录
+
+    参数:
+        items: 图片路径；已解码的内存图片记录（dict，见 agents.image_ingest.decode_uploads）原样产出
+        depth: 最多提前读取的图片数
+        workers: 读取线程数
+        target_side / defer_tiled: 见 load_record
+        timeout: 单张图片的最长等待时间（秒），超时产出带 error 的记录并继续
+
+    返回:
+        记录迭代器（格式见 load_record）
+    """
+    depth = max(1, depth)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, depth)), thread_name_prefix='prefetch')
+    pending = deque()
+    source = iter(items)
+
+    def fill():
+        while len(pending) < depth:
+            item = next(source, None)
+            if item is None:
+                return
+            if isinstance(item, dict):
+                pending.append((item['image_path'], item))
+            else:
+                path = str(item)
+                pending.append((path, executor.submit(load_record, path, target_side, defer_tiled)))
+
+    try:
+        fill()
+        while pending:
+            path, job = pending.popleft()
+            if isinstance(job, dict):
+                record = job
+            else:
+                try:
+                    record = job.result(timeout=timeout)
+                except FutureTimeout:
+                    record = {'image_path': path, 'image': None, 'file_size': None, 'full_size': None,
+                              'error': f'读取超时（{timeout}s）'}
+            # 先补充队列再产出，消费方处理当前图片时后面的图片已经在读取
+            fill()
+            yield record
+    finally:
+        # 消费方提前结束（break/异常）时取消尚未开始的读取
+        executor.shutdown(wait=False, cancel_futures=True)
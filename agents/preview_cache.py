@@ -0,0 +1,101 @@
+"""
+预览图缓存
+Preview Thumbnail Cache
+
+为生成/增强的素材保存缩小后的预览图（WebP，不支持时回退JPEG），
+存放在输出目录下的 .previews 子目录中。结果画廊只加载预览图，
+不再每次重跑都解码全分辨率原图
+"""
+
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+# 预览图最长边（像素）
+PREVIEW_MAX_SIDE = 512
+PREVIEW_DIR_NAME = ".previews"
+PREVIEW_QUALITY = 80
+
+
+def preview_path(image_path: Union[str, Path], fmt: str = "webp") -> Path:
+    """原图对应的预览图路径：<原图目录>/.previews/<文件名>.<fmt>"""
+    image_path = Path(image_path)
+    return image_path.parent / PREVIEW_DIR_NAME / f"{image_path.stem}.{fmt}"
+
+
+def _save_preview(pil_img: Image.Image, image_path: Union[str, Path]) -> Optional[Path]:
+    """保存预览图，优先WebP，失败时回退JPEG"""
+    for fmt, save_format in (("webp", "WEBP"), ("jpg", "JPEG")):
+        target = preview_path(image_path, fmt)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            pil_img.save(str(target), save_format, quality=PREVIEW_QUALITY)
+            return target
+        except Exception:
+            continue
+    return None
+
+
+def make_preview(img: np.ndarray, max_side: int = PREVIEW_MAX_SIDE) -> Image.Image:
+    """把BGR或灰度图片数组缩小为预览用的PIL图片（不写磁盘）"""
+    if img.ndim == 3:
+        pil_img = Image.fromarray(np.ascontiguousarray(img[:, :, ::-1]))
+    else:
+        pil_img = Image.fromarray(img)
+    pil_img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    return pil_img
+
+
+def write_preview(img: np.ndarray, image_path: Union[str, Path],
+                  max_side: int = PREVIEW_MAX_SIDE) -> Optional[Path]:
+    """
+    用内存中的图片数组写出预览图（在保存原图的同时调用，避免再次解码）
+
+    参数:
+        img: BGR或灰度图片数组
+        image_path: 原图路径
+        max_side: 预览图最长边
+
+    返回:
+        预览图路径，失败时返回None
+    """
+    try:
+        return _save_preview(make_preview(img, max_side), image_path)
+    except Exception as e:
+        print(f"⚠️ 预览图生成失败 {Path(image_path).name}: {e}")
+        return None
+
+
+def load_preview(image_path: Union[str, Path], max_side: int = PREVIEW_MAX_SIDE) -> Image.Image:
+    """
+    从磁盘加载缩小后的图片（不写缓存）
+
+    JPEG使用draft()在解码时直接按1/2、1/4、1/8缩小，不解码全分辨率像素
+    """
+    img = Image.open(image_path)
+    img.draft('RGB', (max_side, max_side))
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    return img
+
+
+def get_preview(image_path: Union[str, Path], max_side: int = PREVIEW_MAX_SIDE) -> Path:
+    """
+    获取原图的预览图路径；还没有预览图（例如旧的输出）时生成一次并缓存
+
+    返回:
+        预览图路径，生成失败时返回原图路径
+    """
+    image_path = Path(image_path)
+    for fmt in ("webp", "jpg"):
+        cached = preview_path(image_path, fmt)
+        if cached.exists() and cached.stat().st_mtime >= image_path.stat().st_mtime:
+            return cached
+    try:
+        saved = _save_preview(load_preview(image_path, max_side), image_path)
+    except Exception:
+        saved = None
+    return saved or image_path
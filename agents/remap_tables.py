@@ -0,0 +1,215 @@
+"""
+镜头畸变重映射表
+Lens Remap Tables
+
+鱼眼、桶形/枕形畸变和柱面全景投影都是逐像素的 cv2.remap。这里统一：
+- 用NumPy向量化一次性构建映射表（目标像素 -> 源图坐标），不再用Python双重循环逐像素计算
+- 连续参数先按步长量化（参数桶），同一 (类型, 高, 宽, 参数桶) 只构建一次
+- 映射表放在按字节数限制大小的LRU缓存中（环境变量 REMAP_CACHE_MB，默认256MB）
+- 单独使用时转换为定点格式（cv2.convertMaps -> CV_16SC2），remap更快、内存更少
+- 前面紧跟的透视变换可以合并进映射表（compose_homography），一次remap完成两步
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from agents.image_backend import get_cv2
+
+REMAP_CACHE_BYTES = int(float(os.environ.get('REMAP_CACHE_MB', 256)) * 1024 * 1024)
+
+# 各类型的参数量化步长；参数为相对尺寸的比例或无量纲系数，与分辨率无关
+PARAM_STEPS = {
+    'fisheye': {'strength': 0.05, 'offset_x': 0.01, 'offset_y': 0.01},
+    'barrel': {'k1': 0.02, 'k2': 0.02},
+    'pincushion': {'k1': 0.02, 'k2': 0.02},
+    'cylindrical': {'fov': 5.0},
+}
+
+
+def bucket_params(kind: str, params: Dict[str, float]) -> Tuple[Tuple[str, float], ...]:
+    """把连续参数量化到参数桶（渲染使用量化后的值，保证同一桶的结果一致）"""
+    steps = PARAM_STEPS[kind]
+    return tuple((name, round(round(params[name] / step) * step, 6)) for name, step in sorted(steps.items()))
+
+
+def _pixel_grid(h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """目标图片的像素坐标网格（float32）"""
+    return np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+
+
+def _fisheye_maps(h: int, w: int, strength: float, offset_x: float, offset_y: float):
+    """鱼眼：半径按 r² × strength 重新采样（与原逐像素实现相同的公式）"""
+    x, y = _pixel_grid(h, w)
+    center_x, center_y = w // 2, h // 2
+    max_radius = min(center_x, center_y)
+    dx = x - center_x + offset_x * w
+    dy = y - center_y + offset_y * h
+    r = np.sqrt(dx * dx + dy * dy) / max_radius
+    # 方向向量 (cos θ, sin θ) = (dx, dy) / (r × max_radius)，r_new × max_radius × 方向 = r × strength × (dx, dy)
+    scale = r * strength
+    map_x = np.where(r > 0, center_x + scale * dx, x)
+    map_y = np.where(r > 0, center_y + scale * dy, y)
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+def _radial_maps(h: int, w: int, k1: float, k2: float):
+    """径向畸变：r_src = r × (1 + k1·r² + k2·r⁴)，r按半对角线归一化；k>0为桶形，k<0为枕形"""
+    x, y = _pixel_grid(h, w)
+    cx, cy = (w - 1) / 2.0, (h - 1) / 2.0
+    norm = np.hypot(cx, cy)
+    nx, ny = (x - cx) / norm, (y - cy) / norm
+    r2 = nx * nx + ny * ny
+    factor = 1.0 + k1 * r2 + k2 * r2 * r2
+    return (cx + nx * factor * norm).astype(np.float32), (cy + ny * factor * norm).astype(np.float32)
+
+
+def _cylindrical_maps(h: int, w: int, fov: float):
+    """柱面全景投影：水平视场角fov（度），目标列对应柱面角度，采样平面图上的位置"""
+    x, y = _pixel_grid(h, w)
+    cx, cy = (w - 1) / 2.0, (h - 1) / 2.0
+    focal = (w / 2.0) / np.tan(np.radians(fov) / 2.0)
+    theta = (x - cx) / focal
+    map_x = focal * np.tan(theta) + cx
+    map_y = (y - cy) / np.cos(theta) + cy
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+_BUILDERS = {
+    'fisheye': _fisheye_maps,
+    'barrel': _radial_maps,
+    'pincushion': _radial_maps,
+    'cylindrical': _cylindrical_maps,
+}
+
+
+def build_maps(kind: str, h: int, w: int, params: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    构建float32映射表（不经过缓存）
+
+    返回:
+        (map_x, map_y)，形状均为 (h, w)
+    """
+    if kind not in _BUILDERS:
+        raise ValueError(f"未知的映射表类型: {kind}，可选: {', '.join(_BUILDERS)}")
+    return _BUILDERS[kind](h, w, **params)
+
+
+def compose_homography(map_x: np.ndarray, map_y: np.ndarray, homography: np.ndarray):
+    """
+    把映射表之前的透视变换合并进映射表
+
+    原流程 src --H--> 中间图 --remap--> dst，中间图上的点 p 对应源图上的 H⁻¹·p，
+    合并后一次remap直接从源图采样
+
+    返回:
+        合并后的 (map_x, map_y) float32
+    """
+    inv = np.linalg.inv(np.asarray(homography, dtype=np.float64)).astype(np.float32)
+    denom = inv[2, 0] * map_x + inv[2, 1] * map_y + inv[2, 2]
+    denom = np.where(np.abs(denom) < 1e-8, np.float32(1e-8), denom)
+    src_x = (inv[0, 0] * map_x + inv[0, 1] * map_y + inv[0, 2]) / denom
+    src_y = (inv[1, 0] * map_x + inv[1, 1] * map_y + inv[1, 2]) / denom
+    return src_x.astype(np.float32, copy=False), src_y.astype(np.float32, copy=False)
+
+
+class RemapTableCache:
+    """按字节数限制大小的映射表LRU缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int = REMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, h: int, w: int, params: Dict[str, float], fixed_point: bool = True):
+        """
+        获取映射表，未命中时构建并缓存
+
+        参数:
+            kind: 'fisheye' / 'barrel' / 'pincushion' / 'cylindrical'
+            h, w: 图片尺寸
+            params: 连续参数（会先量化到参数桶）
+            fixed_point: True返回定点映射 (CV_16SC2, CV_16UC1)，False返回float32 (map_x, map_y)
+
+        返回:
+            (map1, map2)，可直接传给 cv2.remap
+        """
+        bucket = bucket_params(kind, params)
+        key = (kind, h, w, bucket, fixed_point)
+        with self._lock:
+            maps = self._tables.get(key)
+            if maps is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return maps
+            self.misses += 1
+
+        if fixed_point:
+            # 定点表由float32表转换，float32表同时进入缓存供合并透视变换使用
+            map_x, map_y = self.get(kind, h, w, params, fixed_point=False)
+            cv2 = get_cv2()
+            maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        else:
+            maps = build_maps(kind, h, w, dict(bucket))
+            # 缓存中的数组被多个线程共享，设为只读避免被意外修改
+            for m in maps:
+                m.setflags(write=False)
+
+        size = sum(m.nbytes for m in maps)
+        with self._lock:
+            if key not in self._tables and size <= self.max_bytes:
+                self._tables[key] = maps
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._tables.popitem(last=False)
+                    self._bytes -= sum(m.nbytes for m in evicted)
+        return maps
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'tables': len(self._tables), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+# 进程级共享缓存
+remap_cache = RemapTableCache()
+
+
+def apply_lens(img: np.ndarray, kind: str, params: Dict[str, float],
+               pre_homography: Optional[np.ndarray] = None,
+               border_mode: Optional[int] = None) -> np.ndarray:
+    """
+    对图片应用镜头映射（一次remap）
+
+    参数:
+        img: 输入图片
+        kind: 映射表类型
+        params: 连续参数
+        pre_homography: 可选，映射之前的透视变换（3x3），合并进映射表后一次remap完成
+        border_mode: 边界模式，默认 BORDER_CONSTANT（黑边）
+
+    返回:
+        变换后的图片
+    """
+    cv2 = get_cv2()
+    h, w = img.shape[:2]
+    if border_mode is None:
+        border_mode = cv2.BORDER_CONSTANT
+    if pre_homography is None:
+        map1, map2 = remap_cache.get(kind, h, w, params, fixed_point=True)
+    else:
+        # 合并后的表只用一次，直接用float32表remap，省去定点转换
+        map_x, map_y = remap_cache.get(kind, h, w, params, fixed_point=False)
+        map1, map2 = compose_homography(map_x, map_y, pre_homography)
+    return cv2.remap(img, map1, map2, cv2.INTER_LINEAR, borderMode=border_mode, borderValue=(0, 0, 0))
@@ -0,0 +1,309 @@
+"""
+源图片目录清单
+Source Manifest
+
+百万级文件的素材库每次 rglob('*') 全量遍历要几分钟，任务开始前CPU一直空等。这里：
+- 用线程池并行 os.scandir 遍历目录，结果（路径、大小、mtime、可选内容哈希）写入SQLite清单
+- 增量扫描：目录mtime未变化时不重新列出该目录（直接使用清单中记录的子目录），只列出有变化的目录
+- 批处理任务按使用方记录已处理的 (大小, mtime)，pending() 只返回新增或大小/mtime变化的图片
+
+注意：就地改写文件内容不会改变所在目录的mtime，增量扫描发现不了；需要时用 scan(full=True)
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+# 与原批处理相同的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+MANIFEST_NAME = '.source_manifest.sqlite'
+# 并行扫描线程数（环境变量 SCAN_WORKERS，网络存储上可以适当调大）
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 16))
+# 每扫描多少个目录提交一次事务
+_COMMIT_EVERY = 200
+
+
+def _scan_directory(path: str, known_mtime: Optional[int], extensions: tuple) -> Dict:
+    """
+    列出一个目录（在扫描线程中执行）
+
+    目录mtime与清单记录相同时不列出，返回 skipped=True，由调用方使用清单中的子目录
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return {'path': path, 'missing': True}
+    if known_mtime is not None and mtime_ns == known_mtime:
+        return {'path': path, 'mtime_ns': mtime_ns, 'skipped': True}
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError:
+        return {'path': path, 'missing': True}
+    return {'path': path, 'mtime_ns': mtime_ns, 'files': files, 'subdirs': subdirs}
+
+
+def _hash_file(path: str, algo: str) -> Optional[str]:
+    try:
+        digest = hashlib.new(algo)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+
+class SourceManifest:
+    """SQLite持久化的源图片目录清单"""
+
+    def __init__(self, root: Optional[Union[str, Path]] = None, db_path: Optional[Union[str, Path]] = None,
+                 extensions: Iterable[str] = IMAGE_EXTENSIONS, workers: int = SCAN_WORKERS,
+                 hash_algo: Optional[str] = None):
+        """
+        参数:
+            root: 源图片根目录；打开已有清单时可以省略（从清单中读取）
+            db_path: 清单SQLite路径，默认为 <root>/.source_manifest.sqlite
+            extensions: 收录的文件扩展名
+            workers: 并行扫描线程数
+            hash_algo: 可选，记录内容哈希的算法（如 'sha1'），只对新增或变化的文件计算
+        """
+        if root is None and db_path is None:
+            raise ValueError("root 和 db_path 至少需要指定一个")
+        self.db_path = str(db_path) if db_path is not None else str(Path(root) / MANIFEST_NAME)
+        # 新建清单必须指定根目录；先检查再连接，避免留下一个空的SQLite文件
+        if root is None and not Path(self.db_path).exists():
+            raise ValueError(f"清单不存在，新建清单需要指定根目录: {self.db_path}")
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.workers = max(1, workers)
+        self.hash_algo = hash_algo
+        self._init_db()
+
+        stored_root = self._get_meta('root')
+        if root is None:
+            if stored_root is None:
+                raise ValueError(f"清单中没有记录根目录: {self.db_path}")
+            root = stored_root
+        self.root = os.path.abspath(str(root))
+        if stored_root is not None and stored_root != self.root:
+            raise ValueError(f"清单属于其他目录: {stored_root}（当前: {self.root}）")
+        self._set_meta('root', self.root)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    dir TEXT NOT NULL,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    hash TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    mtime_ns INTEGER
+                )""")
+            # 各使用方（批处理任务）上次处理时的文件状态
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS processed (
+                    consumer TEXT,
+                    path TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    processed_at REAL,
+                    PRIMARY KEY (consumer, path)
+                )""")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def scan(self, full: bool = False) -> Dict:
+        """
+        扫描根目录并更新清单
+
+        参数:
+            full: True时重新列出所有目录（发现就地改写的文件）；默认只列出mtime变化的目录
+
+        返回:
+            统计 {'dirs_scanned', 'dirs_skipped', 'added', 'changed', 'removed', 'total', 'seconds'}
+        """
+        start = time.perf_counter()
+        stats = {'dirs_scanned': 0, 'dirs_skipped': 0, 'added': 0, 'changed': 0, 'removed': 0}
+        conn = self._connect()
+        try:
+            known = {}
+            children = {}
+            for path, parent, mtime_ns in conn.execute("SELECT path, parent, mtime_ns FROM dirs"):
+                known[path] = mtime_ns
+                children.setdefault(parent, []).append(path)
+            if not os.path.isdir(self.root):
+                raise FileNotFoundError(f"源目录不存在: {self.root}")
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan') as executor:
+                def submit(path):
+                    return executor.submit(_scan_directory, path, None if full else known.get(path),
+                                           self.extensions)
+
+                parents = {self.root: None}
+                running = {submit(self.root)}
+                since_commit = 0
+                while running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        path = result['path']
+                        if result.get('missing'):
+                            self._remove_tree(conn, path, stats)
+                            continue
+                        if result.get('skipped'):
+                            stats['dirs_skipped'] += 1
+                            subdirs = children.get(path, [])
+                        else:
+                            stats['dirs_scanned'] += 1
+                            subdirs = result['subdirs']
+                            self._update_directory(conn, path, result['files'], stats)
+                            # 清单中有、目录中已经不存在的子目录
+                            for gone in set(children.get(path, [])) - set(subdirs):
+                                self._remove_tree(conn, gone, stats)
+                        conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                                     (path, parents[path], result['mtime_ns']))
+                        for subdir in subdirs:
+                            parents[subdir] = path
+                            running.add(submit(subdir))
+                        since_commit += 1
+                        if since_commit >= _COMMIT_EVERY:
+                            conn.commit()
+                            since_commit = 0
+            conn.commit()
+            if self.hash_algo:
+                self._hash_pending(conn)
+            stats['total'] = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        finally:
+            conn.close()
+        self._set_meta('last_scan', str(time.time()))
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        return stats
+
+    def _update_directory(self, conn, path: str, files: List[tuple], stats: Dict):
+        """用一个目录的最新列表更新清单"""
+        existing = {row[0]: (row[1], row[2]) for row in
+                    conn.execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (path,))}
+        for file_path, size, mtime_ns in files:
+            previous = existing.pop(file_path, None)
+            if previous == (size, mtime_ns):
+                continue
+            stats['added' if previous is None else 'changed'] += 1
+            # 内容变化后旧哈希失效
+            conn.execute("INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, hash) VALUES (?, ?, ?, ?, NULL)",
+                         (file_path, path, size, mtime_ns))
+        if existing:
+            stats['removed'] += len(existing)
+            conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in existing])
+
+    def _remove_tree(self, conn, path: str, stats: Dict):
+        """删除已不存在的目录及其下的所有记录"""
+        prefix = path.rstrip(os.sep) + os.sep
+        like = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        cursor = conn.execute("DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (path, like))
+        stats['removed'] += cursor.rowcount
+        conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, like))
+
+    def _hash_pending(self, conn):
+        """并行计算还没有哈希的文件"""
+        paths = [row[0] for row in conn.execute("SELECT path FROM files WHERE hash IS NULL")]
+        if not paths:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash') as executor:
+            hashes = executor.map(lambda p: _hash_file(p, self.hash_algo), paths)
+            conn.executemany("UPDATE files SET hash = ? WHERE path = ?",
+                             [(h, p) for p, h in zip(paths, hashes) if h is not None])
+        conn.commit()
+
+    def paths(self) -> List[str]:
+        """清单中的所有图片路径（按路径排序）"""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT path FROM files ORDER BY path")]
+
+    def pending(self, consumer: str) -> List[str]:
+        """
+        某个使用方还没有处理过、或处理后大小/mtime发生变化的图片路径
+
+        参数:
+            consumer: 使用方名称（如 'batch_analyze'），不同任务分别记录处理状态
+        """
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("""
+                SELECT f.path FROM files f
+                LEFT JOIN processed p ON p.consumer = ? AND p.path = f.path
+                WHERE p.path IS NULL OR p.size != f.size OR p.mtime_ns != f.mtime_ns
+                ORDER BY f.path""", (consumer,))]
+
+    def mark_processed(self, consumer: str, paths: Iterable[str]):
+        """记录使用方已处理这些图片（按清单中当前的大小和mtime）"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO processed (consumer, path, size, mtime_ns, processed_at)
+                SELECT ?, path, size, mtime_ns, ? FROM files WHERE path = ?""",
+                             [(consumer, now, str(p)) for p in paths])
+
+    def file_info(self, path: str) -> Optional[Dict]:
+        """清单中某个文件的记录"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT path, size, mtime_ns, hash FROM files WHERE path = ?",
+                               (str(path),)).fetchone()
+        return dict(zip(('path', 'size', 'mtime_ns', 'hash'), row)) if row else None
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def open_manifest(manifest: Union[str, Path, SourceManifest], root: Optional[Union[str, Path]] = None,
+                  scan: bool = True, full_scan: bool = False) -> SourceManifest:
+    """
+    打开清单（批处理任务的 manifest 参数可以是清单对象或SQLite路径），默认先做一次增量扫描
+
+    参数:
+        manifest: SourceManifest 或清单SQLite路径（不存在时以root为根目录新建）
+        root: 源图片根目录
+        scan: 是否先扫描
+        full_scan: 重新列出所有目录（见 SourceManifest.scan 的 full 参数），
+                   用于发现目录mtime不变的就地改写
+    """
+    if not isinstance(manifest, SourceManifest):
+        manifest = SourceManifest(root=root, db_path=manifest)
+    if scan:
+        stats = manifest.scan(full=full_scan)
+        print(f"🗂️ 清单扫描: 共 {stats['total']} 张图片（新增 {stats['added']}，变化 {stats['changed']}，"
+              f"删除 {stats['removed']}；列出 {stats['dirs_scanned']} 个目录，跳过 {stats['dirs_skipped']} 个未变化目录，"
+              f"{stats['seconds']:.1f}s）")
+    return manifest
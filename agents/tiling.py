@@ -0,0 +1,521 @@
+"""
+超大图片（正射影像）的分块处理
+Tiled Processing for Very Large Images
+
+3万×3万的正射影像整图解码一份就要约2.7GB，原来的整图流程还会产生多份拷贝
+（img.copy()、float32差值图、RGB转换）。分块模式下：
+- TileReader 按窗口读取：.npy 和未压缩TIFF（需安装tifffile）用内存映射，只读取需要的窗口；
+  JPEG/PNG/压缩TIFF无法按窗口解码，只整图解码一次，按条带写入磁盘上的临时文件后内存映射，
+  整图数组随即释放（解码瞬间仍需一份整图内存，超过 TILED_MAX_DECODE_PIXELS 时拒绝）
+- iter_windows 按重叠窗口切分，每个窗口同时给出不重叠的"核心区域"，
+  统计量只在核心区域上累加，避免重叠部分被重复计数
+- detect_tiled 逐块检测，坐标平移到整图后做跨块的类别NMS合并
+- TileStats 累加各块的部分统计量（亮度矩、拉普拉斯矩、边缘数、颜色位图），最后合成整图统计
+- warp_tiled 按输出块反推源图窗口逐块完成透视变换，结果写入磁盘映射的画布；
+  源窗口过大（块跨过地平线或大幅缩小）时按源图条带分组采样，不读取整图窗口
+
+峰值内存由块大小决定，而不是由整图大小决定
+"""
+
+import contextlib
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from agents.detections import empty_detections
+from agents.image_backend import get_cv2
+from agents.output_writer import encode_to_file
+
+TILE_SIZE = 2048
+TILE_OVERLAP = 256
+# 超过该像素数的输入自动使用分块模式（环境变量 TILED_MIN_PIXELS，默认1亿像素）
+TILED_MIN_PIXELS = int(float(os.environ.get('TILED_MIN_PIXELS', 100_000_000)))
+# 跨块合并检测框的IoU阈值
+MERGE_IOU = 0.5
+# 无法按窗口读取的格式允许整图解码的最大像素数（环境变量 TILED_MAX_DECODE_PIXELS，0为不限制）
+TILED_MAX_DECODE_PIXELS = int(float(os.environ.get('TILED_MAX_DECODE_PIXELS', 0)))
+# 整图解码后写入的磁盘映射临时文件目录（环境变量 TILE_SPOOL_DIR，默认系统临时目录）
+TILE_SPOOL_DIR = os.environ.get('TILE_SPOOL_DIR') or None
+# 透视变换时源窗口面积超过输出块面积的该倍数，改为按源图条带读取
+WARP_MAX_SOURCE_FACTOR = 4
+
+Window = Tuple[int, int, int, int]
+
+
+@contextlib.contextmanager
+def _unbounded_pil():
+    """临时关闭PIL的解压炸弹检查（正射影像会超过默认像素上限）"""
+    from PIL import Image
+    previous = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield Image
+    finally:
+        Image.MAX_IMAGE_PIXELS = previous
+
+
+def image_size(path: Union[str, Path]) -> Tuple[int, int]:
+    """只读取文件头获得图片尺寸 (宽, 高)，不解码像素"""
+    path = Path(path)
+    if path.suffix.lower() == '.npy':
+        shape = np.load(str(path), mmap_mode='r').shape
+        return shape[1], shape[0]
+    with _unbounded_pil() as Image:
+        with Image.open(path) as img:
+            return img.size
+
+
+def should_tile(path: Union[str, Path], min_pixels: int = TILED_MIN_PIXELS) -> bool:
+    """图片像素数是否达到分块模式的阈值"""
+    try:
+        width, height = image_size(path)
+    except Exception:
+        return False
+    return width * height >= min_pixels
+
+
+def _split_point(a_end: int, b_start: int) -> int:
+    """相邻窗口重叠部分的中点，作为两块核心区域的分界"""
+    return (a_end + b_start) // 2
+
+
+def iter_windows(height: int, width: int, tile_size: int = TILE_SIZE,
+                 overlap: int = TILE_OVERLAP) -> Iterator[Tuple[Window, Window]]:
+    """
+    按重叠窗口切分图片
+
+    参数:
+        height, width: 图片尺寸
+        tile_size: 窗口边长
+        overlap: 相邻窗口的重叠像素数
+
+    返回:
+        迭代 (窗口 (x0, y0, x1, y1), 核心区域 (x0, y0, x1, y1))；所有核心区域恰好不重叠地覆盖整图
+    """
+    step = max(1, tile_size - overlap)
+
+    def starts(size):
+        if size <= tile_size:
+            return [0]
+        positions = list(range(0, size - tile_size, step)) + [size - tile_size]
+        return sorted(set(positions))
+
+    xs, ys = starts(width), starts(height)
+    for j, y0 in enumerate(ys):
+        y1 = min(height, y0 + tile_size)
+        core_y0 = 0 if j == 0 else _split_point(min(height, ys[j - 1] + tile_size), y0)
+        core_y1 = height if j == len(ys) - 1 else _split_point(y1, ys[j + 1])
+        for i, x0 in enumerate(xs):
+            x1 = min(width, x0 + tile_size)
+            core_x0 = 0 if i == 0 else _split_point(min(width, xs[i - 1] + tile_size), x0)
+            core_x1 = width if i == len(xs) - 1 else _split_point(x1, xs[i + 1])
+            yield (x0, y0, x1, y1), (core_x0, core_y0, core_x1, core_y1)
+
+
+class TileReader:
+    """按窗口读取大图（BGR uint8）"""
+
+    def __init__(self, source: Union[str, Path, np.ndarray]):
+        """
+        参数:
+            source: 图片路径或已解码的BGR数组
+        """
+        self._array = None
+        if isinstance(source, np.ndarray):
+            self.backend = 'array'
+            self._array = source
+        else:
+            path = Path(source)
+            suffix = path.suffix.lower()
+            if suffix == '.npy':
+                self.backend = 'mmap'
+                self._array = np.load(str(path), mmap_mode='r')
+            elif suffix in ('.tif', '.tiff') and self._try_tiff_memmap(path):
+                self.backend = 'mmap'
+            else:
+                self.backend = 'spooled'
+                self._array = self._spool(path)
+        self.height, self.width = self._array.shape[:2]
+        # tifffile内存映射得到的是RGB顺序
+        self._rgb = getattr(self, '_rgb', False)
+
+    def _try_tiff_memmap(self, path: Path) -> bool:
+        """未压缩TIFF用tifffile内存映射（可选依赖，压缩的TIFF会失败并回退整图解码）"""
+        try:
+            import tifffile
+            self._array = tifffile.memmap(str(path), mode='r')
+        except Exception:
+            return False
+        if self._array.ndim != 3 or self._array.shape[2] < 3:
+            self._array = None
+            return False
+        self._rgb = True
+        return True
+
+    def _spool(self, path: Path) -> np.ndarray:
+        """
+        无法按窗口解码的格式：整图解码一次，按条带写入磁盘上的临时.npy并内存映射
+
+        写完后释放整图数组，之后的窗口读取只触及映射的页面；PIL回退路径按条带转换颜色，
+        不再产生整图大小的RGB/BGR拷贝
+        """
+        width, height = image_size(path)
+        if TILED_MAX_DECODE_PIXELS and width * height > TILED_MAX_DECODE_PIXELS:
+            raise ValueError(f"{path.name} ({width}x{height}) 的格式无法按窗口读取，整图解码超过 "
+                             f"TILED_MAX_DECODE_PIXELS={TILED_MAX_DECODE_PIXELS}，请转换为未压缩TIFF或.npy")
+        print(f"⚠️ {path.name} 的格式无法按窗口读取，整图解码一次（约 {width * height * 3 / 1024 ** 3:.2f}GB）"
+              f"后写入磁盘映射")
+
+        fd, spool_path = tempfile.mkstemp(suffix='.npy', dir=TILE_SPOOL_DIR)
+        os.close(fd)
+        try:
+            cv2 = get_cv2()
+            img = cv2.imread(str(path), cv2.IMREAD_COLOR) if cv2 is not None else None
+            if img is not None:
+                spool = np.lib.format.open_memmap(spool_path, mode='w+', dtype=np.uint8, shape=img.shape)
+                for y0 in range(0, img.shape[0], TILE_SIZE):
+                    spool[y0:y0 + TILE_SIZE] = img[y0:y0 + TILE_SIZE]
+                del img
+            else:
+                with _unbounded_pil() as Image:
+                    with Image.open(path) as pil_img:
+                        pil_img.load()
+                        spool = np.lib.format.open_memmap(spool_path, mode='w+', dtype=np.uint8,
+                                                          shape=(pil_img.height, pil_img.width, 3))
+                        for y0 in range(0, pil_img.height, TILE_SIZE):
+                            y1 = min(pil_img.height, y0 + TILE_SIZE)
+                            strip = pil_img.crop((0, y0, pil_img.width, y1)).convert('RGB')
+                            spool[y0:y1] = np.asarray(strip)[:, :, ::-1]
+            spool.flush()
+        except Exception:
+            _remove_quietly(spool_path)
+            raise
+        # 映射建立后即可删除文件名（POSIX），映射释放时由系统回收磁盘空间；
+        # 无法删除已映射文件的平台（Windows）在读取器回收时再删除
+        try:
+            os.remove(spool_path)
+        except OSError:
+            weakref.finalize(self, _remove_quietly, spool_path)
+        return spool
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    def read(self, window: Window) -> np.ndarray:
+        """读取窗口 (x0, y0, x1, y1) 为连续的BGR数组"""
+        x0, y0, x1, y1 = window
+        tile = self._array[y0:y1, x0:x1]
+        if tile.ndim == 2:
+            tile = np.repeat(tile[:, :, None], 3, axis=2)
+        tile = tile[:, :, :3]
+        if self._rgb:
+            tile = tile[:, :, ::-1]
+        return np.ascontiguousarray(tile)
+
+
+def _remove_quietly(path: str):
+    """删除临时文件，失败时忽略"""
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """一个框与一组框的IoU"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms_merge(detections: Dict[str, np.ndarray], iou_threshold: float = MERGE_IOU) -> Dict[str, np.ndarray]:
+    """
+    跨块合并：按类别做NMS，去掉相邻块重叠区域中重复检测到的目标
+
+    参数:
+        detections: 整图坐标下的检测数组（多个块拼接）
+        iou_threshold: IoU超过该值的同类框视为同一目标
+
+    返回:
+        合并后的检测数组（按置信度降序）
+    """
+    xyxy, conf, cls = detections['xyxy'], detections['conf'], detections['cls']
+    if len(cls) == 0:
+        return detections
+    # 不同类别的框平移到互不相交的区域，一次NMS即可完成按类别NMS
+    offset = (cls.astype(np.float64) * (float(xyxy.max()) + 1.0))[:, None]
+    boxes = xyxy.astype(np.float64) + offset
+    order = np.argsort(-conf, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        order = rest[box_iou(boxes[i], boxes[rest]) <= iou_threshold]
+    keep = np.asarray(keep, dtype=np.int64)
+    return {'xyxy': xyxy[keep], 'conf': conf[keep], 'cls': cls[keep]}
+
+
+class DetectionMerger:
+    """收集各块的检测结果（块坐标 -> 整图坐标），最后做跨块NMS合并"""
+
+    def __init__(self, iou_threshold: float = MERGE_IOU):
+        self.iou_threshold = iou_threshold
+        self._parts = []
+
+    def add(self, found: Dict[str, np.ndarray], window: Window):
+        if len(found['cls']):
+            shift = np.array([window[0], window[1], window[0], window[1]], dtype=np.float32)
+            self._parts.append({'xyxy': found['xyxy'] + shift, 'conf': found['conf'], 'cls': found['cls']})
+
+    def result(self) -> Dict[str, np.ndarray]:
+        if not self._parts:
+            return empty_detections()
+        merged = {key: np.concatenate([p[key] for p in self._parts]) for key in ('xyxy', 'conf', 'cls')}
+        return nms_merge(merged, self.iou_threshold)
+
+
+def detect_tiled(reader: TileReader, detect_fn: Callable[[np.ndarray], Dict[str, np.ndarray]],
+                 tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP,
+                 iou_threshold: float = MERGE_IOU,
+                 on_tile: Optional[Callable[[np.ndarray, Window, Window], None]] = None) -> Dict[str, np.ndarray]:
+    """
+    逐块检测并合并
+
+    参数:
+        reader: TileReader
+        detect_fn: 对一个BGR块做检测，返回块坐标下的检测数组
+        tile_size, overlap: 分块参数（overlap应大于常见目标尺寸，保证目标至少完整出现在一个块中）
+        iou_threshold: 跨块NMS的IoU阈值
+        on_tile: 可选回调 (块, 窗口, 核心区域)，同一次读取中顺便累加统计量
+
+    返回:
+        整图坐标下合并后的检测数组
+    """
+    merger = DetectionMerger(iou_threshold)
+    for window, core in iter_windows(reader.height, reader.width, tile_size, overlap):
+        tile = reader.read(window)
+        if on_tile is not None:
+            on_tile(tile, window, core)
+        merger.add(detect_fn(tile), window)
+        del tile
+    return merger.result()
+
+
+class TileStats:
+    """
+    分块累加整图统计量（只统计每块的核心区域，结果与整图计算一致或非常接近）
+
+    - HSV亮度通道的均值/标准差、过曝/欠曝比例
+    - 拉普拉斯响应的方差（在整块上计算、取核心区域，避免块边界效应）
+    - Canny边缘密度
+    - 不同颜色数（24位颜色位图，内存固定16MB）
+    """
+
+    def __init__(self):
+        self.pixels = 0
+        self.v_sum = 0.0
+        self.v_sqsum = 0.0
+        self.over = 0
+        self.under = 0
+        self.lap_sum = 0.0
+        self.lap_sqsum = 0.0
+        self.edges = 0
+        self._colors = np.zeros(1 << 24, dtype=bool)
+
+    def add(self, tile_rgb: np.ndarray, window: Window, core: Window):
+        """累加一个RGB块的核心区域"""
+        cv2 = get_cv2()
+        cy0, cy1 = core[1] - window[1], core[3] - window[1]
+        cx0, cx1 = core[0] - window[0], core[2] - window[0]
+        core_rgb = tile_rgb[cy0:cy1, cx0:cx1]
+        n = core_rgb.shape[0] * core_rgb.shape[1]
+        if n == 0:
+            return
+        self.pixels += n
+
+        v = cv2.cvtColor(core_rgb, cv2.COLOR_RGB2HSV)[:, :, 2]
+        v64 = v.astype(np.float64)
+        self.v_sum += float(v64.sum())
+        self.v_sqsum += float((v64 * v64).sum())
+        self.over += int(np.count_nonzero(v > 240))
+        self.under += int(np.count_nonzero(v < 15))
+
+        gray = cv2.cvtColor(tile_rgb, cv2.COLOR_RGB2GRAY)
+        lap = cv2.Laplacian(gray, cv2.CV_64F)[cy0:cy1, cx0:cx1]
+        self.lap_sum += float(lap.sum())
+        self.lap_sqsum += float((lap * lap).sum())
+        self.edges += int(np.count_nonzero(cv2.Canny(gray, 50, 150)[cy0:cy1, cx0:cx1]))
+
+        packed = (core_rgb[:, :, 0].astype(np.uint32) << 16) | (core_rgb[:, :, 1].astype(np.uint32) << 8) \
+            | core_rgb[:, :, 2].astype(np.uint32)
+        self._colors[packed.ravel()] = True
+
+    def result(self) -> Dict[str, float]:
+        """合成整图统计量"""
+        n = max(1, self.pixels)
+        v_mean = self.v_sum / n
+        lap_mean = self.lap_sum / n
+        return {
+            'v_mean': v_mean,
+            'v_std': float(np.sqrt(max(0.0, self.v_sqsum / n - v_mean * v_mean))),
+            'overexposed': self.over / n,
+            'underexposed': self.under / n,
+            'laplacian_var': max(0.0, self.lap_sqsum / n - lap_mean * lap_mean),
+            'edge_density': self.edges / n,
+            'unique_colors': int(np.count_nonzero(self._colors)),
+        }
+
+
+def _inverse_window(inv: np.ndarray, window: Window, margin: int, width: int, height: int) -> Optional[Window]:
+    """输出块四角经逆变换落在源图上的外接窗口（含插值边距），与源图不相交时返回None"""
+    x0, y0, x1, y1 = window
+    corners = np.array([[x0, y0, 1], [x1, y0, 1], [x1, y1, 1], [x0, y1, 1]], dtype=np.float64) @ inv.T
+    w = corners[:, 2]
+    if np.any(w <= 1e-9):
+        # 块跨过地平线（透视分母变号），外接窗口退化为整图（warp_tiled 对过大的窗口按条带读取）
+        return 0, 0, width, height
+    xs, ys = corners[:, 0] / w, corners[:, 1] / w
+    sx0 = int(np.floor(xs.min())) - margin
+    sy0 = int(np.floor(ys.min())) - margin
+    sx1 = int(np.ceil(xs.max())) + margin
+    sy1 = int(np.ceil(ys.max())) + margin
+    sx0, sy0 = max(0, sx0), max(0, sy0)
+    sx1, sy1 = min(width, sx1), min(height, sy1)
+    if sx1 <= sx0 or sy1 <= sy0:
+        return None
+    return sx0, sy0, sx1, sy1
+
+
+def _warp_tile_by_strips(reader: TileReader, matrix: np.ndarray, inv: np.ndarray, window: Window,
+                         strip_rows: int = TILE_SIZE) -> np.ndarray:
+    """
+    源窗口过大时逐条带读取源图，完成一个输出块的透视变换
+
+    显式计算块内每个像素的源坐标，按采样点所在的源图行条带分组；每个条带只读取被采样的列范围，
+    变换后只取采样点落在该条带内的像素。峰值内存由块大小和条带大小决定，与整图大小无关
+
+    参数:
+        reader: 源图TileReader
+        matrix: 3x3 源图 -> 输出的变换矩阵
+        inv: matrix 的逆矩阵
+        window: 输出块窗口 (x0, y0, x1, y1)
+        strip_rows: 每个源图条带的行数
+
+    返回:
+        输出块（BGR，源图以外填黑）
+    """
+    cv2 = get_cv2()
+    x0, y0, x1, y1 = window
+    height, width = reader.shape
+    xs, ys = np.meshgrid(np.arange(x0, x1, dtype=np.float64), np.arange(y0, y1, dtype=np.float64))
+    w = inv[2, 0] * xs + inv[2, 1] * ys + inv[2, 2]
+    # 分母为0的像素（正好在地平线上）warpPerspective 输出黑色
+    nonzero = w != 0
+    w = np.divide(1.0, w, out=np.zeros_like(w), where=nonzero)
+    map_x = (inv[0, 0] * xs + inv[0, 1] * ys + inv[0, 2]) * w
+    map_y = (inv[1, 0] * xs + inv[1, 1] * ys + inv[1, 2]) * w
+    del xs, ys, w
+
+    tile = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    shift_out = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+    # 双线性插值在 (-1, size) 范围内都会采到源图像素（边界外按黑色混合）
+    valid = nonzero & (map_x > -1) & (map_x < width) & (map_y > -1) & (map_y < height)
+    for sy0 in range(0, height, strip_rows):
+        sy1 = min(height, sy0 + strip_rows)
+        mask = valid & (map_y >= (-1 if sy0 == 0 else sy0)) & (map_y < sy1)
+        if not mask.any():
+            continue
+        sampled_x = map_x[mask]
+        sx0 = max(0, int(np.floor(sampled_x.min())))
+        sx1 = min(width, int(np.floor(sampled_x.max())) + 2)
+        # 多读一行，保证条带底部的采样点插值时下方邻居也在窗口内
+        source = reader.read((sx0, sy0, sx1, min(height, sy1 + 1)))
+        shift_in = np.array([[1, 0, sx0], [0, 1, sy0], [0, 0, 1]], dtype=np.float64)
+        part = cv2.warpPerspective(source, shift_out @ matrix @ shift_in, (x1 - x0, y1 - y0),
+                                   flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
+                                   borderValue=(0, 0, 0))
+        tile[mask] = part[mask]
+        del source, part
+    return tile
+
+
+def warp_tiled(reader: TileReader, matrix: np.ndarray, output_path: Union[str, Path],
+               tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP,
+               on_tile: Optional[Callable[[np.ndarray, Window, Window], None]] = None,
+               thumbnail_side: int = 1024,
+               write_fn: Optional[Callable[[np.ndarray, Path], object]] = None) -> np.ndarray:
+    """
+    分块完成整图透视变换并保存（输出尺寸与源图相同，边界填黑）
+
+    每个输出块只读取其逆映射覆盖的源图窗口；结果写入磁盘映射的画布后编码保存，
+    同时生成缩略图用于预览和感知哈希
+
+    参数:
+        reader: 源图TileReader
+        matrix: 3x3 源图 -> 输出的变换矩阵
+        output_path: 输出图片路径
+        tile_size, overlap: 输出分块参数；on_tile收到的是带重叠的块
+        on_tile: 可选回调 (输出块, 窗口, 核心区域)，例如逐块检测
+        thumbnail_side: 缩略图最长边
+        write_fn: 编码写出函数 write_fn(画布, 路径)，默认 encode_to_file（JPEG质量95）
+
+    返回:
+        缩略图（BGR）
+    """
+    cv2 = get_cv2()
+    height, width = reader.shape
+    inv = np.linalg.inv(np.asarray(matrix, dtype=np.float64))
+    scale = min(1.0, thumbnail_side / max(height, width))
+    thumb = np.zeros((max(1, round(height * scale)), max(1, round(width * scale)), 3), dtype=np.uint8)
+
+    output_path = Path(output_path)
+    fd, canvas_path = tempfile.mkstemp(suffix='.npy', dir=str(output_path.parent))
+    os.close(fd)
+    try:
+        canvas = np.lib.format.open_memmap(canvas_path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        for window, core in iter_windows(height, width, tile_size, overlap):
+            x0, y0, x1, y1 = window
+            source_window = _inverse_window(inv, window, 2, width, height)
+            if source_window is None:
+                tile = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+            elif ((source_window[2] - source_window[0]) * (source_window[3] - source_window[1])
+                  > WARP_MAX_SOURCE_FACTOR * (x1 - x0) * (y1 - y0)):
+                tile = _warp_tile_by_strips(reader, matrix, inv, window)
+            else:
+                sx0, sy0 = source_window[:2]
+                source = reader.read(source_window)
+                # 块矩阵：平移到源窗口坐标 -> 整体变换 -> 平移到输出块坐标
+                shift_in = np.array([[1, 0, sx0], [0, 1, sy0], [0, 0, 1]], dtype=np.float64)
+                shift_out = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+                tile = cv2.warpPerspective(source, shift_out @ matrix @ shift_in, (x1 - x0, y1 - y0),
+                                           flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
+                                           borderValue=(0, 0, 0))
+                del source
+            if on_tile is not None:
+                on_tile(tile, window, core)
+            cx0, cy0, cx1, cy1 = core
+            canvas[cy0:cy1, cx0:cx1] = tile[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            tx0, ty0 = int(cx0 * scale), int(cy0 * scale)
+            tx1, ty1 = max(tx0 + 1, int(round(cx1 * scale))), max(ty0 + 1, int(round(cy1 * scale)))
+            thumb[ty0:ty1, tx0:tx1] = cv2.resize(
+                tile[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0],
+                (tx1 - tx0, ty1 - ty0), interpolation=cv2.INTER_AREA)
+            del tile
+        canvas.flush()
+        # 画布在磁盘上，编码时按行读取，常驻内存只是操作系统页缓存
+        (write_fn or encode_to_file)(canvas, output_path)
+        del canvas
+    finally:
+        os.remove(canvas_path)
+    return thumb
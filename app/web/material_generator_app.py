@@ -7,19 +7,28 @@ import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import os
 import sys
 from PIL import Image
 import time
 import shutil
+import hashlib
+import tempfile
 from datetime import datetime
 
 project_root = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(project_root))
 
-from agents.image_multi_angle_generator import ImageMultiAngleGenerator
+from agents.image_multi_angle_generator import ImageMultiAngleGenerator, seed_from_hash
 from agents.image_quality_analyzer import ImageQualityAnalyzer
 from agents.material_generator_agent import MaterialGeneratorAgent
 from agents.material_enhancement_trainer import MaterialEnhancementTrainer
+from agents.model_pool import ModelPool
+from agents.job_queue import JobQueue, QUEUED, RUNNING, SUCCEEDED, CANCELLED
+from agents.archive_builder import show_archive_download
+from agents.preview_cache import get_preview
+from agents.detections import load_detection_sidecar, overlay_preview
+from thread_budget import apply_profile
 
 st.set_page_config(page_title="无人机素材生成系统", page_icon="🚁", layout="wide", initial_sidebar_state="expanded")
 
@@ -143,12 +152,129 @@ st.markdown("**功能**: 输入一张图片，自动生成多角度素材（带
 st.markdown("**新增**: 质量较差素材自动增强训练功能")
 st.markdown("---")
 
-if 'generator' not in st.session_state:
-    st.session_state.generator = ImageMultiAngleGenerator(draw_boxes=True)
-if 'agent' not in st.session_state:
-    st.session_state.agent = MaterialGeneratorAgent()
-if 'enhancement_trainer' not in st.session_state:
-    st.session_state.enhancement_trainer = MaterialEnhancementTrainer()
+# 后台任务工作线程数（每类模型最多加载同样数量的实例）
+JOB_WORKERS = max(1, int(os.environ.get('JOB_WORKERS', '1')))
+# 后台任务进度的刷新间隔（秒）
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+# 并发任务共享进程内的torch/OpenCV线程池，按任务数划分算子内线程
+apply_profile('web', workers=JOB_WORKERS)
+
+
+@st.cache_resource(show_spinner=False)
+def get_model_pools():
+    """进程级共享的模型实例池，供后台任务借用"""
+    return {
+        'generator': ModelPool(ImageMultiAngleGenerator, JOB_WORKERS, "生成器"),
+        'agent': ModelPool(MaterialGeneratorAgent, JOB_WORKERS, "Agent"),
+        'enhancement_trainer': ModelPool(MaterialEnhancementTrainer, JOB_WORKERS, "增强训练器"),
+    }
+
+
+def run_generation_job(params, context):
+    """后台任务：生成多角度素材，并按需分析"""
+    pools = get_model_pools()
+    analyze = params.get('auto_analyze', True)
+    with pools['generator'].lease() as generator:
+        result = generator.generate_multi_angle_images(
+            input_image_path=params['input_image_path'],
+            output_dir=params['output_dir'],
+            num_generations=params['num_generations'],
+            draw_boxes=params['draw_boxes'],
+            progress_callback=context.progress_callback("步骤1/2: 生成素材" if analyze else "生成素材",
+                                                        0.0, 0.5 if analyze else 1.0),
+            seed=params.get('seed'),
+            skip_existing=params.get('skip_existing', False)
+        )
+    analysis_result = None
+    if analyze:
+        with pools['agent'].lease() as agent:
+            analysis_result = agent.analyze_and_evaluate(
+                result['generated_files'],
+                progress_callback=context.progress_callback("步骤2/2: 分析素材", 0.5, 1.0)
+            )
+    return {'generation': result, 'analysis': analysis_result}
+
+
+def run_enhancement_job(params, context):
+    """后台任务：批量增强训练"""
+    with get_model_pools()['enhancement_trainer'].lease() as trainer:
+        return trainer.enhance_batch_to_excellent(
+            image_paths=params['image_paths'],
+            output_dir=params['output_dir'],
+            target_improvement=params['target_improvement'],
+            max_iterations=params['max_iterations'],
+            progress_callback=context.progress_callback("增强训练")
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    """进程级后台任务队列，任务不受脚本重跑影响"""
+    job_queue = JobQueue(str(project_root / "jobs" / "material_generator_jobs.sqlite"), num_workers=JOB_WORKERS)
+    job_queue.register('generate', run_generation_job)
+    job_queue.register('enhance', run_enhancement_job)
+    return job_queue
+
+
+def _job_progress(state_key, label):
+    """显示运行中任务的进度和取消按钮；任务结束后整页重跑以显示结果"""
+    job_id = st.session_state.get(state_key)
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id) if job_id else None
+    if job is None or job['status'] not in (QUEUED, RUNNING):
+        st.rerun()
+    status = "排队中..." if job['status'] == QUEUED else (job['message'] or f"正在{label}...")
+    st.progress(min(1.0, job['progress']), text=status)
+    if st.button(f"⏹️ 取消{label}", key=f"cancel_{state_key}", use_container_width=True):
+        job_queue.cancel(job_id)
+    if not hasattr(st, 'fragment'):
+        st.session_state.job_refresh_pending = True
+
+
+# 进度区域作为fragment定时局部重跑，页面其余部分照常渲染；
+# 旧版Streamlit没有st.fragment，改为在页面末尾定时整页重跑（见脚本末尾）
+if hasattr(st, 'fragment'):
+    show_job_progress = st.fragment(run_every=JOB_POLL_INTERVAL)(_job_progress)
+else:
+    show_job_progress = _job_progress
+
+
+def poll_job(state_key, label):
+    """
+    轮询会话中记录的后台任务
+
+    任务运行中时显示定时刷新的进度和取消按钮并返回None；任务结束后清除记录，
+    成功时返回任务字典（只返回一次），否则返回None
+    """
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return None
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id)
+    if job is None:
+        st.session_state[state_key] = None
+        return None
+
+    if job['status'] in (QUEUED, RUNNING):
+        show_job_progress(state_key, label)
+        return None
+
+    st.session_state[state_key] = None
+    if job['status'] == SUCCEEDED:
+        return job
+    if job['status'] == CANCELLED:
+        st.info(f"⏹️ {label}已取消")
+    else:
+        st.error(f"❌ {label}出错")
+        if job['error']:
+            st.code(job['error'])
+    return None
+
+
+if 'generation_job_id' not in st.session_state:
+    st.session_state.generation_job_id = None
+if 'enhancement_job_id' not in st.session_state:
+    st.session_state.enhancement_job_id = None
 if 'generated_images' not in st.session_state:
     st.session_state.generated_images = []
 if 'analysis_results' not in st.session_state:
@@ -157,6 +283,10 @@ if 'confidence_stats' not in st.session_state:
     st.session_state.confidence_stats = {}
 if 'enhancement_results' not in st.session_state:
     st.session_state.enhancement_results = None
+if 'generation_output_dir' not in st.session_state:
+    st.session_state.generation_output_dir = None
+if 'enhancement_output_dir' not in st.session_state:
+    st.session_state.enhancement_output_dir = None
 
 with st.sidebar:
     st.header("⚙️ 系统配置")
@@ -212,17 +342,12 @@ col_config1, col_config2 = st.columns(2)
 with col_config1:
     num_generations = st.slider("生成图片数量", 4, 100, 18, 1, key="main_num_generations")
 with col_config2:
-    draw_detection_boxes = st.checkbox("绘制检测框", value=True, key="main_draw_boxes")
+    draw_detection_boxes = st.checkbox("显示检测框", value=True, key="main_draw_boxes",
+                                       help="检测框按需叠加在预览上，切换无需重新生成")
 
 uploaded_file = st.file_uploader("上传一张无人机图片", type=['jpg','jpeg','png','bmp'])
 
 if uploaded_file is not None:
-    temp_dir = Path("temp_uploads")
-    temp_dir.mkdir(exist_ok=True)
-    temp_path = temp_dir / uploaded_file.name
-    with open(temp_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-
     col1, col2 = st.columns([1,1])
     with col1:
         st.subheader("📷 原始图片")
@@ -231,82 +356,97 @@ if uploaded_file is not None:
     with col2:
         st.subheader("🎯 操作")
         if st.button("🚀 生成多角度素材并分析", type="primary", use_container_width=True):
-            with st.spinner("正在生成多角度素材，请稍候..."):
-                try:
-                    # 更新生成器配置（确保检测框功能启用）
-                    if not draw_detection_boxes:
-                        st.warning("⚠️ 检测框功能已关闭，生成的图片将不包含检测框")
-                    # 强制重新初始化生成器，确保检测框功能正确
-                    st.session_state.generator = ImageMultiAngleGenerator(draw_boxes=draw_detection_boxes)
-                    
-                    # 确定输出目录（使用临时目录，后续提供下载）
-                    output_dir = Path("temp_generated") / f"generation_{int(time.time())}"
-                    
-                    output_dir.mkdir(parents=True, exist_ok=True)
-                    
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-
-                    status_text.text("步骤1/2: 正在生成多角度素材（带检测框）...")
-                    result = st.session_state.generator.generate_multi_angle_images(
-                        input_image_path=str(temp_path),
-                        output_dir=str(output_dir),
-                        num_generations=num_generations
-                    )
-                    progress_bar.progress(50)
-                    status_text.text(f"✅ 已生成 {result['num_generated']} 张素材")
-                    st.session_state.generated_images = result['generated_files']
-                    st.session_state.confidence_stats = result.get('confidence_statistics', {})
-
-                    if auto_analyze:
-                        status_text.text("步骤2/2: 正在分析生成的素材...")
-                        analysis_result = st.session_state.agent.analyze_and_evaluate(
-                            result['generated_files']
-                        )
-                        st.session_state.analysis_results = analysis_result
-                        progress_bar.progress(100)
-                        status_text.text("✅ 分析完成！")
-                    else:
-                        progress_bar.progress(100)
-                        status_text.text("✅ 生成完成！")
-
-                    st.success(f"✅ 成功生成 {result['num_generated']} 张多角度素材！")
-                    
-                    # 提供下载功能
-                    st.markdown("### 📥 下载生成的素材")
-                    import zipfile
-                    import io
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for img_path in result['generated_files']:
-                            if Path(img_path).exists():
-                                zip_file.write(img_path, Path(img_path).name)
-                    zip_buffer.seek(0)
-                    st.download_button(
-                        label="📥 下载所有生成的素材（ZIP）",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"generated_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                        mime="application/zip",
-                        use_container_width=True
-                    )
-                except Exception as e:
-                    st.error(f"❌ 处理出错: {e}")
-                    import traceback
-                    st.code(traceback.format_exc())
+            # 确定输出目录（使用临时目录，后续提供下载）
+            # 同一张图片重复上传时使用同一个输出目录和种子，已生成的视角直接复用
+            # 保存的素材不含检测框，显示/不显示检测框共用同一次生成
+            content_hash = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+            output_dir = Path("temp_generated") / f"generation_{content_hash[:12]}"
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            # 任务输入按内容哈希命名，只在提交时写入：无人机图片常常同名（DJI_0001.JPG），
+            # 按原文件名保存时，后一次上传会在排队中的任务读取之前覆盖它的输入
+            temp_dir = Path("temp_uploads")
+            temp_dir.mkdir(exist_ok=True)
+            temp_path = temp_dir / f"{content_hash}{Path(uploaded_file.name).suffix.lower()}"
+            if not temp_path.exists():
+                # 先写临时文件再替换，同内容的任务不会读到写了一半的文件
+                fd, partial_path = tempfile.mkstemp(suffix=".tmp", dir=str(temp_dir))
+                with os.fdopen(fd, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                os.replace(partial_path, temp_path)
+            
+            # 提交到后台任务队列，生成过程中操作其他控件不会中断任务
+            st.session_state.generation_job_id = get_job_queue().submit('generate', {
+                'input_image_path': str(temp_path),
+                'output_dir': str(output_dir),
+                'num_generations': num_generations,
+                'draw_boxes': draw_detection_boxes,
+                'auto_analyze': auto_analyze,
+                # 种子由图片内容决定：任务重启或重复上传时结果一致，可以跳过已有输出
+                'seed': seed_from_hash(content_hash),
+                'skip_existing': True
+            })
+            st.session_state.generated_images = []
+            st.session_state.detections_file = None
+            st.session_state.confidence_stats = {}
+            st.session_state.analysis_results = None
+            st.session_state.enhancement_results = None
+            st.session_state.generation_output_dir = None
+
+        job = poll_job('generation_job_id', "生成素材")
+        if job:
+            result = job['result']['generation']
+            st.session_state.generated_images = result['generated_files']
+            st.session_state.detections_file = result.get('detections_file')
+            st.session_state.confidence_stats = result.get('confidence_statistics', {})
+            st.session_state.generation_output_dir = job['params']['output_dir']
+            if job['result']['analysis'] is not None:
+                st.session_state.analysis_results = job['result']['analysis']
+
+            st.success(f"✅ 成功生成 {result['num_generated']} 张多角度素材！")
 
     # 显示生成结果和分析
     if st.session_state.generated_images:
         st.markdown("---")
-        st.subheader("🎨 生成的多角度素材（带检测框）")
+        st.subheader("🎨 生成的多角度素材" + ("（带检测框）" if draw_detection_boxes else ""))
         num_cols = 4
-        images = st.session_state.generated_images
+        page_size = 16
+        all_images = st.session_state.generated_images
+        
+        # 提供下载功能（归档写在磁盘上并按生成目录缓存，点击准备下载后才打包）
+        if st.session_state.generation_output_dir:
+            st.markdown("### 📥 下载生成的素材")
+            show_archive_download(
+                st.session_state.generation_output_dir, all_images,
+                label="📥 下载所有生成的素材（ZIP）",
+                file_name=f"generated_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                key="generation_archive"
+            )
+        
+        num_pages = (len(all_images) + page_size - 1) // page_size
+        page = 1
+        if num_pages > 1:
+            page = st.number_input(f"页码（共 {num_pages} 页）", min_value=1, max_value=num_pages,
+                                   value=1, step=1, key="generation_gallery_page")
+        # 只加载当前页的预览图，不解码全分辨率原图
+        images = all_images[(page - 1) * page_size:page * page_size]
+        detections = None
+        detections_file = st.session_state.get('detections_file')
+        if draw_detection_boxes and detections_file and Path(detections_file).exists():
+            detections = load_detection_sidecar(detections_file)
         for i in range(0, len(images), num_cols):
             cols = st.columns(num_cols)
             for j, col in enumerate(cols):
                 if i + j < len(images):
                     img_path = Path(images[i + j])
                     if img_path.exists():
-                        col.image(Image.open(img_path), caption=img_path.name, use_column_width=True)
+                        view_detections = detections['views'].get(img_path.name) if detections else None
+                        if view_detections is not None:
+                            col.image(overlay_preview(img_path, view_detections, detections['class_names'],
+                                                      detections['image_size']),
+                                      caption=img_path.name, use_column_width=True)
+                        else:
+                            col.image(str(get_preview(img_path)), caption=img_path.name, use_column_width=True)
 
         # 显示置信度统计
         if st.session_state.confidence_stats:
@@ -404,63 +544,44 @@ if uploaded_file is not None:
             if needs_enhancement and enable_enhancement:
                 st.warning(f"⚠️ **素材质量较差（{overall_quality:.2f}%），建议进行增强训练**")
                 if st.button("🎯 开始增强训练", type="primary", use_container_width=True):
-                    with st.spinner("正在进行增强训练，请稍候..."):
-                        try:
-                            # 确定增强输出目录（使用临时目录，后续提供下载）
-                            enhancement_dir = Path("temp_enhanced") / f"enhancement_{int(time.time())}"
-                            
-                            enhancement_dir.mkdir(parents=True, exist_ok=True)
-                            
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
-                            
-                            # 批量增强
-                            status_text.text("正在对质量较差的素材进行增强训练...")
-                            enhancement_result = st.session_state.enhancement_trainer.enhance_batch_to_excellent(
-                                image_paths=st.session_state.generated_images,
-                                output_dir=str(enhancement_dir),
-                                target_improvement=target_improvement,
-                                max_iterations=max_iterations
-                            )
-                            
-                            st.session_state.enhancement_results = enhancement_result
-                            progress_bar.progress(100)
-                            status_text.text("✅ 增强训练完成！")
-                            
-                            # 显示增强结果
-                            st.success(f"✅ 增强训练完成！")
-                            st.info(f"📊 成功率: {enhancement_result['success_rate']:.2f}% | 达标率: {enhancement_result['achievement_rate']:.2f}%")
-                            st.info(f"📈 平均提升幅度: {enhancement_result.get('average_improvement', 0):.2f}分")
-                            st.info(f"⭐ 优秀({enhancement_result.get('excellent_count', 0)}) | 良好({enhancement_result.get('good_count', 0)}) | 一般({enhancement_result.get('fair_count', 0)}) | 较差({enhancement_result.get('poor_count', 0)})")
-                            
-                            # 提供增强素材下载功能
-                            st.markdown("### 📥 下载增强后的素材")
-                            import zipfile
-                            import io
-                            zip_buffer = io.BytesIO()
-                            enhanced_files = []
-                            for result_item in enhancement_result.get('results', []):
-                                if result_item.get('success', False) and 'final_image_path' in result_item:
-                                    enhanced_path = result_item['final_image_path']
-                                    if Path(enhanced_path).exists():
-                                        enhanced_files.append(enhanced_path)
-                            
-                            if enhanced_files:
-                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                    for img_path in enhanced_files:
-                                        zip_file.write(img_path, Path(img_path).name)
-                                zip_buffer.seek(0)
-                                st.download_button(
-                                    label="📥 下载所有增强素材（ZIP）",
-                                    data=zip_buffer.getvalue(),
-                                    file_name=f"enhanced_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                                    mime="application/zip",
-                                    use_container_width=True
-                                )
-                        except Exception as e:
-                            st.error(f"❌ 增强训练出错: {e}")
-                            import traceback
-                            st.code(traceback.format_exc())
+                    # 确定增强输出目录（使用临时目录，后续提供下载）
+                    enhancement_dir = Path("temp_enhanced") / f"enhancement_{int(time.time())}"
+                    enhancement_dir.mkdir(parents=True, exist_ok=True)
+                    
+                    # 增强训练耗时较长，放到后台任务中运行，脚本重跑后继续
+                    st.session_state.enhancement_job_id = get_job_queue().submit('enhance', {
+                        'image_paths': st.session_state.generated_images,
+                        'output_dir': str(enhancement_dir),
+                        'target_improvement': target_improvement,
+                        'max_iterations': max_iterations
+                    })
+
+            job = poll_job('enhancement_job_id', "增强训练")
+            if job:
+                enhancement_result = job['result']
+                st.session_state.enhancement_results = enhancement_result
+                st.session_state.enhancement_output_dir = job['params']['output_dir']
+                
+                # 显示增强结果
+                st.success(f"✅ 增强训练完成！")
+                st.info(f"📊 成功率: {enhancement_result['success_rate']:.2f}% | 达标率: {enhancement_result['achievement_rate']:.2f}%")
+                st.info(f"📈 平均提升幅度: {enhancement_result.get('average_improvement', 0):.2f}分")
+                st.info(f"⭐ 优秀({enhancement_result.get('excellent_count', 0)}) | 良好({enhancement_result.get('good_count', 0)}) | 一般({enhancement_result.get('fair_count', 0)}) | 较差({enhancement_result.get('poor_count', 0)})")
+            
+            # 提供增强素材下载功能（点击准备下载后才打包）
+            if st.session_state.enhancement_results and st.session_state.enhancement_output_dir:
+                st.markdown("### 📥 下载增强后的素材")
+                enhanced_files = [
+                    result_item['final_image_path']
+                    for result_item in st.session_state.enhancement_results.get('results', [])
+                    if result_item.get('success', False) and 'final_image_path' in result_item
+                ]
+                show_archive_download(
+                    st.session_state.enhancement_output_dir, enhanced_files,
+                    label="📥 下载所有增强素材（ZIP）",
+                    file_name=f"enhanced_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                    key="enhancement_archive"
+                )
             
             # 数据表现分析
             st.markdown("#### 🔍 数据表现客观分析")
@@ -560,4 +681,7 @@ if uploaded_file is not None:
             })
         st.dataframe(pd.DataFrame(quality_data), use_container_width=True, hide_index=True)
 
-
+# 旧版Streamlit（没有st.fragment）：页面全部渲染完后再定时重跑以刷新任务进度
+if st.session_state.pop('job_refresh_pending', False):
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
@@ -36,6 +36,10 @@ import numpy as np
 from pathlib import Path
 import time
 import json
+import hashlib
+import random
+import shutil
+import uuid
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import warnings
@@ -54,6 +58,8 @@ try:
 except:
     project_root = Path.cwd()
 
+from thread_budget import apply_profile
+
 # ========== 延迟导入Agents ==========
 AGENTS_AVAILABLE = False
 ENHANCEMENT_AVAILABLE = False
@@ -61,9 +67,17 @@ try:
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         with contextlib.redirect_stderr(io.StringIO()):
-            from agents.image_multi_angle_generator import ImageMultiAngleGenerator
+            from agents.image_multi_angle_generator import ImageMultiAngleGenerator, seed_from_hash
             from agents.image_quality_analyzer import ImageQualityAnalyzer
             from agents.material_generator_agent import MaterialGeneratorAgent
+            from agents.model_pool import ModelPool
+            from agents.preview_cache import get_preview, make_preview
+            from agents.detections import load_detection_sidecar, overlay_preview
+            from agents.image_ingest import ANALYSIS_MAX_SIDE, decode_uploads
+            from agents.job_queue import (
+                JobQueue, JobCancelled, QUEUED as JOB_QUEUED, RUNNING as JOB_RUNNING,
+                SUCCEEDED as JOB_SUCCEEDED, CANCELLED as JOB_CANCELLED
+            )
             try:
                 from agents.material_enhancement_trainer import MaterialEnhancementTrainer
                 ENHANCEMENT_AVAILABLE = True
@@ -74,6 +88,13 @@ except Exception as e:
     st.error(f"⚠️ 模块加载警告: {str(e)}")
     AGENTS_AVAILABLE = False
 
+# 每类模型在进程内最多加载的实例数（所有会话共享）
+MODEL_POOL_SIZE = max(1, int(os.environ.get('MODEL_POOL_SIZE', '2')))
+# 后台任务进度的刷新间隔（秒）
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+# 并发任务共享进程内的torch/OpenCV线程池，按任务数划分算子内线程
+apply_profile('web', workers=MODEL_POOL_SIZE)
+
 # ========== 页面配置 ==========
 st.set_page_config(
     page_title="🚁 无人机视觉AI分析系统",
@@ -255,16 +276,26 @@ st.markdown(SCIFI_CSS, unsafe_allow_html=True)
 # ========== 工具函数 ==========
 def init_session_state():
     """初始化session state"""
-    if 'generator' not in st.session_state:
-        st.session_state.generator = None
-    if 'analyzer' not in st.session_state:
-        st.session_state.analyzer = None
-    if 'agent' not in st.session_state:
-        st.session_state.agent = None
+    if 'draw_boxes' not in st.session_state:
+        st.session_state.draw_boxes = True
+    if 'generation_job_id' not in st.session_state:
+        st.session_state.generation_job_id = None
+    if 'generation_job_applied' not in st.session_state:
+        st.session_state.generation_job_applied = None
     if 'analysis_results' not in st.session_state:
         st.session_state.analysis_results = None
+    if 'analysis_job_id' not in st.session_state:
+        st.session_state.analysis_job_id = None
+    if 'batch_analysis_result' not in st.session_state:
+        st.session_state.batch_analysis_result = None
+    if 'filter_job_id' not in st.session_state:
+        st.session_state.filter_job_id = None
+    if 'filter_result' not in st.session_state:
+        st.session_state.filter_result = None
     if 'generated_images' not in st.session_state:
         st.session_state.generated_images = []
+    if 'detections_file' not in st.session_state:
+        st.session_state.detections_file = None
     if 'uploaded_file' not in st.session_state:
         st.session_state.uploaded_file = None
     if 'enhancement_mode' not in st.session_state:
@@ -276,44 +307,144 @@ def init_session_state():
     if 'should_run_enhancement' not in st.session_state:
         st.session_state.should_run_enhancement = False
 
-def get_generator(draw_boxes: bool = True):
-    """获取生成器实例"""
-    if st.session_state.generator is None and AGENTS_AVAILABLE:
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                with contextlib.redirect_stderr(io.StringIO()):
-                    st.session_state.generator = ImageMultiAngleGenerator(draw_boxes=draw_boxes)
-        except Exception as e:
-            st.error(f"生成器初始化失败: {e}")
-    elif st.session_state.generator is not None:
-        # 更新检测框设置
-        st.session_state.generator.draw_boxes = draw_boxes
-    return st.session_state.generator
+def _create_quietly(factory):
+    """包装实例创建函数，屏蔽模型加载时的警告和stderr输出"""
+    def create():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with contextlib.redirect_stderr(io.StringIO()):
+                return factory()
+    return create
+
+@st.cache_resource(show_spinner=False)
+def get_model_pools():
+    """
+    进程级共享的模型实例池（所有浏览器会话共用）
+
+    模型权重只在池中加载，内存占用不随会话数增长；
+    检测框开关等会话设置保存在session_state中，调用时传入
+    """
+    return {
+        'generator': ModelPool(_create_quietly(ImageMultiAngleGenerator), MODEL_POOL_SIZE, "生成器"),
+        'analyzer': ModelPool(_create_quietly(ImageQualityAnalyzer), MODEL_POOL_SIZE, "分析器"),
+        'agent': ModelPool(_create_quietly(MaterialGeneratorAgent), MODEL_POOL_SIZE, "Agent"),
+    }
+
+def _get_pool(kind: str, label: str):
+    """获取指定类型的实例池，首次使用时预热以便尽早暴露初始化错误"""
+    if not AGENTS_AVAILABLE:
+        return None
+    try:
+        return get_model_pools()[kind].warm_up()
+    except Exception as e:
+        st.error(f"{label}初始化失败: {e}")
+        return None
+
+def get_generator():
+    """获取共享生成器池，使用 `with pool.lease() as generator:` 借出实例"""
+    return _get_pool('generator', "生成器")
 
 def get_analyzer():
-    """获取分析器实例"""
-    if st.session_state.analyzer is None and AGENTS_AVAILABLE:
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                with contextlib.redirect_stderr(io.StringIO()):
-                    st.session_state.analyzer = ImageQualityAnalyzer()
-        except Exception as e:
-            st.error(f"分析器初始化失败: {e}")
-    return st.session_state.analyzer
+    """获取共享分析器池"""
+    return _get_pool('analyzer', "分析器")
 
 def get_agent():
-    """获取Agent实例"""
-    if st.session_state.agent is None and AGENTS_AVAILABLE:
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                with contextlib.redirect_stderr(io.StringIO()):
-                    st.session_state.agent = MaterialGeneratorAgent()
-        except Exception as e:
-            st.error(f"Agent初始化失败: {e}")
-    return st.session_state.agent
+    """获取共享Agent池"""
+    return _get_pool('agent', "Agent")
+
+def _run_generation_job(params: Dict, context) -> Dict:
+    """后台任务：从单张图片生成多角度素材"""
+    pools = get_model_pools()
+    input_path = Path(params['input_image_path'])
+    output_dir = Path(params['output_dir'])
+    try:
+        with pools['generator'].lease() as generator:
+            return generator.generate_multi_angle_images(
+                input_image_path=str(input_path),
+                output_dir=str(output_dir),
+                num_generations=params['num_generations'],
+                transformations=params.get('transformations'),
+                draw_boxes=params.get('draw_boxes', True),
+                progress_callback=context.progress_callback("生成素材"),
+                seed=params.get('seed'),
+                skip_existing=params.get('skip_existing', False)
+            )
+    except JobCancelled:
+        raise
+    except Exception as e:
+        error_msg = str(e)
+        if "list indices must be integers" in error_msg or "must be integers or slices" in error_msg:
+            # 这是统计数据的错误，不影响图片生成，返回已生成的文件
+            generated_files = sorted(str(f) for f in output_dir.glob("generated_*.jpg"))
+            return {
+                'generated_files': generated_files,
+                'num_generated': len(generated_files),
+                'confidence_statistics': {},
+                'partial': True
+            }
+        raise
+    finally:
+        if input_path.exists():
+            input_path.unlink()
+
+def save_job_uploads(uploaded_files) -> Dict:
+    """
+    把一批上传文件写入本次任务专属的临时目录（任务结束后由任务删除）
+
+    返回:
+        任务参数 {'upload_dir': 临时目录, 'files': [[保存路径, 原文件名], ...]}
+    """
+    upload_dir = Path("temp_uploads") / uuid.uuid4().hex
+    upload_dir.mkdir(parents=True)
+    files = []
+    for idx, uploaded_file in enumerate(uploaded_files):
+        path = upload_dir / f"{idx}_{Path(uploaded_file.name).name}"
+        with open(path, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        files.append([str(path), uploaded_file.name])
+    return {'upload_dir': str(upload_dir), 'files': files}
+
+def _run_analysis_job(params: Dict, context) -> Dict:
+    """后台任务：批量8维度质量分析（结果中的 image_path 为上传时的文件名）"""
+    pools = get_model_pools()
+    names = {path: name for path, name in params['files']}
+    try:
+        with pools['analyzer'].lease() as analyzer:
+            batch_result = analyzer.analyze_batch(
+                [path for path, _ in params['files']],
+                progress_callback=context.progress_callback("分析图片"))
+        for result in batch_result['individual_results']:
+            result['image_path'] = names.get(result['image_path'], result['image_path'])
+        return batch_result
+    finally:
+        shutil.rmtree(params['upload_dir'], ignore_errors=True)
+
+def _run_filter_job(params: Dict, context) -> Dict:
+    """后台任务：分析并筛选高质量素材（返回上传时的文件名）"""
+    pools = get_model_pools()
+    names = {path: name for path, name in params['files']}
+    try:
+        with pools['agent'].lease() as agent:
+            high_quality = agent.filter_high_quality_materials(
+                [path for path, _ in params['files']],
+                min_score=params['min_score'],
+                progress_callback=context.progress_callback("分析和筛选"))
+        return {'high_quality': [names.get(path, path) for path in high_quality]}
+    finally:
+        shutil.rmtree(params['upload_dir'], ignore_errors=True)
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    """
+    进程级后台任务队列（SQLite持久化，工作线程数与模型池大小一致）
+
+    任务在工作线程中运行，不受Streamlit脚本重跑影响，界面按任务ID轮询
+    """
+    job_queue = JobQueue(str(project_root / "jobs" / "drone_vision_jobs.sqlite"), num_workers=MODEL_POOL_SIZE)
+    job_queue.register('generate', _run_generation_job)
+    job_queue.register('analyze', _run_analysis_job)
+    job_queue.register('filter', _run_filter_job)
+    return job_queue
 
 def create_radar_chart(scores: Dict[str, float], title: str = "8维度质量分析雷达图"):
     """创建科幻风格的雷达图"""
@@ -487,6 +618,8 @@ def main():
         st.session_state.current_page = "📸 素材生成"
         show_generation_page()
 
+    run_pending_job_refresh()
+
 def show_generation_page():
     """素材生成页面"""
     st.markdown("## 📸 多角度素材生成器")
@@ -517,7 +650,9 @@ def show_generation_page():
             help="选择要应用的变换类型"
         )
         
-        show_detection = st.checkbox("显示检测框", value=True, help="在生成的图片上绘制YOLO检测框")
+        show_detection = st.checkbox("显示检测框", value=True,
+                                     help="在生成的图片上叠加YOLO检测框（按需绘制，切换无需重新生成）")
+    st.session_state.draw_boxes = show_detection
     
     if st.button("🚀 开始生成", type="primary", use_container_width=True):
         if not uploaded_file:
@@ -528,299 +663,392 @@ def show_generation_page():
             st.error("系统模块未加载，请检查环境配置")
             return
         
-        generator = get_generator(draw_boxes=show_detection)
-        if generator is None:
+        if get_generator() is None:
             st.error("生成器初始化失败")
             return
         
-        # 保存临时文件
+        # 保存临时文件（任务结束后由任务删除）
         temp_dir = Path("temp_uploads")
         temp_dir.mkdir(exist_ok=True)
-        temp_path = temp_dir / uploaded_file.name
+        temp_path = temp_dir / f"{int(time.time() * 1000)}_{uploaded_file.name}"
         with open(temp_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
         
-        output_dir = Path("generated_images") / datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 同一张图片重复上传时使用同一个输出目录和种子，已生成的视角直接复用
+        # 保存的视角不含检测框，显示/不显示检测框共用同一次生成
+        content_hash = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+        output_dir = Path("generated_images") / f"generation_{content_hash[:12]}"
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        try:
-            status_text.info("🔄 正在生成素材，请稍候...")
-            
-            result = None
-            try:
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    with contextlib.redirect_stderr(io.StringIO()):
-                        result = generator.generate_multi_angle_images(
-                            input_image_path=str(temp_path),
-                            output_dir=str(output_dir),
-                            num_generations=num_generations,
-                            transformations=transformations if transformations else None
-                        )
-                
-                progress_bar.progress(100)
-                status_text.success(f"✅ 成功生成 {result.get('num_generated', 0)} 张素材")
-            except Exception as e:
-                progress_bar.progress(100)
-                # 静默处理错误，尝试获取已生成的文件
-                error_msg = str(e)
-                if "list indices must be integers" in error_msg or "must be integers or slices" in error_msg:
-                    # 这是统计数据的错误，不影响图片生成
-                    # 尝试获取已生成的文件
-                    import glob
-                    generated_files = list(output_dir.glob("generated_*.jpg"))
-                    if generated_files:
-                        result = {
-                            'generated_files': [str(f) for f in generated_files],
-                            'num_generated': len(generated_files),
-                            'confidence_statistics': {}
-                        }
-                        status_text.success(f"✅ 成功生成 {len(generated_files)} 张素材（统计数据可能不完整）")
-                    else:
-                        status_text.warning("⚠️ 生成过程中出现错误，请重试")
-                        result = {'generated_files': [], 'num_generated': 0, 'confidence_statistics': {}}
-                else:
-                    # 其他错误也静默处理
-                    status_text.warning("⚠️ 生成过程中出现错误，请重试")
-                    result = {'generated_files': [], 'num_generated': 0, 'confidence_statistics': {}}
-            
-            generated_files_list = result.get('generated_files', [])
-            unique_images = list(dict.fromkeys(generated_files_list))
+        # 提交到后台任务队列，脚本重跑（操作其他控件）不会中断生成
+        st.session_state.generation_job_id = get_job_queue().submit('generate', {
+            'input_image_path': str(temp_path),
+            'output_dir': str(output_dir),
+            'num_generations': num_generations,
+            'transformations': transformations if transformations else None,
+            'draw_boxes': st.session_state.draw_boxes,
+            # 种子由图片内容决定：任务重启或重复上传时结果一致，可以跳过已有输出
+            'seed': seed_from_hash(content_hash),
+            'skip_existing': True
+        })
+        st.session_state.generation_job_applied = None
+        st.session_state.generated_images = []
+        st.session_state.detections_file = None
+        st.session_state.confidence_stats = {}
+        st.session_state.enhancement_result = None
+    
+    if not poll_generation_job():
+        return
+    
+    if st.session_state.generation_job_applied:
+        show_generation_results()
+
+def poll_generation_job() -> bool:
+    """
+    轮询当前会话的生成任务
+
+    返回:
+        任务已结束（或没有任务）时返回True，仍在运行时返回False
+    """
+    job_id = st.session_state.get('generation_job_id')
+    if not job_id:
+        return True
+    
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id)
+    if job is None:
+        st.session_state.generation_job_id = None
+        return True
+    
+    if job['status'] in (JOB_QUEUED, JOB_RUNNING):
+        show_job_progress(job_id, "生成", "cancel_generation_job")
+        return False
+    
+    if st.session_state.get('generation_job_applied') != job_id:
+        st.session_state.generation_job_applied = job_id
+        if job['status'] == JOB_SUCCEEDED:
+            result = job['result'] or {}
+            unique_images = list(dict.fromkeys(result.get('generated_files', [])))
             unique_images.sort()
             st.session_state.generated_images = unique_images
+            st.session_state.detections_file = result.get('detections_file')
             st.session_state.confidence_stats = result.get('confidence_statistics', {})
             st.session_state.enhancement_result = None
-            
-            # 显示生成的图片 - 显示所有图片，使用分页
-            st.markdown("### 🖼️ 生成的素材")
-            total_images = len(st.session_state.generated_images)
-            st.info(f"✅ 共生成 {total_images} 张素材图片")
-            
-            # 显示所有图片（不分页，使用滚动）
-            if total_images:
-                grid_container = st.container()
-                for row_start in range(0, total_images, 3):
-                    cols = grid_container.columns(3)
-                    for col_idx in range(3):
-                        idx = row_start + col_idx
-                        if idx < total_images:
-                            img_path = st.session_state.generated_images[idx]
-                            with cols[col_idx]:
-                                try:
-                                    img = Image.open(img_path)
-                                    st.image(img, use_container_width=True)
-                                    transform_name = Path(img_path).stem.split('_')[-1] if '_' in Path(img_path).stem else "original"
-                                    st.caption(f"素材 {idx + 1}/{total_images} - {transform_name}")
-                                except Exception as e:
-                                    st.error(f"加载失败: {e}")
-            
-            # 显示置信度统计饼图（显示所有置信度）
-            confidence_stats = st.session_state.confidence_stats
-            # 调试：打印置信度统计
-            if confidence_stats:
-                st.write(f"🔍 调试：置信度统计键: {list(confidence_stats.keys())}")
-            
-            if confidence_stats and len(confidence_stats) > 0:
-                st.markdown("### 📊 检测置信度统计")
-                col1, col2 = st.columns([2, 1])
-                
-                with col1:
-                    # 获取所有置信度值（不是平均值）
-                    all_confidences = confidence_stats.get('_all_confidences', [])
-                    
-                    # 如果没有_all_confidences，从其他统计中提取
-                    if not all_confidences or len(all_confidences) == 0:
-                        all_confidences = []
-                        for key, value in confidence_stats.items():
-                            if key != '_all_confidences' and key != '_total_detections' and isinstance(value, dict):
-                                if 'confidences' in value and len(value['confidences']) > 0:
-                                    all_confidences.extend(value['confidences'])
-                                elif 'avg_confidence' in value:
-                                    # 如果没有详细列表，使用平均值创建模拟数据
-                                    count = value.get('count', 1)
-                                    avg = value.get('avg_confidence', 0.5)
-                                    # 创建围绕平均值的置信度分布
-                                    for _ in range(count):
-                                        all_confidences.append(max(0.1, min(0.9, avg + random.uniform(-0.2, 0.2))))
-                        
-                        # 更新confidence_stats
-                        if all_confidences:
-                            confidence_stats['_all_confidences'] = all_confidences
-                            st.session_state.confidence_stats = confidence_stats
-                    
-                    if all_confidences and len(all_confidences) > 0:
-                        # 将置信度分组到区间（用于饼图显示）
-                        confidence_ranges = {
-                            '0.0-0.2': 0,
-                            '0.2-0.4': 0,
-                            '0.4-0.6': 0,
-                            '0.6-0.8': 0,
-                            '0.8-1.0': 0
-                        }
-                        
-                        for conf in all_confidences:
-                            if conf < 0.2:
-                                confidence_ranges['0.0-0.2'] += 1
-                            elif conf < 0.4:
-                                confidence_ranges['0.2-0.4'] += 1
-                            elif conf < 0.6:
-                                confidence_ranges['0.4-0.6'] += 1
-                            elif conf < 0.8:
-                                confidence_ranges['0.6-0.8'] += 1
-                            else:
-                                confidence_ranges['0.8-1.0'] += 1
-                        
-                        # 创建饼图 - 显示所有置信度分布
-                        fig = go.Figure(data=[go.Pie(
-                            labels=list(confidence_ranges.keys()),
-                            values=list(confidence_ranges.values()),
-                            hole=0.3,
-                            textinfo='label+percent+value',
-                            texttemplate='%{label}<br>%{value}个检测<br>占比:%{percent}',
-                            marker=dict(
-                                colors=['#ff6b9d', '#ffa500', '#00ff88', '#00ffff', '#0088ff'],
-                                line=dict(color='#000000', width=2)
-                            )
-                        )])
-                        fig.update_layout(
-                            title="所有检测置信度分布",
-                            font=dict(color='#e0e0e0', family='Rajdhani'),
-                            paper_bgcolor='rgba(0, 0, 0, 0)',
-                            plot_bgcolor='rgba(0, 0, 0, 0)',
-                            height=400
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-
-                        class_rows = []
-                        for class_name, stats in confidence_stats.items():
-                            if class_name in ['_all_confidences', '_total_detections']:
-                                continue
-                            if not isinstance(stats, dict):
-                                continue
-                            class_rows.append({
-                                "类别": class_name,
-                                "检测数量": stats.get('count', 0),
-                                "平均置信度(%)": f"{stats.get('avg_confidence', 0)*100:.1f}",
-                                "最高(%)": f"{stats.get('max_confidence', 0)*100:.1f}",
-                                "最低(%)": f"{stats.get('min_confidence', 0)*100:.1f}"
-                            })
-
-                        if class_rows:
-                            st.markdown("#### 📋 类别置信度统计")
-                            st.dataframe(pd.DataFrame(class_rows), use_container_width=True)
-                    else:
-                        st.warning("⚠️ 暂无检测数据，可能图片中没有检测到目标")
-                        # 显示调试信息
-                        with st.expander("🔍 调试信息"):
-                            st.json(confidence_stats)
-                
-                with col2:
-                    st.subheader("📈 统计信息")
-                    
-                    # 计算加权平均置信度（权重由每个维度的占比随机生成）
-                    all_confidences = st.session_state.confidence_stats.get('_all_confidences', [])
-                    if all_confidences:
-                        total_detections = len(all_confidences)
-                        st.metric("总检测数", total_detections)
-                        
-                        # 生成随机权重（8个维度）
-                        np.random.seed(int(time.time()) % 1000)
-                        dimension_weights = np.random.dirichlet(np.ones(8))  # 8个维度的随机权重
-                        
-                        # 将置信度分成8组，每组使用不同的权重
-                        num_groups = 8
-                        group_size = len(all_confidences) // num_groups
-                        weighted_sum = 0
-                        total_weight = 0
-                        
-                        for i in range(num_groups):
-                            start_idx = i * group_size
-                            end_idx = start_idx + group_size if i < num_groups - 1 else len(all_confidences)
-                            group_confidences = all_confidences[start_idx:end_idx]
-                            
-                            if group_confidences:
-                                group_avg = np.mean(group_confidences)
-                                weight = dimension_weights[i]
-                                weighted_sum += group_avg * weight
-                                total_weight += weight
-                        
-                        weighted_avg_confidence = (weighted_sum / total_weight * 100) if total_weight > 0 else 0
-                        
-                        st.metric("加权平均置信度", f"{weighted_avg_confidence:.1f}%")
-                        st.caption("权重由8维度占比随机生成")
-                        
-                        # 显示权重分布
-                        st.subheader("📊 权重分布")
-                        with st.expander("查看权重", expanded=False):
-                            dimension_names = [
-                                "图片数据量", "拍摄光照质量", "目标尺寸", "目标完整性",
-                                "数据均衡度", "产品丰富度", "目标密集度", "场景复杂度"
-                            ]
-                            for i, (name, weight) in enumerate(zip(dimension_names, dimension_weights)):
-                                st.progress(weight, text=f"{name}: {weight*100:.1f}%")
-                        
-                        # 简单平均置信度（对比）
-                        simple_avg = np.mean(all_confidences) * 100
-                        st.metric("简单平均置信度", f"{simple_avg:.1f}%")
-                        
-                        # 质量评估（使用加权平均）
-                        quality_score = weighted_avg_confidence
+            if result.get('partial'):
+                st.success(f"✅ 成功生成 {len(unique_images)} 张素材（统计数据可能不完整）")
+            elif unique_images:
+                st.success(f"✅ 成功生成 {result.get('num_generated', 0)} 张素材")
+            else:
+                st.warning("⚠️ 生成过程中出现错误，请重试")
+        elif job['status'] == JOB_CANCELLED:
+            st.info("⏹️ 生成任务已取消")
+        else:
+            st.warning("⚠️ 生成过程中出现错误，请重试")
+    return True
+
+def poll_job(state_key: str, label: str) -> Optional[Dict]:
+    """
+    轮询保存在 st.session_state[state_key] 中的后台任务（分析、筛选等）
+
+    参数:
+        state_key: 保存任务ID的session_state键
+        label: 进度条和取消按钮上显示的任务名称
+
+    返回:
+        任务刚结束时返回任务记录（每个任务只返回一次），没有任务或仍在运行时返回None
+    """
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return None
+    job = get_job_queue().get(job_id)
+    if job is None:
+        st.session_state[state_key] = None
+        return None
+    if job['status'] in (JOB_QUEUED, JOB_RUNNING):
+        show_job_progress(job_id, label, f"cancel_{state_key}")
+        return None
+    st.session_state[state_key] = None
+    return job
+
+def _job_progress(job_id: str, label: str, key: str):
+    """显示运行中任务的进度和取消按钮；任务结束后整页重跑以显示结果"""
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id)
+    if job is None or job['status'] not in (JOB_QUEUED, JOB_RUNNING):
+        st.rerun()
+    status = "排队中" if job['status'] == JOB_QUEUED else (job['message'] or f"正在{label}")
+    st.progress(min(1.0, job['progress']), text=f"🔄 {status}")
+    if st.button(f"⏹️ 取消{label}", key=key):
+        job_queue.cancel(job_id)
+    if not hasattr(st, 'fragment'):
+        st.session_state.job_refresh_pending = True
+
+
+# 进度区域作为fragment定时局部重跑，页面其余部分照常渲染；
+# 旧版Streamlit没有st.fragment，改为在页面末尾定时整页重跑（见run_pending_job_refresh）
+if hasattr(st, 'fragment'):
+    show_job_progress = st.fragment(run_every=JOB_POLL_INTERVAL)(_job_progress)
+else:
+    show_job_progress = _job_progress
+
+
+def run_pending_job_refresh():
+    """页面全部渲染完后，如有运行中的任务则等待一个刷新间隔再重跑脚本（仅旧版Streamlit）"""
+    if st.session_state.pop('job_refresh_pending', False):
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
+GALLERY_PAGE_SIZE = 12
+
+
+@st.cache_data(show_spinner=False)
+def load_generation_detections(detections_file: str) -> Dict:
+    """读取生成任务的检测附属文件（按路径缓存）"""
+    return load_detection_sidecar(detections_file)
+
+
+def show_image_gallery(image_paths: List[str], key: str, num_cols: int = 3, page_size: int = GALLERY_PAGE_SIZE,
+                       detections: Optional[Dict] = None):
+    """
+    分页显示图片画廊：只加载当前页的预览图（缩略图），不解码全分辨率原图
+
+    参数:
+        image_paths: 原图路径列表
+        key: 分页控件的唯一key
+        num_cols: 每行列数
+        page_size: 每页图片数
+        detections: 可选，load_detection_sidecar 的结果；提供时在预览图上叠加检测框
+    """
+    total_images = len(image_paths)
+    if not total_images:
+        return
+    num_pages = (total_images + page_size - 1) // page_size
+    page = 1
+    if num_pages > 1:
+        page = st.number_input(f"页码（共 {num_pages} 页）", min_value=1, max_value=num_pages,
+                               value=1, step=1, key=key)
+    start = (page - 1) * page_size
+    page_paths = image_paths[start:start + page_size]
+
+    grid_container = st.container()
+    for row_start in range(0, len(page_paths), num_cols):
+        cols = grid_container.columns(num_cols)
+        for col_idx, img_path in enumerate(page_paths[row_start:row_start + num_cols]):
+            idx = start + row_start + col_idx
+            with cols[col_idx]:
+                try:
+                    view_detections = detections['views'].get(Path(img_path).name) if detections else None
+                    if view_detections is not None:
+                        st.image(overlay_preview(img_path, view_detections, detections['class_names'],
+                                                 detections['image_size']), use_container_width=True)
                     else:
-                        quality_score = 0
-                    
-                    if quality_score > 0:
-                        if quality_score < 60:
-                            st.warning("⚠️ 素材质量较低，建议查看训练技巧（可在左侧控制面板切换）")
-                        elif quality_score < 80:
-                            st.info("⚡ 素材质量良好，可以进一步提升（可在左侧控制面板查看训练技巧）")
-                        else:
-                            st.success("✅ 素材质量优秀（可在左侧控制面板查看训练技巧）")
-            
-            # 显示详细统计表格
-            if st.session_state.confidence_stats:
-                with st.expander("📋 详细检测统计", expanded=False):
-                    stats_data = []
-                    for class_name, stats in st.session_state.confidence_stats.items():
-                        # 跳过特殊键
-                        if class_name in ['_all_confidences', '_total_detections']:
-                            continue
-                        # 确保stats是字典且包含所需字段
-                        if not isinstance(stats, dict):
-                            continue
-                        if 'count' not in stats or 'avg_confidence' not in stats:
-                            continue
-                        stats_data.append({
-                            '类别': class_name,
-                            '检测数量': stats.get('count', 0),
-                            '平均置信度': f"{stats.get('avg_confidence', 0)*100:.2f}%",
-                            '最高置信度': f"{stats.get('max_confidence', 0)*100:.2f}%",
-                            '最低置信度': f"{stats.get('min_confidence', 0)*100:.2f}%"
-                        })
-                    if stats_data:
-                        df_stats = pd.DataFrame(stats_data)
-                        st.dataframe(df_stats, use_container_width=True)
+                        st.image(str(get_preview(img_path)), use_container_width=True)
+                    transform_name = Path(img_path).stem.split('_')[-1] if '_' in Path(img_path).stem else "original"
+                    st.caption(f"素材 {idx + 1}/{total_images} - {transform_name}")
+                except Exception as e:
+                    st.error(f"加载失败: {e}")
+
+
+def show_generation_results():
+    """显示生成结果（图片网格和置信度统计）"""
+    # 显示生成的图片 - 分页加载预览图
+    st.markdown("### 🖼️ 生成的素材")
+    total_images = len(st.session_state.generated_images)
+    st.info(f"✅ 共生成 {total_images} 张素材图片")
+    detections = None
+    detections_file = st.session_state.get('detections_file')
+    if st.session_state.draw_boxes and detections_file and Path(detections_file).exists():
+        detections = load_generation_detections(detections_file)
+    show_image_gallery(st.session_state.generated_images, key="generation_gallery_page", detections=detections)
+
+    # 显示置信度统计饼图（显示所有置信度）
+    confidence_stats = st.session_state.confidence_stats
+    # 调试：打印置信度统计
+    if confidence_stats:
+        st.write(f"🔍 调试：置信度统计键: {list(confidence_stats.keys())}")
+
+    if confidence_stats and len(confidence_stats) > 0:
+        st.markdown("### 📊 检测置信度统计")
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            # 获取所有置信度值（不是平均值）
+            all_confidences = confidence_stats.get('_all_confidences', [])
+
+            # 如果没有_all_confidences，从其他统计中提取
+            if not all_confidences or len(all_confidences) == 0:
+                all_confidences = []
+                for key, value in confidence_stats.items():
+                    if key != '_all_confidences' and key != '_total_detections' and isinstance(value, dict):
+                        if 'confidences' in value and len(value['confidences']) > 0:
+                            all_confidences.extend(value['confidences'])
+                        elif 'avg_confidence' in value:
+                            # 如果没有详细列表，使用平均值创建模拟数据
+                            count = value.get('count', 1)
+                            avg = value.get('avg_confidence', 0.5)
+                            # 创建围绕平均值的置信度分布
+                            for _ in range(count):
+                                all_confidences.append(max(0.1, min(0.9, avg + random.uniform(-0.2, 0.2))))
+
+                # 更新confidence_stats
+                if all_confidences:
+                    confidence_stats['_all_confidences'] = all_confidences
+                    st.session_state.confidence_stats = confidence_stats
+
+            if all_confidences and len(all_confidences) > 0:
+                # 将置信度分组到区间（用于饼图显示）
+                confidence_ranges = {
+                    '0.0-0.2': 0,
+                    '0.2-0.4': 0,
+                    '0.4-0.6': 0,
+                    '0.6-0.8': 0,
+                    '0.8-1.0': 0
+                }
+
+                for conf in all_confidences:
+                    if conf < 0.2:
+                        confidence_ranges['0.0-0.2'] += 1
+                    elif conf < 0.4:
+                        confidence_ranges['0.2-0.4'] += 1
+                    elif conf < 0.6:
+                        confidence_ranges['0.4-0.6'] += 1
+                    elif conf < 0.8:
+                        confidence_ranges['0.6-0.8'] += 1
                     else:
-                        st.info("暂无详细统计数据")
-        
-        except Exception as e:
-            # 静默处理错误，不显示红色错误框
-            # 只在调试模式下显示
-            import traceback
-            error_msg = str(e)
-            # 如果是常见错误，静默处理
-            if "list indices must be integers" in error_msg or "must be integers or slices" in error_msg:
-                # 静默处理，不显示错误
-                pass
+                        confidence_ranges['0.8-1.0'] += 1
+
+                # 创建饼图 - 显示所有置信度分布
+                fig = go.Figure(data=[go.Pie(
+                    labels=list(confidence_ranges.keys()),
+                    values=list(confidence_ranges.values()),
+                    hole=0.3,
+                    textinfo='label+percent+value',
+                    texttemplate='%{label}<br>%{value}个检测<br>占比:%{percent}',
+                    marker=dict(
+                        colors=['#ff6b9d', '#ffa500', '#00ff88', '#00ffff', '#0088ff'],
+                        line=dict(color='#000000', width=2)
+                    )
+                )])
+                fig.update_layout(
+                    title="所有检测置信度分布",
+                    font=dict(color='#e0e0e0', family='Rajdhani'),
+                    paper_bgcolor='rgba(0, 0, 0, 0)',
+                    plot_bgcolor='rgba(0, 0, 0, 0)',
+                    height=400
+                )
+                st.plotly_chart(fig, use_container_width=True)
+
+                class_rows = []
+                for class_name, stats in confidence_stats.items():
+                    if class_name in ['_all_confidences', '_total_detections']:
+                        continue
+                    if not isinstance(stats, dict):
+                        continue
+                    class_rows.append({
+                        "类别": class_name,
+                        "检测数量": stats.get('count', 0),
+                        "平均置信度(%)": f"{stats.get('avg_confidence', 0)*100:.1f}",
+                        "最高(%)": f"{stats.get('max_confidence', 0)*100:.1f}",
+                        "最低(%)": f"{stats.get('min_confidence', 0)*100:.1f}"
+                    })
+
+                if class_rows:
+                    st.markdown("#### 📋 类别置信度统计")
+                    st.dataframe(pd.DataFrame(class_rows), use_container_width=True)
             else:
-                # 其他错误也静默处理，避免影响用户体验
-                pass
-        finally:
-            progress_bar.empty()
-            if temp_path.exists():
-                temp_path.unlink()
+                st.warning("⚠️ 暂无检测数据，可能图片中没有检测到目标")
+                # 显示调试信息
+                with st.expander("🔍 调试信息"):
+                    st.json(confidence_stats)
+
+        with col2:
+            st.subheader("📈 统计信息")
+
+            # 计算加权平均置信度（权重由每个维度的占比随机生成）
+            all_confidences = st.session_state.confidence_stats.get('_all_confidences', [])
+            if all_confidences:
+                total_detections = len(all_confidences)
+                st.metric("总检测数", total_detections)
+
+                # 生成随机权重（8个维度）
+                np.random.seed(int(time.time()) % 1000)
+                dimension_weights = np.random.dirichlet(np.ones(8))  # 8个维度的随机权重
+
+                # 将置信度分成8组，每组使用不同的权重
+                num_groups = 8
+                group_size = len(all_confidences) // num_groups
+                weighted_sum = 0
+                total_weight = 0
+
+                for i in range(num_groups):
+                    start_idx = i * group_size
+                    end_idx = start_idx + group_size if i < num_groups - 1 else len(all_confidences)
+                    group_confidences = all_confidences[start_idx:end_idx]
+
+                    if group_confidences:
+                        group_avg = np.mean(group_confidences)
+                        weight = dimension_weights[i]
+                        weighted_sum += group_avg * weight
+                        total_weight += weight
+
+                weighted_avg_confidence = (weighted_sum / total_weight * 100) if total_weight > 0 else 0
+
+                st.metric("加权平均置信度", f"{weighted_avg_confidence:.1f}%")
+                st.caption("权重由8维度占比随机生成")
+
+                # 显示权重分布
+                st.subheader("📊 权重分布")
+                with st.expander("查看权重", expanded=False):
+                    dimension_names = [
+                        "图片数据量", "拍摄光照质量", "目标尺寸", "目标完整性",
+                        "数据均衡度", "产品丰富度", "目标密集度", "场景复杂度"
+                    ]
+                    for i, (name, weight) in enumerate(zip(dimension_names, dimension_weights)):
+                        st.progress(weight, text=f"{name}: {weight*100:.1f}%")
+
+                # 简单平均置信度（对比）
+                simple_avg = np.mean(all_confidences) * 100
+                st.metric("简单平均置信度", f"{simple_avg:.1f}%")
+
+                # 质量评估（使用加权平均）
+                quality_score = weighted_avg_confidence
+            else:
+                quality_score = 0
+
+            if quality_score > 0:
+                if quality_score < 60:
+                    st.warning("⚠️ 素材质量较低，建议查看训练技巧（可在左侧控制面板切换）")
+                elif quality_score < 80:
+                    st.info("⚡ 素材质量良好，可以进一步提升（可在左侧控制面板查看训练技巧）")
+                else:
+                    st.success("✅ 素材质量优秀（可在左侧控制面板查看训练技巧）")
+
+    # 显示详细统计表格
+    if st.session_state.confidence_stats:
+        with st.expander("📋 详细检测统计", expanded=False):
+            stats_data = []
+            for class_name, stats in st.session_state.confidence_stats.items():
+                # 跳过特殊键
+                if class_name in ['_all_confidences', '_total_detections']:
+                    continue
+                # 确保stats是字典且包含所需字段
+                if not isinstance(stats, dict):
+                    continue
+                if 'count' not in stats or 'avg_confidence' not in stats:
+                    continue
+                stats_data.append({
+                    '类别': class_name,
+                    '检测数量': stats.get('count', 0),
+                    '平均置信度': f"{stats.get('avg_confidence', 0)*100:.2f}%",
+                    '最高置信度': f"{stats.get('max_confidence', 0)*100:.2f}%",
+                    '最低置信度': f"{stats.get('min_confidence', 0)*100:.2f}%"
+                })
+            if stats_data:
+                df_stats = pd.DataFrame(stats_data)
+                st.dataframe(df_stats, use_container_width=True)
+            else:
+                st.info("暂无详细统计数据")
+
 
 def show_analysis_page():
     """质量分析页面"""
@@ -874,8 +1102,8 @@ def show_analysis_page():
             st.error("系统模块未加载")
             return
         
-        analyzer = get_analyzer()
-        if analyzer is None:
+        analyzer_pool = get_analyzer()
+        if analyzer_pool is None:
             st.error("分析器初始化失败")
             return
         
@@ -884,19 +1112,17 @@ def show_analysis_page():
                 st.error("请先上传图片")
                 return
             
-            # 保存临时文件
-            temp_dir = Path("temp_uploads")
-            temp_dir.mkdir(exist_ok=True)
-            temp_path = temp_dir / uploaded_file.name
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            # 上传字节直接解码为数组，不写临时文件
+            records = decode_uploads([uploaded_file], target_side=ANALYSIS_MAX_SIDE)
+            if not records:
+                st.error("图片解码失败")
+                return
             
             try:
                 with st.spinner("🔄 正在分析..."):
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        with contextlib.redirect_stderr(io.StringIO()):
-                            result = analyzer.analyze_single_image(str(temp_path))
+                    with analyzer_pool.lease() as analyzer:
+                        result = analyzer.analyze_image_array(records[0]['image'], records[0]['file_size'],
+                                                              records[0]['full_size'])
                 
                 st.session_state.analysis_results = result
                 
@@ -934,63 +1160,55 @@ def show_analysis_page():
             
             except Exception as e:
                 st.error(f"分析失败: {str(e)}")
-            finally:
-                if temp_path.exists():
-                    temp_path.unlink()
         
         else:  # 批量分析
             if not uploaded_files:
                 st.error("请先上传图片")
                 return
             
-            # 保存临时文件
-            temp_dir = Path("temp_uploads")
-            temp_dir.mkdir(exist_ok=True)
-            temp_paths = []
-            for file in uploaded_files:
-                temp_path = temp_dir / file.name
-                with open(temp_path, "wb") as f:
-                    f.write(file.getbuffer())
-                temp_paths.append(str(temp_path))
-            
-            try:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    with contextlib.redirect_stderr(io.StringIO()):
-                        results = analyzer.analyze_batch(temp_paths)
-                
-                progress_bar.progress(100)
-                status_text.success(f"✅ 成功分析 {len(results)} 张图片")
-                
-                # 显示结果表格
-                st.markdown("### 📋 分析结果表格")
-                df = pd.DataFrame(results)
-                st.dataframe(df, use_container_width=True)
-                
-                # 平均得分
-                avg_scores = df.iloc[:, 1:].mean()
-                st.markdown("### 📊 平均维度得分")
-                fig = create_radar_chart(avg_scores.to_dict(), "批量分析平均得分")
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # 导出CSV
-                csv = df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button(
-                    "📥 下载CSV报告",
-                    csv,
-                    file_name=f"batch_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
-            
-            except Exception as e:
-                st.error(f"批量分析失败: {str(e)}")
-            finally:
-                for path in temp_paths:
-                    if Path(path).exists():
-                        Path(path).unlink()
+            # 提交到后台任务队列，脚本重跑（操作其他控件）不会中断分析
+            st.session_state.analysis_job_id = get_job_queue().submit('analyze', save_job_uploads(uploaded_files))
+            st.session_state.batch_analysis_result = None
+    
+    if analysis_mode == "批量分析":
+        job = poll_job('analysis_job_id', "分析")
+        if job is not None:
+            if job['status'] == JOB_SUCCEEDED:
+                st.session_state.batch_analysis_result = job['result']
+            elif job['status'] == JOB_CANCELLED:
+                st.info("⏹️ 分析任务已取消")
+            else:
+                st.error(f"批量分析失败: {job.get('error') or '未知错误'}")
+        if st.session_state.batch_analysis_result:
+            show_batch_analysis_result(st.session_state.batch_analysis_result)
+
+def show_batch_analysis_result(batch_result: Dict):
+    """显示批量分析结果：得分表格、平均得分雷达图和CSV导出"""
+    results = batch_result['individual_results']
+    st.success(f"✅ 成功分析 {len(results)} 张图片")
+    if not results:
+        return
+    
+    # 显示结果表格（第一列为文件名，其余为各维度得分）
+    st.markdown("### 📋 分析结果表格")
+    df = pd.DataFrame(results)
+    df = df[['image_path'] + [c for c in df.columns if c != 'image_path']]
+    st.dataframe(df, use_container_width=True)
+    
+    # 平均得分
+    avg_scores = df.iloc[:, 1:].mean()
+    st.markdown("### 📊 平均维度得分")
+    fig = create_radar_chart(avg_scores.to_dict(), "批量分析平均得分")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # 导出CSV
+    csv = df.to_csv(index=False).encode('utf-8-sig')
+    st.download_button(
+        "📥 下载CSV报告",
+        csv,
+        file_name=f"batch_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv"
+    )
 
 def show_filter_page():
     """智能筛选页面"""
@@ -1022,52 +1240,43 @@ def show_filter_page():
             st.error("系统模块未加载")
             return
         
-        agent = get_agent()
-        if agent is None:
+        agent_pool = get_agent()
+        if agent_pool is None:
             st.error("Agent初始化失败")
             return
         
-        # 保存临时文件
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        temp_paths = []
-        for file in uploaded_files:
-            temp_path = temp_dir / file.name
-            with open(temp_path, "wb") as f:
-                f.write(file.getbuffer())
-            temp_paths.append(str(temp_path))
-        
-        try:
-            with st.spinner("🔄 正在分析和筛选..."):
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    with contextlib.redirect_stderr(io.StringIO()):
-                        if filter_mode == "总体得分":
-                            high_quality = agent.filter_high_quality_materials(temp_paths, min_score=min_score)
-                        else:
-                            # 需要实现其他筛选模式
-                            high_quality = agent.filter_high_quality_materials(temp_paths, min_score=min_score)
-            
-            st.success(f"✅ 筛选完成，找到 {len(high_quality)} 张高质量素材")
-            
-            # 显示筛选结果
-            st.markdown("### 🎯 高质量素材")
-            cols = st.columns(3)
-            for idx, img_path in enumerate(high_quality[:9]):
-                with cols[idx % 3]:
-                    try:
-                        img = Image.open(img_path)
-                        st.image(img, use_container_width=True)
-                        st.caption(f"素材 {idx + 1}")
-                    except:
-                        pass
+        # 提交到后台任务队列，脚本重跑（操作其他控件）不会中断筛选
+        # 需要实现其他筛选模式（目前均按总体得分筛选）
+        params = save_job_uploads(uploaded_files)
+        params['min_score'] = min_score
+        st.session_state.filter_job_id = get_job_queue().submit('filter', params)
+        st.session_state.filter_result = None
+    
+    job = poll_job('filter_job_id', "筛选")
+    if job is not None:
+        if job['status'] == JOB_SUCCEEDED:
+            st.session_state.filter_result = job['result']
+        elif job['status'] == JOB_CANCELLED:
+            st.info("⏹️ 筛选任务已取消")
+        else:
+            st.error(f"筛选失败: {job.get('error') or '未知错误'}")
+    
+    if st.session_state.filter_result is not None:
+        high_quality = st.session_state.filter_result['high_quality']
+        st.success(f"✅ 筛选完成，找到 {len(high_quality)} 张高质量素材")
         
-        except Exception as e:
-            st.error(f"筛选失败: {str(e)}")
-        finally:
-            for path in temp_paths:
-                if Path(path).exists():
-                    Path(path).unlink()
+        # 显示筛选结果：只解码要预览的图片
+        st.markdown("### 🎯 高质量素材")
+        files_by_name = {f.name: f for f in uploaded_files or []}
+        cols = st.columns(3)
+        for idx, img_name in enumerate(high_quality[:9]):
+            with cols[idx % 3]:
+                try:
+                    records = decode_uploads([files_by_name[img_name]], target_side=ANALYSIS_MAX_SIDE)
+                    st.image(make_preview(records[0]['image']), use_container_width=True)
+                    st.caption(f"素材 {idx + 1} - {img_name}")
+                except:
+                    pass
 
 def show_report_page():
     """数据报告页面"""
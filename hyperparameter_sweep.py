@@ -0,0 +1,270 @@
+"""
+无人机视觉超参数搜索
+Drone Vision Hyperparameter Sweep
+
+在进程池中并行运行多个DroneVisionExperiment试验：
+- 每个试验进程通过torch.set_num_threads只占用一部分CPU线程
+- 数据集只生成一次，通过共享内存分发给所有试验进程；训练/验证/测试划分也只在父进程做一次，
+  试验进程按下标读取共享数组，不复制数据
+- 使用Successive Halving逐轮淘汰表现差的试验，存活的试验获得更多epoch：
+  每轮结束时保存试验的检查点，下一轮从检查点继续训练，不从头重训
+- 所有试验记录到同一个MLflow实验中
+"""
+
+import argparse
+import itertools
+import math
+import multiprocessing as mp
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import mlflow
+import torch
+
+from main import DroneVisionExperiment, available_cpu_count
+from thread_budget import ThreadBudget, init_worker
+
+
+# 默认搜索空间
+DEFAULT_SEARCH_SPACE = {
+    'learning_rate': [0.0003, 0.001, 0.003, 0.01],
+    'batch_size': [16, 32, 64],
+}
+
+# 试验进程内的共享数据（由_init_worker设置）
+_WORKER_STATE = {}
+
+
+def _init_worker(shared_specs, splits, num_threads, tracking_uri, experiment_name):
+    """试验进程初始化：限制线程数并挂载共享内存中的数据集"""
+    init_worker(num_threads)
+    mlflow.set_tracking_uri(tracking_uri)
+
+    arrays = {}
+    handles = []
+    for key, (name, shape, dtype) in shared_specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        handles.append(shm)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    _WORKER_STATE.update({
+        'images': arrays['images'],
+        'labels': arrays['labels'],
+        'splits': splits,
+        'experiment_name': experiment_name,
+        # 保持引用，避免共享内存被提前关闭
+        'handles': handles,
+    })
+
+
+def _run_trial(trial, num_epochs, rung, sweep_id, checkpoint_dir):
+    """在试验进程中训练一个配置（累计训练到num_epochs轮，从上一轮的检查点继续），返回验证/测试结果"""
+    params = trial['params']
+    loader_config = {'batch_size': params.get('batch_size', 32)}
+    experiment = DroneVisionExperiment(_WORKER_STATE['experiment_name'], loader_config=loader_config)
+    experiment.prepare_data(_WORKER_STATE['images'], _WORKER_STATE['labels'], splits=_WORKER_STATE['splits'])
+
+    history, test_accuracy = experiment.train_model(
+        num_epochs=num_epochs,
+        learning_rate=params.get('learning_rate', 0.001),
+        perf_modes=params.get('perf_modes'),
+        run_name=f"sweep_{sweep_id}_trial{trial['trial_id']}_rung{rung}",
+        extra_params={
+            'sweep_id': sweep_id,
+            'trial_id': trial['trial_id'],
+            'sweep_rung': rung,
+            'torch_num_threads': torch.get_num_threads(),
+        },
+        checkpoint_path=os.path.join(checkpoint_dir, f"trial_{trial['trial_id']}.pt")
+    )
+    return {
+        'trial_id': trial['trial_id'],
+        'params': params,
+        'rung': rung,
+        'num_epochs': num_epochs,
+        'val_accuracy': history['val_accuracies'][-1],
+        'test_accuracy': test_accuracy,
+        'train_time': history['train_time'],
+    }
+
+
+def sample_trials(search_space=None, num_trials=None, seed=42):
+    """
+    从搜索空间生成试验配置
+
+    参数:
+        search_space: {超参数名: 候选值列表}
+        num_trials: 试验数量，None表示完整网格；小于网格大小时随机抽样
+        seed: 抽样随机种子
+
+    返回:
+        [{'trial_id': int, 'params': dict}, ...]
+    """
+    search_space = search_space or DEFAULT_SEARCH_SPACE
+    keys = list(search_space)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(search_space[k] for k in keys))]
+    if num_trials is not None and num_trials < len(grid):
+        grid = random.Random(seed).sample(grid, num_trials)
+    return [{'trial_id': i, 'params': params} for i, params in enumerate(grid)]
+
+
+def run_sweep(
+    experiment_name="无人机视觉实验",
+    search_space=None,
+    num_trials=None,
+    num_samples=1000,
+    min_epochs=1,
+    max_epochs=9,
+    eta=3,
+    threads_per_trial=None,
+    max_parallel=None,
+    seed=42
+):
+    """
+    并行运行超参数搜索（Successive Halving）
+
+    第k轮每个存活试验累计训练到 min_epochs * eta^k 个epoch（不超过max_epochs，从上一轮的检查点继续），
+    按验证准确率保留前 1/eta，直到只剩一个试验或达到max_epochs
+
+    参数:
+        experiment_name: MLflow实验名称
+        search_space: 搜索空间，见sample_trials
+        num_trials: 试验数量
+        num_samples: 合成数据集样本数
+        min_epochs: 第一轮的epoch数
+        max_epochs: 最后一轮的epoch上限
+        eta: 每轮淘汰比例
+        threads_per_trial: 每个试验进程的torch线程数，None则按CPU核数和并行度均分
+        max_parallel: 最大并行试验数，None则按 CPU核数 // threads_per_trial
+        seed: 随机种子
+
+    返回:
+        {'sweep_id', 'best', 'rungs': [[trial结果, ...], ...]}
+    """
+    trials = sample_trials(search_space, num_trials, seed)
+    if not trials:
+        raise ValueError("搜索空间为空，没有可运行的试验")
+
+    cpus = available_cpu_count()
+    if threads_per_trial is None:
+        parallel = max_parallel or min(len(trials), cpus)
+        threads_per_trial = ThreadBudget.for_profile('batch', workers=parallel, cpus=cpus).intra_op_threads
+    if max_parallel is None:
+        max_parallel = max(1, cpus // threads_per_trial)
+    max_parallel = min(max_parallel, len(trials))
+
+    sweep_id = uuid.uuid4().hex[:8]
+    print(f"🔍 超参数搜索 {sweep_id}: {len(trials)} 个试验，并行 {max_parallel}，"
+          f"每个试验 {threads_per_trial} 线程")
+
+    # 数据集只生成一次，放入共享内存
+    np.random.seed(seed)
+    generator = DroneVisionExperiment(experiment_name)
+    images, labels, class_names = generator.generate_synthetic_data(num_samples=num_samples)
+    splits = DroneVisionExperiment.split_indices(labels)
+
+    shared = {}
+    shared_specs = {}
+    # 每个试验的检查点（模型/优化器/调度器状态），下一轮从这里继续训练
+    checkpoint_dir = tempfile.mkdtemp(prefix=f"sweep_{sweep_id}_")
+    try:
+        for key, array in (('images', images), ('labels', labels)):
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            shared[key] = shm
+            shared_specs[key] = (shm.name, array.shape, array.dtype.str)
+        del images, labels
+
+        # spawn避免fork后继承父进程的torch/OpenMP线程状态
+        with ProcessPoolExecutor(
+            max_workers=max_parallel,
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(shared_specs, splits, threads_per_trial, mlflow.get_tracking_uri(), experiment_name)
+        ) as pool:
+            rungs = []
+            survivors = trials
+            rung = 0
+            while True:
+                num_epochs = min(max_epochs, min_epochs * eta ** rung)
+                print(f"\n===== 第 {rung} 轮: {len(survivors)} 个试验 × {num_epochs} epoch =====")
+                futures = [pool.submit(_run_trial, trial, num_epochs, rung, sweep_id, checkpoint_dir) for trial in survivors]
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        print(f"❌ 试验失败: {e}")
+                if not results:
+                    raise RuntimeError("本轮所有试验均失败")
+
+                results.sort(key=lambda r: r['val_accuracy'], reverse=True)
+                rungs.append(results)
+                for r in results:
+                    print(f"  trial {r['trial_id']}: 验证准确率 {r['val_accuracy']:.2f}% {r['params']}")
+
+                if len(results) == 1 or num_epochs >= max_epochs:
+                    break
+                keep = max(1, math.ceil(len(results) / eta))
+                survivors = [{'trial_id': r['trial_id'], 'params': r['params']} for r in results[:keep]]
+                rung += 1
+    finally:
+        for shm in shared.values():
+            shm.close()
+            shm.unlink()
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    best = rungs[-1][0]
+    with mlflow.start_run(run_name=f"sweep_{sweep_id}_summary"):
+        mlflow.log_params({
+            'sweep_id': sweep_id,
+            'sweep_num_trials': len(trials),
+            'sweep_eta': eta,
+            'sweep_threads_per_trial': threads_per_trial,
+            'sweep_max_parallel': max_parallel,
+            **{f"best_{k}": v for k, v in best['params'].items()}
+        })
+        mlflow.log_metrics({
+            'best_val_accuracy': best['val_accuracy'],
+            'best_test_accuracy': best['test_accuracy'],
+        })
+
+    print(f"\n🏆 最优配置: {best['params']} (验证准确率 {best['val_accuracy']:.2f}%, "
+          f"测试准确率 {best['test_accuracy']:.2f}%)")
+    return {'sweep_id': sweep_id, 'best': best, 'rungs': rungs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无人机视觉超参数并行搜索")
+    parser.add_argument("--experiment-name", type=str, default="无人机视觉实验", help="MLflow实验名称")
+    parser.add_argument("--num-trials", type=int, default=None, help="试验数量 (默认: 完整网格)")
+    parser.add_argument("--num-samples", type=int, default=1000, help="合成数据集样本数 (默认: 1000)")
+    parser.add_argument("--min-epochs", type=int, default=1, help="第一轮epoch数 (默认: 1)")
+    parser.add_argument("--max-epochs", type=int, default=9, help="最后一轮epoch上限 (默认: 9)")
+    parser.add_argument("--eta", type=int, default=3, help="每轮保留 1/eta 的试验 (默认: 3)")
+    parser.add_argument("--threads-per-trial", type=int, default=None, help="每个试验的torch线程数 (默认: 自动)")
+    parser.add_argument("--max-parallel", type=int, default=None, help="最大并行试验数 (默认: 自动)")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子 (默认: 42)")
+    args = parser.parse_args()
+
+    run_sweep(
+        experiment_name=args.experiment_name,
+        num_trials=args.num_trials,
+        num_samples=args.num_samples,
+        min_epochs=args.min_epochs,
+        max_epochs=args.max_epochs,
+        eta=args.eta,
+        threads_per_trial=args.threads_per_trial,
+        max_parallel=args.max_parallel,
+        seed=args.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -23,29 +23,176 @@ import mlflow
 import mlflow.pytorch
 import mlflow.sklearn
 from mlflow.tracking import MlflowClient
+from mlflow.entities import Metric, Param
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import json
+import threading
+import time
 import warnings
 warnings.filterwarnings('ignore')
 
+from thread_budget import apply_profile, available_cpu_count
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei']
 plt.rcParams['axes.unicode_minus'] = False
 
+# 数据加载器默认配置
+# num_workers 设为 'auto' 时会在 prepare_data 中按前N个batch的吞吐量自动选择
+# pin_memory 为 None 时按设备自动决定（仅CUDA下锁页内存才有意义）
+DEFAULT_LOADER_CONFIG = {
+    'batch_size': 32,
+    'num_workers': 0,
+    'persistent_workers': True,
+    'prefetch_factor': 2,
+    'pin_memory': None,
+    'drop_last': False,
+    'autotune_batches': 20,
+}
+
+# 可选的CPU性能模式
+PERF_MODES = ('bf16', 'channels_last', 'compile')
+
+
+class AsyncMetricLogger:
+    """
+    异步批量MLflow指标记录器
+
+    指标和参数先缓存在内存中，由后台线程定时（或调用flush时）
+    通过MlflowClient.log_batch一次性写入，训练循环内每次记录只是一次加锁追加，
+    开销足够小，可以常开逐batch指标
+    """
+
+    # MLflow log_batch单次请求的上限
+    MAX_METRICS_PER_BATCH = 1000
+    MAX_PARAMS_PER_BATCH = 100
+
+    def __init__(self, run_id, client=None, flush_interval=5.0):
+        """
+        参数:
+            run_id: 要写入的MLflow run ID
+            client: MlflowClient实例，None则新建
+            flush_interval: 后台定时刷新间隔（秒）
+        """
+        self.run_id = run_id
+        self.client = client or MlflowClient()
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._params = []
+        self._lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flushed = threading.Condition(self._lock)
+        # flush请求序号 / 已完成写入的序号，用于flush(wait=True)
+        self._flush_requested = 0
+        self._flush_done = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="mlflow-metric-logger", daemon=True)
+        self._thread.start()
+
+    def log_param(self, key, value):
+        """缓存一个参数"""
+        with self._lock:
+            self._params.append(Param(key, str(value)))
+
+    def log_params(self, params):
+        """缓存多个参数"""
+        with self._lock:
+            self._params.extend(Param(key, str(value)) for key, value in params.items())
+
+    def log_metric(self, key, value, step=None):
+        """缓存一个指标"""
+        metric = Metric(key, float(value), int(time.time() * 1000), step or 0)
+        with self._lock:
+            self._metrics.append(metric)
+
+    def log_metrics(self, metrics, step=None):
+        """缓存多个指标（同一step）"""
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._metrics.extend(Metric(key, float(value), timestamp, step or 0)
+                                 for key, value in metrics.items())
+
+    def flush(self, wait=False):
+        """
+        通知后台线程立即写入缓存
+
+        参数:
+            wait: 是否阻塞到本次写入完成
+        """
+        with self._lock:
+            self._flush_requested += 1
+            target = self._flush_requested
+            self._flush_event.set()
+            if wait:
+                while self._flush_done < target and self._thread.is_alive():
+                    self._flushed.wait(timeout=self.flush_interval)
+
+    def close(self):
+        """写入剩余缓存并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_event.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            self._flush_event.wait(timeout=self.flush_interval)
+            self._flush_event.clear()
+            closed = self._closed
+            with self._lock:
+                requested = self._flush_requested
+                metrics, self._metrics = self._metrics, []
+                params, self._params = self._params, []
+            self._write(metrics, params)
+            with self._lock:
+                self._flush_done = requested
+                self._flushed.notify_all()
+            if closed:
+                return
+
+    def _write(self, metrics, params):
+        if not metrics and not params:
+            return
+        try:
+            for i in range(0, len(params), self.MAX_PARAMS_PER_BATCH):
+                self.client.log_batch(self.run_id, params=params[i:i + self.MAX_PARAMS_PER_BATCH])
+            for i in range(0, len(metrics), self.MAX_METRICS_PER_BATCH):
+                self.client.log_batch(self.run_id, metrics=metrics[i:i + self.MAX_METRICS_PER_BATCH])
+        except Exception as e:
+            # 记录失败不应中断训练
+            print(f"⚠️ MLflow批量记录失败: {e}")
+
+
 class DroneDataset(Dataset):
     """无人机数据集类"""
-    def __init__(self, images, labels, transform=None):
+    def __init__(self, images, labels, transform=None, indices=None):
+        """
+        参数:
+            images / labels: 完整数据数组（可以是共享内存上的数组）
+            transform: 图片变换
+            indices: 可选，本数据集使用的样本下标；按下标逐条读取，不复制数组
+        """
         self.images = images
         self.labels = labels
         self.transform = transform
+        self.indices = indices
     
     def __len__(self):
-        return len(self.images)
+        return len(self.indices) if self.indices is not None else len(self.images)
     
     def __getitem__(self, idx):
+        if self.indices is not None:
+            idx = self.indices[idx]
         image = self.images[idx]
         label = self.labels[idx]
         
@@ -96,7 +243,8 @@ class DroneVisionCNN(nn.Module):
         x = self.pool(self.relu(self.bn4(self.conv4(x))))
         
         # 展平
-        x = x.view(x.size(0), -1)
+        # flatten兼容channels_last（NHWC步长下view会失败）
+        x = torch.flatten(x, 1)
         
         # 全连接层
         x = self.dropout(self.relu(self.fc1(x)))
@@ -108,17 +256,125 @@ class DroneVisionCNN(nn.Module):
 class DroneVisionExperiment:
     """无人机视觉MLflow实验类"""
     
-    def __init__(self, experiment_name="无人机视觉实验"):
+    def __init__(self, experiment_name="无人机视觉实验", loader_config=None):
         self.experiment_name = experiment_name
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model = None
+        self.runtime_model = None
+        self.perf_modes = ()
         self.train_loader = None
         self.val_loader = None
         self.test_loader = None
-        
+
+        # 数据加载器配置
+        self.loader_config = dict(DEFAULT_LOADER_CONFIG)
+        self.loader_autotune_results = {}
+        if loader_config:
+            self.configure_loader(**loader_config)
+
         # 设置MLflow实验
         mlflow.set_experiment(experiment_name)
-        
+
+    def configure_loader(self, **overrides):
+        """
+        更新数据加载器配置
+
+        参数:
+            batch_size: 批次大小
+            num_workers: 工作进程数，'auto' 表示自动调优
+            persistent_workers: epoch之间是否保留工作进程
+            prefetch_factor: 每个工作进程预取的batch数
+            pin_memory: 是否使用锁页内存，None表示按设备自动决定
+            drop_last: 训练集是否丢弃最后一个不完整batch
+            autotune_batches: 自动调优时每个候选测量的batch数
+        """
+        unknown = set(overrides) - set(DEFAULT_LOADER_CONFIG)
+        if unknown:
+            raise ValueError(f"未知的数据加载器配置项: {sorted(unknown)}")
+        self.loader_config.update(overrides)
+        return self.loader_config
+
+    def _build_loader(self, dataset, shuffle=False, drop_last=False, num_workers=None, persistent=None):
+        """按当前配置创建DataLoader"""
+        config = self.loader_config
+        if num_workers is None:
+            num_workers = config['num_workers']
+        pin_memory = config['pin_memory']
+        if pin_memory is None:
+            pin_memory = self.device.type == 'cuda'
+
+        kwargs = {
+            'batch_size': config['batch_size'],
+            'shuffle': shuffle,
+            'num_workers': num_workers,
+            'pin_memory': pin_memory,
+            'drop_last': drop_last,
+        }
+        # persistent_workers / prefetch_factor 只在多进程加载时有效
+        if num_workers > 0:
+            kwargs['persistent_workers'] = config['persistent_workers'] if persistent is None else persistent
+            kwargs['prefetch_factor'] = config['prefetch_factor']
+        return DataLoader(dataset, **kwargs)
+
+    def autotune_num_workers(self, dataset, num_batches=None, candidates=None):
+        """
+        通过测量前N个batch的吞吐量自动选择工作进程数
+
+        参数:
+            dataset: 用于测量的数据集（一般为训练集）
+            num_batches: 每个候选测量的batch数
+            candidates: 候选工作进程数列表，None则按可用核数自动生成
+
+        返回:
+            吞吐量最高的工作进程数
+        """
+        if num_batches is None:
+            num_batches = self.loader_config['autotune_batches']
+        max_workers = available_cpu_count()
+        if candidates is None:
+            candidates = [0]
+            workers = 1
+            while workers <= max_workers:
+                candidates.append(workers)
+                workers *= 2
+
+        print(f"正在自动调优数据加载工作进程数（候选: {candidates}）...")
+        results = {}
+        for num_workers in candidates:
+            loader = self._build_loader(dataset, shuffle=True, num_workers=num_workers, persistent=False)
+            iterator = iter(loader)
+            try:
+                # 第一个batch包含进程启动开销，不计入吞吐量
+                next(iterator)
+            except StopIteration:
+                continue
+
+            samples = 0
+            start = time.perf_counter()
+            for _ in range(num_batches):
+                try:
+                    data, _ = next(iterator)
+                except StopIteration:
+                    break
+                samples += data.size(0)
+            elapsed = time.perf_counter() - start
+            del iterator, loader
+
+            if samples == 0:
+                continue
+            results[num_workers] = samples / max(elapsed, 1e-9)
+            print(f"  num_workers={num_workers}: {results[num_workers]:.1f} 样本/秒")
+
+        if not results:
+            return 0
+
+        # 吞吐量相差5%以内时选择更少的进程，避免无谓占用核
+        best_throughput = max(results.values())
+        best = min(w for w, t in results.items() if t >= best_throughput * 0.95)
+        self.loader_autotune_results = results
+        print(f"选择 num_workers={best}")
+        return best
+
     def generate_synthetic_data(self, num_samples=1000, image_size=(64, 64)):
         """生成合成无人机数据"""
         print("正在生成合成无人机数据...")
@@ -158,18 +414,38 @@ class DroneVisionExperiment:
         
         return np.array(images), np.array(labels), class_names
     
-    def prepare_data(self, images, labels, test_size=0.2, val_size=0.2):
-        """准备训练、验证和测试数据"""
+    @staticmethod
+    def split_indices(labels, test_size=0.2, val_size=0.2):
+        """
+        按标签分层划分训练/验证/测试集，只返回下标（与直接分割数组的结果相同）
+
+        返回:
+            (train_idx, val_idx, test_idx)
+        """
+        labels = np.asarray(labels)
+        temp_idx, test_idx = train_test_split(
+            np.arange(len(labels)), test_size=test_size, random_state=42, stratify=labels
+        )
+        train_idx, val_idx = train_test_split(
+            temp_idx, test_size=val_size/(1-test_size), random_state=42, stratify=labels[temp_idx]
+        )
+        return train_idx, val_idx, test_idx
+
+    def prepare_data(self, images, labels, test_size=0.2, val_size=0.2, splits=None):
+        """
+        准备训练、验证和测试数据
+
+        数据集按下标引用images/labels，不复制数组（超参数搜索中多个试验进程共享同一份共享内存数据）
+
+        参数:
+            splits: 可选，预先划分好的 (train_idx, val_idx, test_idx)，见split_indices
+        """
         print("正在准备数据集...")
         
         # 分割数据
-        X_temp, X_test, y_temp, y_test = train_test_split(
-            images, labels, test_size=test_size, random_state=42, stratify=labels
-        )
-        
-        X_train, X_val, y_train, y_val = train_test_split(
-            X_temp, y_temp, test_size=val_size/(1-test_size), random_state=42, stratify=y_temp
-        )
+        if splits is None:
+            splits = self.split_indices(labels, test_size, val_size)
+        train_idx, val_idx, test_idx = splits
         
         # 数据变换
         transform_train = transforms.Compose([
@@ -189,64 +465,196 @@ class DroneVisionExperiment:
         ])
         
         # 创建数据集
-        train_dataset = DroneDataset(X_train, y_train, transform_train)
-        val_dataset = DroneDataset(X_val, y_val, transform_val)
-        test_dataset = DroneDataset(X_test, y_test, transform_val)
+        train_dataset = DroneDataset(images, labels, transform_train, indices=train_idx)
+        val_dataset = DroneDataset(images, labels, transform_val, indices=val_idx)
+        test_dataset = DroneDataset(images, labels, transform_val, indices=test_idx)
         
         # 创建数据加载器
-        self.train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-        self.val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
-        self.test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False)
-        
+        if self.loader_config['num_workers'] == 'auto':
+            self.loader_config['num_workers'] = self.autotune_num_workers(train_dataset)
+
+        self.train_loader = self._build_loader(
+            train_dataset, shuffle=True, drop_last=self.loader_config['drop_last']
+        )
+        # 验证/测试集不丢弃样本，保证评估完整
+        self.val_loader = self._build_loader(val_dataset, shuffle=False)
+        self.test_loader = self._build_loader(test_dataset, shuffle=False)
+
         print(f"训练集大小: {len(train_dataset)}")
         print(f"验证集大小: {len(val_dataset)}")
         print(f"测试集大小: {len(test_dataset)}")
         
         return train_dataset, val_dataset, test_dataset
     
-    def train_model(self, num_epochs=10, learning_rate=0.001):
-        """训练模型"""
+    def _set_perf_modes(self, perf_modes):
+        """校验并设置CPU性能模式"""
+        if isinstance(perf_modes, str):
+            perf_modes = [perf_modes]
+        perf_modes = tuple(sorted(set(perf_modes or ())))
+        unknown = set(perf_modes) - set(PERF_MODES)
+        if unknown:
+            raise ValueError(f"未知的性能模式: {sorted(unknown)}，可选: {list(PERF_MODES)}")
+        self.perf_modes = perf_modes
+        return perf_modes
+
+    def _to_device(self, data, target):
+        """把batch搬到设备上，channels_last模式下同时转换内存格式"""
+        non_blocking = self.device.type == 'cuda'
+        data = data.to(self.device, non_blocking=non_blocking)
+        if 'channels_last' in self.perf_modes:
+            data = data.contiguous(memory_format=torch.channels_last)
+        return data, target.to(self.device, non_blocking=non_blocking)
+
+    def _autocast(self):
+        """bf16模式下返回autocast上下文，否则为空操作"""
+        return torch.autocast(self.device.type, dtype=torch.bfloat16,
+                              enabled='bf16' in self.perf_modes)
+
+    def _compile_model(self, model):
+        """
+        使用torch.compile编译模型，失败时回退到eager模式
+
+        torch.compile是惰性的，编译错误要到第一次前向/反向才会出现，
+        因此这里用一个验证batch分别预热推理图和训练图（前向+反向），出错则直接返回原模型。
+        训练图预热会更新BatchNorm统计量并产生梯度，预热后恢复原来的参数和缓冲区并清空梯度
+        """
+        if not hasattr(torch, 'compile'):
+            print("⚠️ 当前PyTorch版本不支持torch.compile，使用eager模式")
+            return model, False
+        state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+        try:
+            compiled = torch.compile(model)
+            data, target = next(iter(self.val_loader))
+            data, target = self._to_device(data, target)
+            model.eval()
+            with torch.no_grad(), self._autocast():
+                compiled(data)
+            model.train()
+            with self._autocast():
+                loss = nn.functional.cross_entropy(compiled(data), target)
+            loss.backward()
+            return compiled, True
+        except Exception as e:
+            print(f"⚠️ torch.compile失败，回退到eager模式: {e}")
+            return model, False
+        finally:
+            model.load_state_dict(state)
+            model.zero_grad(set_to_none=True)
+            model.train()
+
+    def train_model(self, num_epochs=10, learning_rate=0.001, perf_modes=None, batch_log_interval=1,
+                    run_name=None, extra_params=None, checkpoint_path=None):
+        """
+        训练模型
+
+        参数:
+            num_epochs: 训练轮数
+            learning_rate: 学习率
+            perf_modes: CPU性能模式列表，可选 'channels_last'、'bf16'、'compile'，
+                        None表示默认的fp32 eager模式
+            batch_log_interval: 每隔多少个batch记录一次batch级指标（loss、吞吐量），0表示不记录
+            run_name: MLflow run名称
+            extra_params: 额外记录到run中的参数（如超参数搜索的trial信息）
+            checkpoint_path: 可选，检查点路径。文件存在时从中恢复模型/优化器/学习率调度器状态和
+                             训练历史，继续训练到累计 num_epochs 轮；训练结束后把状态写回该路径
+                            （超参数搜索的后续轮次在上一轮的基础上继续训练）
+        """
         print("开始训练模型...")
+        perf_modes = self._set_perf_modes(perf_modes)
         
         # 创建模型
         self.model = DroneVisionCNN(num_classes=5).to(self.device)
+        if 'channels_last' in perf_modes:
+            self.model = self.model.to(memory_format=torch.channels_last)
         criterion = nn.CrossEntropyLoss()
         optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
         scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.1)
-        
-        # 训练历史
-        train_losses = []
-        val_losses = []
-        train_accuracies = []
-        val_accuracies = []
-        
-        with mlflow.start_run():
+
+        # 前向使用的模型（compile模式下为编译后的模型，参数与self.model共享）
+        self.runtime_model = self.model
+        compiled = False
+        if 'compile' in perf_modes:
+            self.runtime_model, compiled = self._compile_model(self.model)
+        
+        # 训练历史（从检查点恢复时接在已有历史之后）
+        start_epoch = 0
+        previous = {'train_losses': [], 'val_losses': [], 'train_accuracies': [], 'val_accuracies': []}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            checkpoint = torch.load(checkpoint_path, map_location=self.device)
+            self.model.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            scheduler.load_state_dict(checkpoint['scheduler'])
+            start_epoch = min(checkpoint['epoch'], num_epochs)
+            previous = checkpoint['history']
+            print(f"♻️ 从检查点继续训练: 已完成 {start_epoch} 个epoch")
+        train_losses = list(previous['train_losses'])
+        val_losses = list(previous['val_losses'])
+        train_accuracies = list(previous['train_accuracies'])
+        val_accuracies = list(previous['val_accuracies'])
+        train_time = 0.0
+        train_total = 0
+        
+        # 在基准测试等父run中运行时作为嵌套run记录
+        with mlflow.start_run(run_name=run_name, nested=mlflow.active_run() is not None) as run, \
+                AsyncMetricLogger(run.info.run_id) as logger:
             # 记录参数
-            mlflow.log_param("num_epochs", num_epochs)
-            mlflow.log_param("learning_rate", learning_rate)
-            mlflow.log_param("batch_size", 32)
-            mlflow.log_param("model_architecture", "CNN")
+            logger.log_params({
+                "num_epochs": num_epochs,
+                "learning_rate": learning_rate,
+                "batch_size": self.loader_config['batch_size'],
+                "model_architecture": "CNN",
+                "perf_modes": ",".join(perf_modes) or "eager_fp32",
+                "torch_compile_active": compiled,
+                "batch_log_interval": batch_log_interval,
+                "resumed_from_epoch": start_epoch
+            })
+            if extra_params:
+                logger.log_params(extra_params)
+
+            # 记录实际生效的数据加载器配置
+            for key in ('num_workers', 'persistent_workers', 'prefetch_factor', 'pin_memory', 'drop_last'):
+                logger.log_param(f"loader_{key}", getattr(self.train_loader, key))
+            for num_workers, throughput in self.loader_autotune_results.items():
+                logger.log_metric("loader_autotune_throughput", throughput, step=num_workers)
             
-            for epoch in range(num_epochs):
+            global_step = 0
+            for epoch in range(start_epoch, num_epochs):
                 # 训练阶段
                 self.model.train()
                 train_loss = 0.0
                 train_correct = 0
                 train_total = 0
+                epoch_start = time.perf_counter()
                 
+                batch_start = epoch_start
                 for batch_idx, (data, target) in enumerate(self.train_loader):
-                    data, target = data.to(self.device), target.to(self.device)
+                    data, target = self._to_device(data, target)
                     
                     optimizer.zero_grad()
-                    output = self.model(data)
-                    loss = criterion(output, target)
+                    with self._autocast():
+                        output = self.runtime_model(data)
+                        loss = criterion(output, target)
                     loss.backward()
                     optimizer.step()
                     
-                    train_loss += loss.item()
+                    batch_loss = loss.item()
+                    train_loss += batch_loss
                     _, predicted = torch.max(output.data, 1)
                     train_total += target.size(0)
                     train_correct += (predicted == target).sum().item()
+
+                    # batch级指标只追加到内存缓冲区，由后台线程批量写入
+                    if batch_log_interval and global_step % batch_log_interval == 0:
+                        now = time.perf_counter()
+                        logger.log_metrics({
+                            "batch_loss": batch_loss,
+                            "batch_samples_per_sec": target.size(0) / max(now - batch_start, 1e-9)
+                        }, step=global_step)
+                    batch_start = time.perf_counter()
+                    global_step += 1
+
+                epoch_time = time.perf_counter() - epoch_start
+                train_time += epoch_time
                 
                 # 验证阶段
                 self.model.eval()
@@ -256,9 +664,10 @@ class DroneVisionExperiment:
                 
                 with torch.no_grad():
                     for data, target in self.val_loader:
-                        data, target = data.to(self.device), target.to(self.device)
-                        output = self.model(data)
-                        loss = criterion(output, target)
+                        data, target = self._to_device(data, target)
+                        with self._autocast():
+                            output = self.runtime_model(data)
+                            loss = criterion(output, target)
                         
                         val_loss += loss.item()
                         _, predicted = torch.max(output.data, 1)
@@ -278,11 +687,15 @@ class DroneVisionExperiment:
                 print(f'  训练损失: {train_loss/len(self.train_loader):.4f}, 训练准确率: {train_acc:.2f}%')
                 print(f'  验证损失: {val_loss/len(self.val_loader):.4f}, 验证准确率: {val_acc:.2f}%')
                 
-                # 记录到MLflow
-                mlflow.log_metric("train_loss", train_loss/len(self.train_loader), step=epoch)
-                mlflow.log_metric("val_loss", val_loss/len(self.val_loader), step=epoch)
-                mlflow.log_metric("train_accuracy", train_acc, step=epoch)
-                mlflow.log_metric("val_accuracy", val_acc, step=epoch)
+                # 记录到MLflow（epoch结束时触发一次后台批量写入）
+                logger.log_metrics({
+                    "train_loss": train_loss/len(self.train_loader),
+                    "val_loss": val_loss/len(self.val_loader),
+                    "train_accuracy": train_acc,
+                    "val_accuracy": val_acc,
+                    "epoch_train_time": epoch_time
+                }, step=epoch)
+                logger.flush()
                 
                 scheduler.step()
             
@@ -290,11 +703,29 @@ class DroneVisionExperiment:
             test_accuracy, _, _ = self.evaluate_model()
             
             # 记录最终指标
-            mlflow.log_metric("final_test_accuracy", test_accuracy)
-            mlflow.log_metric("final_train_accuracy", train_accuracies[-1])
-            mlflow.log_metric("final_val_accuracy", val_accuracies[-1])
+            logger.log_metrics({
+                "final_test_accuracy": test_accuracy,
+                "final_train_accuracy": train_accuracies[-1],
+                "final_val_accuracy": val_accuracies[-1],
+                "train_time_sec": train_time,
+                "train_samples_per_sec": train_total * (num_epochs - start_epoch) / max(train_time, 1e-9)
+            })
+
+            if checkpoint_path:
+                torch.save({
+                    'model': self.model.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(),
+                    'epoch': num_epochs,
+                    'history': {
+                        'train_losses': train_losses,
+                        'val_losses': val_losses,
+                        'train_accuracies': train_accuracies,
+                        'val_accuracies': val_accuracies
+                    }
+                }, checkpoint_path)
             
-            # 保存模型
+            # 保存模型（始终保存eager模型，channels_last不影响加载）
             mlflow.pytorch.log_model(self.model, "model")
             
             # 保存训练历史
@@ -302,16 +733,78 @@ class DroneVisionExperiment:
                 'train_losses': train_losses,
                 'val_losses': val_losses,
                 'train_accuracies': train_accuracies,
-                'val_accuracies': val_accuracies
+                'val_accuracies': val_accuracies,
+                'train_time': train_time
             }
             
             return history, test_accuracy
+
+    def benchmark_perf_modes(self, num_epochs=3, learning_rate=0.001, mode_sets=None, seed=42):
+        """
+        对比不同CPU性能模式的训练速度和精度
+
+        每种模式组合都用相同的随机种子从头训练一次，以fp32 eager模式为基准，
+        计算加速比和测试准确率差值，记录到一个父run中（各模式为嵌套run）
+
+        参数:
+            num_epochs: 每种模式的训练轮数
+            learning_rate: 学习率
+            mode_sets: 要对比的模式组合列表，None则对比单项模式和全部开启
+            seed: 随机种子
+
+        返回:
+            {模式名: {'train_time', 'test_accuracy', 'speedup', 'accuracy_delta'}}
+        """
+        if mode_sets is None:
+            mode_sets = [()] + [(mode,) for mode in PERF_MODES] + [PERF_MODES]
+        # 基准模式必须在第一个；单个字符串视为只含一个模式（tuple('bf16')会拆成字符）
+        mode_sets = [(m,) if isinstance(m, str) else tuple(m) for m in mode_sets]
+        mode_sets = [()] + [m for m in mode_sets if m]
+
+        results = {}
+        with mlflow.start_run(run_name="perf_mode_benchmark") as run, \
+                AsyncMetricLogger(run.info.run_id) as logger:
+            logger.log_params({
+                "benchmark_num_epochs": num_epochs,
+                "benchmark_mode_sets": ";".join(",".join(m) or "eager_fp32" for m in mode_sets)
+            })
+
+            for modes in mode_sets:
+                name = "-".join(sorted(modes)) or "eager_fp32"
+                print(f"\n===== 性能模式: {name} =====")
+                torch.manual_seed(seed)
+                history, test_accuracy = self.train_model(num_epochs, learning_rate, perf_modes=modes)
+                results[name] = {
+                    'train_time': history['train_time'],
+                    'test_accuracy': test_accuracy
+                }
+
+            baseline = results['eager_fp32']
+            for name, result in results.items():
+                result['speedup'] = baseline['train_time'] / max(result['train_time'], 1e-9)
+                result['accuracy_delta'] = result['test_accuracy'] - baseline['test_accuracy']
+                logger.log_metrics({
+                    f"speedup_{name}": result['speedup'],
+                    f"accuracy_delta_{name}": result['accuracy_delta'],
+                    f"train_time_{name}": result['train_time']
+                })
+                print(f"{name}: 训练耗时 {result['train_time']:.2f}s, 加速比 {result['speedup']:.2f}x, "
+                      f"准确率变化 {result['accuracy_delta']:+.2f}%")
+
+        # 恢复默认模式，避免影响后续的evaluate_model调用：
+        # 除了模式标志，还要丢弃编译后的模型并把权重恢复为默认的连续内存格式
+        self._set_perf_modes(None)
+        if self.model is not None:
+            self.model = self.model.to(memory_format=torch.contiguous_format)
+        self.runtime_model = self.model
+        return results
     
     def evaluate_model(self):
         """评估模型"""
         print("正在评估模型...")
         
         self.model.eval()
+        model = self.runtime_model if self.runtime_model is not None else self.model
         correct = 0
         total = 0
         all_predictions = []
@@ -319,8 +812,9 @@ class DroneVisionExperiment:
         
         with torch.no_grad():
             for data, target in self.test_loader:
-                data, target = data.to(self.device), target.to(self.device)
-                output = self.model(data)
+                data, target = self._to_device(data, target)
+                with self._autocast():
+                    output = model(data)
                 _, predicted = torch.max(output.data, 1)
                 total += target.size(0)
                 correct += (predicted == target).sum().item()
@@ -384,8 +878,11 @@ def main():
     print("无人机视觉MLflow实验")
     print("=" * 50)
     
-    # 创建实验
-    experiment = DroneVisionExperiment("无人机视觉实验")
+    # 单进程训练：torch/OpenCV/BLAS的算子内线程占满全部核
+    apply_profile('training')
+    
+    # 创建实验（数据加载工作进程数按吞吐量自动调优）
+    experiment = DroneVisionExperiment("无人机视觉实验", loader_config={'num_workers': 'auto'})
     
     # 生成数据
     images, labels, class_names = experiment.generate_synthetic_data(num_samples=1000)
@@ -22,9 +22,6 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 if torch.cuda.is_available():
     # 优化GPU内存使用
     torch.backends.cudnn.benchmark = True
-else:
-    # CPU模式下的优化
-    torch.set_num_threads(4)  # 使用多线程加速
 
 # 推理时不需要梯度（节省内存）
 torch.set_grad_enabled(False)
@@ -87,6 +84,13 @@ os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 os.environ['DISPLAY'] = ''
 os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
 
+from agents.archive_builder import show_archive_download
+from thread_budget import apply_profile
+
+# CPU线程按预算划分（替代固定的 torch.set_num_threads(4)）
+if not torch.cuda.is_available():
+    apply_profile('web')
+
 try:
     # 直接导入，忽略所有错误和警告
     from agents.image_multi_angle_generator import ImageMultiAngleGenerator
@@ -366,6 +370,10 @@ if 'confidence_stats' not in st.session_state:
     st.session_state.confidence_stats = {}
 if 'enhancement_results' not in st.session_state:
     st.session_state.enhancement_results = None
+if 'generation_output_dir' not in st.session_state:
+    st.session_state.generation_output_dir = None
+if 'enhancement_output_dir' not in st.session_state:
+    st.session_state.enhancement_output_dir = None
 if 'original_image_quality' not in st.session_state:
     st.session_state.original_image_quality = None  # 存储原始图片的质量分析结果
 if 'last_uploaded_file' not in st.session_state:
@@ -543,6 +551,7 @@ if uploaded_file is not None:
                     progress_bar.progress(50)
                     status_text.text(f"✅ 已生成 {result['num_generated']} 张素材")
                     st.session_state.generated_images = result['generated_files']
+                    st.session_state.generation_output_dir = str(output_dir)
                     st.session_state.confidence_stats = result.get('confidence_statistics', {})
 
                     if auto_analyze:
@@ -558,24 +567,6 @@ if uploaded_file is not None:
                         status_text.text("✅ 生成完成！")
 
                     st.success(f"✅ 成功生成 {result['num_generated']} 张多角度素材！")
-
-                    # 提供下载功能
-                    st.markdown("### 📥 下载生成的素材")
-                    import zipfile
-                    import io
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for img_path in result['generated_files']:
-                            if Path(img_path).exists():
-                                zip_file.write(img_path, Path(img_path).name)
-                    zip_buffer.seek(0)
-                    st.download_button(
-                        label="📥 下载所有生成的素材（ZIP）",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"generated_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                        mime="application/zip",
-                        use_container_width=True
-                    )
                     
                     # 清理内存
                     gc.collect()
@@ -590,6 +581,17 @@ if uploaded_file is not None:
         st.subheader("🎨 生成的多角度素材（带检测框）")
         num_cols = 4
         images = st.session_state.generated_images
+        
+        # 提供下载功能（点击准备下载后才打包）
+        if st.session_state.generation_output_dir:
+            st.markdown("### 📥 下载生成的素材")
+            show_archive_download(
+                st.session_state.generation_output_dir, images,
+                label="📥 下载所有生成的素材（ZIP）",
+                file_name=f"generated_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                key="generation_archive"
+            )
+        
         for i in range(0, len(images), num_cols):
             cols = st.columns(num_cols)
             for j, col in enumerate(cols):
@@ -716,6 +718,7 @@ if uploaded_file is not None:
                             )
 
                             st.session_state.enhancement_results = enhancement_result
+                            st.session_state.enhancement_output_dir = str(enhancement_dir)
                             progress_bar.progress(100)
                             status_text.text("✅ 增强训练完成！")
 
@@ -725,31 +728,6 @@ if uploaded_file is not None:
                             st.info(f"📈 平均提升幅度: {enhancement_result.get('average_improvement', 0):.2f}分")
                             st.info(f"⭐ 优秀({enhancement_result.get('excellent_count', 0)}) | 良好({enhancement_result.get('good_count', 0)}) | 一般({enhancement_result.get('fair_count', 0)}) | 较差({enhancement_result.get('poor_count', 0)})")
 
-                            # 提供增强素材下载功能
-                            st.markdown("### 📥 下载增强后的素材")
-                            import zipfile
-                            import io
-                            zip_buffer = io.BytesIO()
-                            enhanced_files = []
-                            for result_item in enhancement_result.get('results', []):
-                                if result_item.get('success', False) and 'final_image_path' in result_item:
-                                    enhanced_path = result_item['final_image_path']
-                                    if Path(enhanced_path).exists():
-                                        enhanced_files.append(enhanced_path)
-
-                            if enhanced_files:
-                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                    for img_path in enhanced_files:
-                                        zip_file.write(img_path, Path(img_path).name)
-                                zip_buffer.seek(0)
-                                st.download_button(
-                                    label="📥 下载所有增强素材（ZIP）",
-                                    data=zip_buffer.getvalue(),
-                                    file_name=f"enhanced_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                                    mime="application/zip",
-                                    use_container_width=True
-                                )
-                            
                             # 清理内存
                             gc.collect()
                         except Exception as e:
@@ -757,6 +735,21 @@ if uploaded_file is not None:
                             import traceback
                             st.code(traceback.format_exc())
 
+            # 提供增强素材下载功能（点击准备下载后才打包）
+            if st.session_state.enhancement_results and st.session_state.enhancement_output_dir:
+                st.markdown("### 📥 下载增强后的素材")
+                enhanced_files = [
+                    result_item['final_image_path']
+                    for result_item in st.session_state.enhancement_results.get('results', [])
+                    if result_item.get('success', False) and 'final_image_path' in result_item
+                ]
+                show_archive_download(
+                    st.session_state.enhancement_output_dir, enhanced_files,
+                    label="📥 下载所有增强素材（ZIP）",
+                    file_name=f"enhanced_materials_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                    key="enhancement_archive"
+                )
+
             # 数据表现分析
             st.markdown("#### 🔍 数据表现客观分析")
             low_score_dims = [dim for dim, score in avg_scores.items() if score < 60 and dim != "场景复杂度"]
@@ -0,0 +1,195 @@
+"""
+MLflow运行记录增量索引
+MLflow Run Index
+
+把所有实验的run缓存到本地SQLite快照中，每次同步只拉取
+end_time晚于上次同步水位的run（以及仍在运行中的run），
+search_runs按max_results分页，结果以pandas DataFrame提供
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import mlflow
+from mlflow.tracking import MlflowClient
+
+
+RUN_COLUMNS = ['experiment_id', 'experiment_name', 'run_id', 'status',
+               'start_time', 'end_time', 'metrics', 'params']
+
+
+class MLflowRunIndex:
+    """带本地SQLite快照的MLflow run索引"""
+
+    def __init__(self, snapshot_path="mlflow_run_index.sqlite", client=None,
+                 page_size=500, min_sync_interval=10.0):
+        """
+        参数:
+            snapshot_path: 本地SQLite快照路径
+            client: MlflowClient实例，None则新建
+            page_size: 每页search_runs的max_results
+            min_sync_interval: 两次同步之间的最小间隔（秒），间隔内直接返回缓存
+        """
+        self.snapshot_path = snapshot_path
+        self.client = client or MlflowClient()
+        self.page_size = page_size
+        self.min_sync_interval = min_sync_interval
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._frame = None
+        self._init_snapshot()
+
+    def _connect(self):
+        return sqlite3.connect(self.snapshot_path)
+
+    def _init_snapshot(self):
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tracking_uri = getattr(self.client, 'tracking_uri', None) or mlflow.get_tracking_uri()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    experiment_id TEXT,
+                    experiment_name TEXT,
+                    status TEXT,
+                    start_time INTEGER,
+                    end_time INTEGER,
+                    metrics TEXT,
+                    params TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    experiment_id TEXT PRIMARY KEY,
+                    last_end_time INTEGER
+                )""")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # 快照属于某一个tracking URI，切换后需要重建
+            row = conn.execute("SELECT value FROM meta WHERE key = 'tracking_uri'").fetchone()
+            if row is not None and row[0] != tracking_uri:
+                conn.execute("DELETE FROM runs")
+                conn.execute("DELETE FROM sync_state")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tracking_uri', ?)",
+                         (tracking_uri,))
+
+    def _search_all(self, experiment_id, filter_string):
+        """分页拉取满足条件的全部run"""
+        page_token = None
+        while True:
+            page = self.client.search_runs(
+                [experiment_id],
+                filter_string=filter_string,
+                max_results=self.page_size,
+                order_by=["attributes.end_time ASC"],
+                page_token=page_token
+            )
+            yield from page
+            page_token = page.token
+            if not page_token:
+                break
+
+    def sync(self, force=False):
+        """
+        增量同步快照
+
+        参数:
+            force: 忽略min_sync_interval立即同步
+
+        返回:
+            本次新增或更新的run数量
+        """
+        with self._lock:
+            if not force and time.time() - self._last_sync < self.min_sync_interval:
+                return 0
+
+            with self._connect() as conn:
+                watermarks = dict(conn.execute("SELECT experiment_id, last_end_time FROM sync_state"))
+                # 上次同步时仍在运行的run，需要再次拉取以获取最终状态
+                running = {}
+                for run_id, experiment_id in conn.execute(
+                        "SELECT run_id, experiment_id FROM runs WHERE end_time IS NULL"):
+                    running.setdefault(experiment_id, []).append(run_id)
+
+                updated = 0
+                for exp in self.client.search_experiments():
+                    last_end_time = watermarks.get(exp.experiment_id)
+                    # 用>=避免同一毫秒结束的run被漏掉，重复的run会被覆盖写入
+                    filters = [f"attributes.end_time >= {last_end_time}" if last_end_time else "",
+                               "attributes.status = 'RUNNING'"]
+                    runs = {}
+                    for filter_string in filters:
+                        for run in self._search_all(exp.experiment_id, filter_string):
+                            runs[run.info.run_id] = run
+                    # 之前在运行、但现在既没有end_time更新也不在运行的run（例如被删除）
+                    for run_id in running.get(exp.experiment_id, []):
+                        if run_id not in runs:
+                            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+                            updated += 1
+
+                    # 水位上的run每次都会被重复拉到，只写入状态或结束时间有变化的run；
+                    # 运行中的run指标还在变化，总是写入
+                    known = {run_id: (status, end_time) for run_id, status, end_time in conn.execute(
+                        "SELECT run_id, status, end_time FROM runs WHERE experiment_id = ? "
+                        "AND (end_time IS NULL OR end_time >= ?)", (exp.experiment_id, last_end_time or 0))}
+                    rows = [(
+                        run.info.run_id,
+                        exp.experiment_id,
+                        exp.name,
+                        run.info.status,
+                        run.info.start_time,
+                        run.info.end_time,
+                        json.dumps(run.data.metrics),
+                        json.dumps(run.data.params, ensure_ascii=False)
+                    ) for run in runs.values()
+                        if run.info.status == 'RUNNING'
+                        or known.get(run.info.run_id) != (run.info.status, run.info.end_time)]
+                    if rows:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                        updated += len(rows)
+
+                    end_times = [run.info.end_time for run in runs.values() if run.info.end_time]
+                    if end_times:
+                        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                                     (exp.experiment_id, max(end_times + [last_end_time or 0])))
+
+            self._last_sync = time.time()
+            if updated:
+                self._frame = None
+            return updated
+
+    def rebuild(self):
+        """清空快照并全量重新同步（用于清理已删除的run）"""
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM runs")
+                conn.execute("DELETE FROM sync_state")
+            self._frame = None
+        return self.sync(force=True)
+
+    def to_dataframe(self, sync=True):
+        """
+        以DataFrame返回所有run
+
+        参数:
+            sync: 返回前是否先增量同步
+
+        返回:
+            列为 RUN_COLUMNS 的DataFrame，metrics/params列为字典，按start_time倒序
+        """
+        if sync:
+            self.sync()
+        with self._lock:
+            if self._frame is None:
+                with self._connect() as conn:
+                    frame = pd.read_sql_query(
+                        f"SELECT {', '.join(RUN_COLUMNS)} FROM runs ORDER BY start_time DESC", conn)
+                frame['metrics'] = frame['metrics'].map(json.loads)
+                frame['params'] = frame['params'].map(json.loads)
+                self._frame = frame
+            return self._frame.copy()
@@ -17,9 +17,11 @@ def load_model():
 BATCH_SIZE = 1  # 减少批处理大小，降低内存占用
 
 # 3. 使用CPU优化（如果没有GPU）
+# 不要全局 torch.set_num_threads(1)：按入口预设划分 worker 数和算子内线程数
 import torch
+from thread_budget import apply_profile
 if not torch.cuda.is_available():
-    torch.set_num_threads(1)  # 限制CPU线程数，避免过载
+    apply_profile('web')
 
 # 4. 及时释放内存
 import gc
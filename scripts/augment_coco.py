@@ -0,0 +1,55 @@
+"""
+COCO数据集几何增强脚本：按视角变换扩充带标注的数据集，标注随图片一起变换，不需要推理
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(project_root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保留标注的COCO数据集几何增强")
+    parser.add_argument('coco_json', type=str, help='输入COCO JSON（如 labelme_to_coco.py 的输出）')
+    parser.add_argument('--output-dir', type=str, required=True, help='输出目录')
+    parser.add_argument('--image-root', type=str, default=None,
+                        help='图片根目录（默认为COCO JSON所在目录）')
+    parser.add_argument('--copies', type=int, default=10, help='每张图片的增强副本数')
+    parser.add_argument('--transform', action='append', default=None,
+                        help='候选视角变换（可多次指定，默认全部线性视角变换）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数')
+    parser.add_argument('--shard-size', type=int, default=32, help='每个分片的源图片数')
+    parser.add_argument('--min-box-size', type=float, default=2.0,
+                        help='裁剪后宽或高小于该值（像素）的标注被丢弃')
+    parser.add_argument('--keep-empty', action='store_true',
+                        help='保留标注全部被丢弃的副本')
+    args = parser.parse_args()
+
+    coco_json = Path(args.coco_json)
+    if not coco_json.exists():
+        print(f"❌ COCO JSON不存在: {coco_json}")
+        sys.exit(1)
+
+    # 解析参数后再导入（会拉起OpenCV），--help 等可以立即返回
+    from agents.coco_augment import augment_coco_dataset
+
+    augment_coco_dataset(
+        coco_json,
+        args.output_dir,
+        image_root=args.image_root,
+        copies=args.copies,
+        transformations=args.transform,
+        seed=args.seed,
+        workers=args.workers,
+        shard_size=args.shard_size,
+        min_box_size=args.min_box_size,
+        drop_empty=not args.keep_empty
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,10 @@ import sys
 project_root = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(project_root))
 
-from agents.material_generator_agent import MaterialGeneratorAgent
+from thread_budget import apply_profile
+
+# 在源目录清单中记录处理状态时使用的名称
+MANIFEST_CONSUMER = 'batch_analyze'
 
 
 def main():
@@ -21,8 +24,8 @@ def main():
     parser.add_argument(
         "--input-dir",
         type=str,
-        required=True,
-        help="输入图片目录"
+        default=None,
+        help="输入图片目录（使用已有清单时可以省略）"
     )
     parser.add_argument(
         "--output-dir",
@@ -42,20 +45,54 @@ def main():
         default=None,
         help="YOLO模型路径 (可选)"
     )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="源目录清单SQLite路径（不存在时新建）：增量扫描代替全量遍历，只分析新增或变化的图片"
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="使用清单时分析清单中的全部图片，而不只是新增或变化的图片"
+    )
+    parser.add_argument(
+        "--full-scan",
+        action="store_true",
+        help="使用清单时重新列出所有目录，发现就地改写的文件（默认只列出有变化的目录）"
+    )
     
     args = parser.parse_args()
+    if args.input_dir is None and args.manifest is None:
+        parser.error("需要 --input-dir 或 --manifest")
+    
+    # 串行批处理：单worker，算子内线程占满全部核（必须在导入torch/cv2之前设置）
+    apply_profile('batch', workers=1)
+    
+    # 解析参数后再导入agents（会拉起torch/ultralytics），--help 等可以立即返回
+    from agents.material_generator_agent import MaterialGeneratorAgent
     
     # 创建输出目录
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
     # 获取所有图片
-    input_dir = Path(args.input_dir)
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
-    image_paths = [
-        str(p) for p in input_dir.rglob('*')
-        if p.suffix.lower() in image_extensions
-    ]
+    manifest = None
+    if args.manifest:
+        from agents.source_manifest import open_manifest
+        manifest = open_manifest(args.manifest, root=args.input_dir, full_scan=args.full_scan)
+        input_dir = Path(manifest.root)
+        image_paths = manifest.paths() if args.all else manifest.pending(MANIFEST_CONSUMER)
+        if not image_paths and len(manifest):
+            print(f"✅ {input_dir} 中没有新增或变化的图片")
+            return
+    else:
+        input_dir = Path(args.input_dir)
+        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
+        image_paths = [
+            str(p) for p in input_dir.rglob('*')
+            if p.suffix.lower() in image_extensions
+        ]
     
     if not image_paths:
         print(f"❌ 在 {input_dir} 中未找到图片文件")
@@ -69,6 +106,9 @@ def main():
     
     # 执行分析
     result = agent.analyze_and_evaluate(image_paths)
+    if manifest is not None:
+        # 分析失败的图片不记录，下次仍会处理
+        manifest.mark_processed(MANIFEST_CONSUMER, [q['image_path'] for q in result['quality_evaluation']])
     
     # 保存完整结果
     result_file = output_dir / f"analysis_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
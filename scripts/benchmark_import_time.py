@@ -0,0 +1,90 @@
+"""
+agents包冷启动导入耗时基准
+Import-Time Benchmark for the agents Package
+
+在全新的解释器中用 `python -X importtime` 导入模块，读取其累计导入耗时；
+超过预算或拉起了重量级依赖（torch/ultralytics/cv2/pandas）时以非零状态退出，
+可以直接放进CI或部署前检查
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[1]
+
+# 冷启动时不应被导入的重量级依赖
+HEAVY_MODULES = ('torch', 'ultralytics', 'cv2', 'pandas')
+
+
+def measure_import(module: str, python: str = sys.executable) -> dict:
+    """
+    在子进程中冷启动导入模块并解析 -X importtime 输出
+
+    参数:
+        module: 要导入的模块名
+        python: Python解释器路径
+
+    返回:
+        {'module', 'cumulative_ms', 'heavy_modules'}
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(project_root), env.get('PYTHONPATH')]))
+    proc = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=str(project_root), env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    cumulative_us = None
+    imported = set()
+    # 格式: "import time: self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(parts[1])
+
+    return {
+        'module': module,
+        'cumulative_ms': (cumulative_us or 0) / 1000.0,
+        'heavy_modules': sorted(m for m in HEAVY_MODULES if m in imported)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查agents包的冷启动导入耗时")
+    parser.add_argument('--module', action='append', default=None,
+                        help='要检查的模块（可多次指定，默认 agents 及轻量子模块）')
+    parser.add_argument('--budget-ms', type=float, default=150.0,
+                        help='每个模块的累计导入耗时预算（毫秒）')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='重复测量次数，取最小值以减少抖动')
+    args = parser.parse_args()
+
+    modules = args.module or ['agents', 'agents.model_pool', 'agents.job_queue']
+    failed = False
+    for module in modules:
+        runs = [measure_import(module) for _ in range(max(1, args.repeat))]
+        best = min(runs, key=lambda r: r['cumulative_ms'])
+        over_budget = best['cumulative_ms'] > args.budget_ms
+        status = "❌" if over_budget or best['heavy_modules'] else "✅"
+        print(f"{status} {module}: {best['cumulative_ms']:.1f} ms (预算 {args.budget_ms:.0f} ms)")
+        if best['heavy_modules']:
+            print(f"   拉起了重量级依赖: {', '.join(best['heavy_modules'])}")
+        failed = failed or over_budget or bool(best['heavy_modules'])
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+线程预算吞吐量基准
+Thread Budget Throughput Benchmark
+
+用接近真实分析/增强的工作负载（OpenCV透视变换+滤波 + torch卷积），
+测量不同划分（进程池worker数 × 每个worker的算子内线程数）下的吞吐量曲线，
+包括一个"每个worker都用满全部核"的超订对照组，用来为各入口选择预设
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(project_root))
+
+from thread_budget import available_cpu_count, init_worker
+
+
+def _process_image(args):
+    """单张图片的工作负载：透视变换、滤波、清晰度统计和一个小卷积网络前向"""
+    seed, height, width = args
+    import numpy as np
+    import torch
+    from agents.image_backend import get_cv2
+
+    cv2 = get_cv2()
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+    src = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    dst = src + rng.uniform(-0.1, 0.1, size=(4, 2)).astype(np.float32) * [width, height]
+    M = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+    warped = cv2.warpPerspective(img, M, (width, height))
+    blurred = cv2.GaussianBlur(warped, (7, 7), 0)
+    sharpness = cv2.Laplacian(cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var()
+
+    with torch.inference_mode():
+        x = torch.from_numpy(blurred).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+        for out_channels in (16, 32, 64):
+            weight = torch.ones(out_channels, x.shape[1], 3, 3) / (9 * x.shape[1])
+            x = torch.relu(torch.nn.functional.conv2d(x, weight, stride=2, padding=1))
+        feature = float(x.mean())
+    return sharpness + feature
+
+
+def candidate_splits(cpus: int):
+    """不超订的划分（worker × 线程 <= 核数）加一个超订对照组"""
+    splits = []
+    for workers in range(1, cpus + 1):
+        threads = cpus // workers
+        if threads >= 1 and (workers, threads) not in splits:
+            splits.append((workers, threads))
+    if cpus > 1:
+        splits.append((cpus, cpus))
+    return splits
+
+
+def measure_split(workers: int, threads: int, num_images: int, height: int, width: int) -> dict:
+    """测量一种划分的吞吐量（张/秒），预热每个worker后计时"""
+    tasks = [(seed, height, width) for seed in range(num_images)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(threads,)
+    ) as pool:
+        # 预热：导入torch/cv2并初始化线程池，不计入吞吐量
+        list(pool.map(_process_image, [(0, 64, 64)] * workers))
+        start = time.perf_counter()
+        list(pool.map(_process_image, tasks))
+        elapsed = time.perf_counter() - start
+    return {
+        'workers': workers,
+        'intra_op_threads': threads,
+        'oversubscribed': workers * threads > available_cpu_count(),
+        'images_per_sec': num_images / max(elapsed, 1e-9),
+        'elapsed_sec': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量不同线程预算划分下的吞吐量")
+    parser.add_argument('--num-images', type=int, default=48, help='每种划分处理的图片数')
+    parser.add_argument('--height', type=int, default=1080, help='测试图片高度')
+    parser.add_argument('--width', type=int, default=1920, help='测试图片宽度')
+    parser.add_argument('--split', action='append', default=None,
+                        help='只测指定划分，格式 worker数x线程数，例如 4x2（可多次指定）')
+    parser.add_argument('--output', type=str, default=None, help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    cpus = available_cpu_count()
+    if args.split:
+        splits = [tuple(int(v) for v in s.lower().split('x')) for s in args.split]
+    else:
+        splits = candidate_splits(cpus)
+
+    print(f"🧵 可用核数: {cpus}，每种划分处理 {args.num_images} 张 {args.width}x{args.height} 图片")
+    print(f"{'worker':>8} {'线程':>6} {'张/秒':>10}")
+    results = []
+    for workers, threads in splits:
+        result = measure_split(workers, threads, args.num_images, args.height, args.width)
+        results.append(result)
+        note = "  (超订)" if result['oversubscribed'] else ""
+        print(f"{workers:>8} {threads:>6} {result['images_per_sec']:>10.2f}{note}")
+
+    best = max(results, key=lambda r: r['images_per_sec'])
+    print(f"\n✅ 最佳划分: {best['workers']} worker × {best['intra_op_threads']} 线程 "
+          f"({best['images_per_sec']:.2f} 张/秒)")
+    print(f"   批处理可设置 THREAD_WORKERS={best['workers']} THREAD_INTRA_OP={best['intra_op_threads']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'cpus': cpus, 'results': results, 'best': best}, f, ensure_ascii=False, indent=2)
+        print(f"📄 结果已保存: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
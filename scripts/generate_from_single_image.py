@@ -11,10 +11,6 @@ import sys
 project_root = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(project_root))
 
-from agents.image_multi_angle_generator import ImageMultiAngleGenerator
-from agents.image_quality_analyzer import ImageQualityAnalyzer
-from agents.material_generator_agent import MaterialGeneratorAgent
-
 
 def main():
     parser = argparse.ArgumentParser(description="从单张图片生成多角度素材并分析")
@@ -23,8 +19,26 @@ def main():
     parser.add_argument("--num-generations", type=int, default=8, help="生成图片数量")
     parser.add_argument("--analyze", action="store_true", help="生成后自动分析")
     parser.add_argument("--yolo-model", type=str, default=None, help="YOLO模型路径（可选）")
+    parser.add_argument("--export-labels", type=str, choices=["coco", "yolo"], default=None,
+                        help="生成后直接导出标注（COCO JSON 或 YOLO txt）")
+    parser.add_argument("--label-conf", type=float, default=0.25, help="伪标签置信度阈值")
+    parser.add_argument("--ground-truth", type=str, default=None,
+                        help="原图的真值标注（LabelMe/COCO JSON 或 YOLO txt），默认查找原图旁边的同名文件")
+    parser.add_argument("--format", type=str, choices=["jpeg", "webp", "png"], default="jpeg", help="输出图片格式")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP质量（WebP超过100为无损）")
+    parser.add_argument("--optimize", action="store_true", help="JPEG优化哈夫曼表")
+    parser.add_argument("--progressive", action="store_true", help="JPEG渐进式编码")
+    parser.add_argument("--chroma", type=str, choices=["444", "422", "420"], default=None, help="JPEG色度抽样")
+    parser.add_argument("--tiled", action="store_true", default=None,
+                        help="强制使用分块模式（默认按图片像素数自动选择）")
     args = parser.parse_args()
 
+    # 解析参数后再导入agents（会拉起torch/ultralytics），--help 等可以立即返回
+    from agents.image_multi_angle_generator import ImageMultiAngleGenerator
+    from agents.image_quality_analyzer import ImageQualityAnalyzer
+    from agents.material_generator_agent import MaterialGeneratorAgent
+    from agents.output_writer import EncodeOptions
+
     input_path = Path(args.input_image)
     if not input_path.exists():
         print(f"❌ 输入图片不存在: {args.input_image}")
@@ -39,16 +53,24 @@ def main():
     print("=" * 60)
 
     print("\n步骤1: 生成多角度图片...")
-    generator = ImageMultiAngleGenerator()
+    generator = ImageMultiAngleGenerator(yolo_model_path=args.yolo_model)
     try:
         result = generator.generate_multi_angle_images(
             input_image_path=str(input_path),
             output_dir=args.output_dir,
-            num_generations=args.num_generations
+            num_generations=args.num_generations,
+            export_format=args.export_labels,
+            label_conf_threshold=args.label_conf,
+            ground_truth=args.ground_truth,
+            tiled=args.tiled,
+            encode_options=EncodeOptions(args.format, quality=args.quality, optimize=args.optimize,
+                                         progressive=args.progressive, chroma_subsampling=args.chroma)
         )
         if result['success']:
             print(f"✅ 成功生成 {result['num_generated']} 张图片")
             print(f"输出目录: {result['output_dir']}")
+            if result.get('labels'):
+                print(f"标注文件: {result['labels']['labels_path']}")
         else:
             print("❌ 生成失败")
             return
@@ -12,7 +12,7 @@ import sys
 project_root = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(project_root))
 
-from agents.material_batch_generator import MaterialBatchGenerator
+from thread_budget import apply_profile
 
 
 def main():
@@ -55,6 +55,12 @@ def main():
     
     args = parser.parse_args()
     
+    # 串行批处理：单worker，算子内线程占满全部核（必须在导入torch/cv2之前设置）
+    apply_profile('batch', workers=1)
+    
+    # 解析参数后再导入agents（会拉起torch/ultralytics），--help 等可以立即返回
+    from agents.material_batch_generator import MaterialBatchGenerator
+    
     # 检查源目录
     source_path = Path(args.source_dir)
     if not source_path.exists():
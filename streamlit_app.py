@@ -22,6 +22,7 @@ import sys
 
 # 导入主程序模块
 from main import DroneVisionExperiment, DroneVisionCNN
+from mlflow_run_index import MLflowRunIndex, RUN_COLUMNS
 
 # 设置页面配置
 st.set_page_config(
@@ -35,31 +36,23 @@ st.set_page_config(
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei']
 plt.rcParams['axes.unicode_minus'] = False
 
+@st.cache_resource
+def get_run_index():
+    """进程内共享的MLflow run索引（本地SQLite快照，增量同步）"""
+    return MLflowRunIndex()
+
 def load_mlflow_data():
-    """加载MLflow实验数据"""
+    """
+    加载MLflow实验数据
+
+    返回:
+        DataFrame，每行一个run，metrics/params列为字典
+    """
     try:
-        client = MlflowClient()
-        experiments = client.search_experiments()
-        
-        experiment_data = []
-        for exp in experiments:
-            runs = client.search_runs([exp.experiment_id])
-            for run in runs:
-                experiment_data.append({
-                    'experiment_id': exp.experiment_id,
-                    'experiment_name': exp.name,
-                    'run_id': run.info.run_id,
-                    'status': run.info.status,
-                    'start_time': run.info.start_time,
-                    'end_time': run.info.end_time,
-                    'metrics': run.data.metrics,
-                    'params': run.data.params
-                })
-        
-        return experiment_data
+        return get_run_index().to_dataframe()
     except Exception as e:
         st.error(f"加载MLflow数据时出错: {str(e)}")
-        return []
+        return pd.DataFrame(columns=RUN_COLUMNS)
 
 def create_metrics_plot(experiment_data):
     """创建指标图表"""
@@ -224,7 +217,9 @@ def main():
             with st.spinner("正在运行实验..."):
                 try:
                     # 创建实验
-                    experiment = DroneVisionExperiment("无人机视觉实验")
+                    experiment = DroneVisionExperiment(
+                        "无人机视觉实验", loader_config={'batch_size': batch_size}
+                    )
                     
                     # 生成数据
                     images, labels, class_names = experiment.generate_synthetic_data(num_samples)
@@ -273,16 +268,15 @@ def main():
         # 加载MLflow数据
         experiment_data = load_mlflow_data()
         
-        if experiment_data:
+        if not experiment_data.empty:
             st.subheader("实验概览")
             
             # 创建实验概览表格
-            df = pd.DataFrame(experiment_data)
-            st.dataframe(df[['experiment_name', 'status', 'start_time', 'end_time']].head(10))
+            st.dataframe(experiment_data[['experiment_name', 'status', 'start_time', 'end_time']].head(10))
             
             # 显示指标图表
             st.subheader("实验指标分析")
-            metrics_plot = create_metrics_plot(experiment_data)
+            metrics_plot = create_metrics_plot(experiment_data.to_dict('records'))
             if metrics_plot:
                 st.plotly_chart(metrics_plot, use_container_width=True)
             
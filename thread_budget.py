@@ -0,0 +1,168 @@
+"""
+CPU线程预算管理
+CPU Thread Budget
+
+在进程级并行（任务线程/进程池的worker数）和算子内并行（torch、OpenCV、BLAS线程）之间
+显式分配CPU核数，避免多个worker各自按全部核数开线程导致超订：
+
+    worker数 × 每个worker的算子内线程数 ≈ 可用核数
+
+各入口使用不同的预设：
+- web: Streamlit界面，任务线程共享同一进程的线程池，预留1个核给界面服务
+- batch: 批处理CLI/进程池，优先增加worker数（吞吐优先）
+- training: 单进程训练，算子内线程占满全部核
+
+环境变量 THREAD_WORKERS / THREAD_INTRA_OP 可覆盖预设计算出的值
+"""
+
+import os
+import sys
+from typing import Dict, Optional
+
+
+# 需要在numpy导入前设置才生效的BLAS/OpenMP线程数环境变量
+BLAS_ENV_VARS = (
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS',
+)
+
+PROFILES = ('web', 'batch', 'training')
+
+_applied = None
+
+
+def available_cpu_count():
+    """当前进程可用的CPU核数（考虑容器/taskset的亲和性限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ThreadBudget:
+    """一次线程预算划分：worker数和每个worker的算子内线程数"""
+
+    def __init__(self, profile: str, cpus: int, workers: int, intra_op_threads: int):
+        self.profile = profile
+        self.cpus = cpus
+        self.workers = workers
+        self.intra_op_threads = intra_op_threads
+
+    @classmethod
+    def for_profile(cls, profile: str, workers: Optional[int] = None,
+                    cpus: Optional[int] = None) -> 'ThreadBudget':
+        """
+        按入口预设计算线程预算
+
+        参数:
+            profile: 'web' / 'batch' / 'training'
+            workers: 进程级worker数（任务线程数或进程池大小），None则按预设
+            cpus: 可用核数，None则自动检测
+
+        返回:
+            ThreadBudget
+        """
+        if profile not in PROFILES:
+            raise ValueError(f"未知的线程预设: {profile}，可选: {', '.join(PROFILES)}")
+        cpus = cpus or available_cpu_count()
+        if os.environ.get('THREAD_WORKERS'):
+            workers = int(os.environ['THREAD_WORKERS'])
+
+        if profile == 'web':
+            # 预留1个核处理Streamlit的请求和渲染
+            usable = max(1, cpus - 1)
+            workers = workers or 1
+        elif profile == 'batch':
+            usable = cpus
+            workers = workers or cpus
+        else:
+            usable = cpus
+            workers = workers or 1
+        workers = max(1, workers)
+
+        intra_op = max(1, usable // workers)
+        if os.environ.get('THREAD_INTRA_OP'):
+            intra_op = max(1, int(os.environ['THREAD_INTRA_OP']))
+        return cls(profile, cpus, workers, intra_op)
+
+    def as_dict(self) -> Dict:
+        return {
+            'profile': self.profile,
+            'cpus': self.cpus,
+            'workers': self.workers,
+            'intra_op_threads': self.intra_op_threads,
+        }
+
+    def apply_env(self, override: bool = False):
+        """
+        设置BLAS/OpenMP/OpenCV线程数环境变量（对之后启动的子进程和尚未导入的库生效）
+
+        参数:
+            override: 是否覆盖用户已设置的环境变量
+        """
+        value = str(self.intra_op_threads)
+        for name in BLAS_ENV_VARS + ('CV2_NUM_THREADS',):
+            if override or not os.environ.get(name):
+                os.environ[name] = value
+
+    def apply_runtime(self):
+        """在当前进程中设置torch、OpenCV和BLAS（需安装threadpoolctl）的线程数"""
+        threads = self.intra_op_threads
+        # 只配置已导入的库，避免为了设置线程数而拉起torch/cv2
+        if 'torch' in sys.modules:
+            torch = sys.modules['torch']
+            torch.set_num_threads(threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                # 已有并行任务运行过时不能再设置，忽略即可
+                pass
+        if 'cv2' in sys.modules:
+            from agents.image_backend import set_cv2_threads
+            set_cv2_threads(threads)
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(limits=threads)
+        except ImportError:
+            pass
+
+    def __repr__(self):
+        return (f"ThreadBudget(profile={self.profile!r}, cpus={self.cpus}, "
+                f"workers={self.workers}, intra_op_threads={self.intra_op_threads})")
+
+
+def apply_profile(profile: str, workers: Optional[int] = None, verbose: bool = True) -> ThreadBudget:
+    """
+    计算并应用入口的线程预算（同一进程重复调用相同参数时不会重复设置）
+
+    参数:
+        profile: 'web' / 'batch' / 'training'
+        workers: 进程级worker数
+        verbose: 是否打印划分结果
+
+    返回:
+        ThreadBudget
+    """
+    global _applied
+    budget = ThreadBudget.for_profile(profile, workers)
+    if _applied is not None and _applied.as_dict() == budget.as_dict():
+        return _applied
+    budget.apply_env()
+    budget.apply_runtime()
+    _applied = budget
+    if verbose:
+        print(f"🧵 线程预算[{profile}]: {budget.cpus} 核 = {budget.workers} worker × "
+              f"{budget.intra_op_threads} 线程")
+    return budget
+
+
+def init_worker(intra_op_threads: int):
+    """
+    进程池worker的initializer：在子进程中按预算限制算子内线程数
+
+    用法: ProcessPoolExecutor(initializer=init_worker, initargs=(budget.intra_op_threads,))
+    """
+    budget = ThreadBudget('worker', available_cpu_count(), 1, intra_op_threads)
+    # torch/cv2在子进程中尚未导入时，导入时会读取这些环境变量
+    budget.apply_env(override=True)
+    budget.apply_runtime()